@@ -0,0 +1,197 @@
+"""
+In-process stand-ins for the clients of the consumer.
+
+The fakes implement the parts of `ADLSClient`, `KafkaConsumer` and
+`MySQLClient` that the consumer uses, keep everything in memory and count
+their calls. An optional `latency` in seconds is slept on every round trip to
+emulate the network.
+"""
+
+import threading
+import time
+from collections import Counter, deque
+
+
+class FakeADLSClient:
+    """Blob store in a dict keyed by (container, file name)."""
+
+    def __init__(
+        self, storage_account_name=None, storage_account_key=None, latency=0.0
+    ):
+        self.latency = latency
+        self.blobs = {}
+        self.calls = Counter()
+        self._lock = threading.Lock()
+
+    def upload_bytes(self, container_name, file_name, data):
+        self._round_trip("upload_bytes")
+        with self._lock:
+            self.blobs[(container_name, file_name)] = bytes(data)
+
+    def download_bytes(self, container_name, file_name):
+        self._round_trip("download_bytes")
+        try:
+            return self.blobs[(container_name, file_name)]
+        except KeyError:
+            raise FileNotFoundError(f"{container_name}/{file_name}")
+
+    def _round_trip(self, name):
+        with self._lock:
+            self.calls[name] += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+
+class FakeKafkaConsumer:
+    """
+    Topic of a single partition held in a list. Messages are appended with
+    `produce` and consumed in order; `commit` and `rewind` track the committed
+    offset like the real consumer.
+    """
+
+    def __init__(
+        self,
+        broker=None,
+        group_id=None,
+        topic=None,
+        enable_auto_commit=True,
+        decode_values=True,
+        max_poll=500,
+    ):
+        self.decode_values = decode_values
+        self.max_poll = max_poll
+        self.closed = False
+        self._log = []
+        self._position = 0
+        self._committed = 0
+        self._lock = threading.Lock()
+        self._available = threading.Condition(self._lock)
+
+    def produce(self, messages):
+        with self._lock:
+            self._log.extend(messages)
+            self._available.notify_all()
+
+    def __len__(self):
+        """Number of messages not consumed yet."""
+        return len(self._log) - self._position
+
+    def consume_messages(self, timeout=1.0):
+        with self._lock:
+            if self._position == len(self._log):
+                self._available.wait(timeout)
+            return self._take(self.max_poll)
+
+    def consume_batch(self, max_messages=500, max_wait_ms=1000):
+        deadline = time.monotonic() + max_wait_ms / 1000
+        messages = []
+        with self._lock:
+            while len(messages) < max_messages:
+                messages += self._take(max_messages - len(messages))
+                remaining = deadline - time.monotonic()
+                if len(messages) == max_messages or remaining <= 0:
+                    break
+                self._available.wait(remaining)
+        return messages
+
+    def commit(self):
+        with self._lock:
+            self._committed = self._position
+
+    def rewind(self):
+        with self._lock:
+            self._position = self._committed
+
+    def close(self):
+        self.closed = True
+
+    def _take(self, n):
+        messages = self._log[self._position : self._position + n]
+        self._position += len(messages)
+        if self.decode_values:
+            messages = [
+                m.decode("utf-8") if isinstance(m, bytes) else m for m in messages
+            ]
+        return messages
+
+
+class FakeMySQLClient:
+    """
+    Accepts every statement and keeps the rows of the tables the consumer
+    writes: forecasts by location, observations by (location, timeslot) and
+    the forecast version with the version each location changed in. Reads
+    return the rows registered for a query with `add_result`, the forecast
+    version, or none.
+    """
+
+    def __init__(
+        self, host=None, user=None, password=None, database=None, latency=0.0, **kwargs
+    ):
+        self.latency = latency
+        self.forecasts = {}
+        self.observations = {}
+        self.version = 0
+        self.changes = {}
+        self.results = {}
+        self.calls = Counter()
+        self.statements = deque(maxlen=100)
+        self._lock = threading.Lock()
+
+    def add_result(self, query, rows):
+        self.results[query] = rows
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+    def connect(self):
+        pass
+
+    def disconnect(self):
+        pass
+
+    def read(self, query, params=None):
+        self._round_trip("read", query)
+        if query not in self.results and "FROM forecast_version" in query:
+            return [{"version": self.version}] if self.version else []
+        return list(self.results.get(query, []))
+
+    def fetch_one(self, query):
+        rows = self.read(query)
+        return tuple(rows[0].values()) if rows else None
+
+    def insert(self, query, values):
+        self.execute(query, values)
+
+    def execute(self, query, params=None, commit=True):
+        self._round_trip("execute", query)
+        if "INSERT INTO forecast_version" in query:
+            with self._lock:
+                self.version += 1
+
+    def executemany(self, query, seq_params, commit=True):
+        self._round_trip("executemany", query)
+        rows = list(seq_params)
+        with self._lock:
+            if "cloud_cover_forecasts" in query:
+                for row in rows:
+                    self.forecasts[row[0]] = row[1:]
+            elif "forecast_changes" in query:
+                for row in rows:
+                    self.changes[row[0]] = row[1]
+            elif "observations" in query:
+                for row in rows:
+                    # INSERT IGNORE keeps the first row of a timeslot
+                    self.observations.setdefault((row[0], row[1]), row[2:])
+
+    def commit(self):
+        pass
+
+    def _round_trip(self, name, query):
+        with self._lock:
+            self.calls[name] += 1
+            self.statements.append(query)
+        if self.latency:
+            time.sleep(self.latency)
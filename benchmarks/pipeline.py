@@ -0,0 +1,430 @@
+"""
+End-to-end throughput benchmark of the consumer pipeline.
+
+Synthetic messages for N locations are pushed through the consumer in
+`main.py`, with in-process fakes in place of ADLS, Kafka and MySQL, so the
+benchmark needs no network. Decoding, the observation log, learning,
+forecasting, forecast writes and model loads and saves are timed separately.
+Messages per second and peak memory are reported, and the results can be
+saved as JSON and compared with an earlier run.
+
+The consumer keeps its state in module globals, so every run needs a fresh
+process.
+
+Usage:
+    python -m benchmarks.pipeline --locations 500 --timeslots 8 --mode batch
+    python -m benchmarks.pipeline --save benchmarks/results/baseline.json
+    python -m benchmarks.pipeline --compare benchmarks/results/baseline.json
+"""
+
+import argparse
+import datetime
+import functools
+import importlib
+import json
+import logging
+import os
+import platform
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from contextlib import ExitStack, contextmanager
+
+import numpy as np
+
+from benchmarks import synthetic
+from benchmarks.fakes import FakeADLSClient, FakeKafkaConsumer, FakeMySQLClient
+
+# Settings EnvConfig requires, the fakes ignore their values
+REQUIRED_ENV = [
+    "WEATHER_API_KEY",
+    "WEATHER_API_URL",
+    "OPENWEATHER_API_KEY",
+    "OPENWEATHER_API_URL",
+    "NY2O_API_KEY",
+    "NY2O_API_URL",
+    "OPENMETEO_API_URL",
+    "NIFI_BASE_URL",
+    "STORAGE_ACCOUNT_NAME",
+    "STORAGE_ACCOUNT_KEY",
+    "CONTAINER_NAME",
+    "KAFKA_BROKER",
+    "KAFKA_TOPIC",
+    "KAFKA_GROUP_ID",
+    "MYSQL_HOST",
+    "MYSQL_PASSWORD",
+    "COSMOSDB_ACCOUNT_HOST",
+    "COSMOSDB_ACCOUNT_KEY",
+    "COSMOSDB_DATABASE",
+    "COSMOSDB_CONTAINER",
+]
+MODES = ["message", "concurrent", "batch"]
+STAGES = [
+    "decode",
+    "observation_log",
+    "model_load",
+    "learn",
+    "forecast",
+    "forecast_write",
+    "model_save",
+]
+
+
+def ensure_env():
+    """Fill in the settings EnvConfig requires, unless they are set."""
+    for key in REQUIRED_ENV:
+        os.environ.setdefault(key, "benchmark")
+
+
+def load_consumer(io_latency=0.0, fake_kafka=True):
+    """
+    Import the consumer module with fakes in place of its clients.
+    Args:
+        io_latency (float): Seconds slept on every ADLS and MySQL round trip.
+        fake_kafka (bool): Also replace the Kafka consumer, otherwise it
+            connects to the broker of the `KAFKA_*` settings.
+    Returns:
+        module: `main`, whose `adls_client`, `mysql_client` and, with
+            `fake_kafka`, `kafka_consumer` are fakes.
+    Raises:
+        RuntimeError: If `main` was already imported with other clients.
+    """
+    if "main" not in sys.modules:
+        ensure_env()
+        fakes = [
+            ("clients.adls", "ADLSClient", FakeADLSClient),
+            ("clients.mysql_client", "MySQLClient", FakeMySQLClient),
+        ]
+        if fake_kafka:
+            fakes.append(("clients.kafka", "KafkaConsumer", FakeKafkaConsumer))
+        originals = []
+        for module_name, name, fake in fakes:
+            module = importlib.import_module(module_name)
+            originals.append((module, name, getattr(module, name)))
+            setattr(module, name, fake)
+        try:
+            importlib.import_module("main")
+        finally:
+            for module, name, original in originals:
+                setattr(module, name, original)
+    main = sys.modules["main"]
+    if not isinstance(main.adls_client, FakeADLSClient) or fake_kafka != isinstance(
+        main.kafka_consumer, FakeKafkaConsumer
+    ):
+        raise RuntimeError("main was already imported with other clients")
+    main.adls_client.latency = io_latency
+    main.mysql_client.latency = io_latency
+    return main
+
+
+@contextmanager
+def patched(owner, name, replacement):
+    """Replace `owner.name` while the context is open."""
+    own = name in vars(owner)
+    original = getattr(owner, name)
+    setattr(owner, name, replacement)
+    try:
+        yield original
+    finally:
+        if own:
+            setattr(owner, name, original)
+        else:
+            delattr(owner, name)
+
+
+class StageTimer:
+    """
+    Wall time spent in every stage, summed over threads. Calls nested in a
+    call of the same stage on the same thread, e.g. a flush triggered by
+    `add`, are not counted twice.
+    """
+
+    def __init__(self):
+        self.seconds = Counter()
+        self.calls = Counter()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def wrap(self, stage, fn):
+        @functools.wraps(fn)
+        def timed(*args, **kwargs):
+            active = self._local.__dict__.setdefault("active", set())
+            if stage in active:
+                return fn(*args, **kwargs)
+            active.add(stage)
+            started = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - started
+                active.discard(stage)
+                with self._lock:
+                    self.seconds[stage] += elapsed
+                    self.calls[stage] += 1
+
+        return timed
+
+    def patch(self, stage, owner, name):
+        """Time every call of `owner.name` while the context is open."""
+        return patched(owner, name, self.wrap(stage, getattr(owner, name)))
+
+    def instrument(self, main):
+        """Patch the stages of the consumer, returns the open contexts."""
+        targets = [
+            ("decode", main, "extract_data"),
+            ("decode", main.wire, "decode_batch"),
+            ("observation_log", main.observation_log, "add"),
+            ("observation_log", main.observation_log, "flush"),
+            ("model_load", main.adls_client, "download_bytes"),
+            ("model_load", main.model_cache, "loads"),
+            ("learn", main, "update_model"),
+            ("forecast", main, "forecast_hourly"),
+            ("forecast_write", main.forecast_writer, "add"),
+            ("forecast_write", main.forecast_writer, "flush"),
+            ("model_save", main.model_cache, "dumps"),
+            ("model_save", main.adls_client, "upload_bytes"),
+        ]
+        stack = ExitStack()
+        for stage, owner, name in targets:
+            stack.enter_context(self.patch(stage, owner, name))
+        return stack
+
+
+def seed_models(main, ids, start, seed=0):
+    """Store a trained model for every location in the fake ADLS."""
+    blob = synthetic.model_blob(start, seed)
+    for id in ids:
+        main.adls_client.upload_bytes(
+            main.config.container_name, main.model_cache.blob_name(id), blob
+        )
+    main.adls_client.calls.clear()
+
+
+def consume(main, mode, running, batch_size=None, poll_timeout=0.0, batch_wait_ms=0):
+    """
+    Run the polls of the consumer loop of `mode` from main.py while
+    `running()` is true, then close the consumer components, which flushes
+    all pending writes.
+    Args:
+        main (module): Consumer module from `load_consumer`.
+        mode (str): Consumer loop, one of `MODES`.
+        running (callable): Checked before every poll.
+        batch_size (int, optional): Messages per batch in batch mode, by
+            default `BATCH_MAX_MESSAGES`.
+        poll_timeout (float): Seconds a poll waits for messages.
+        batch_wait_ms (int): Milliseconds a batch waits to fill up.
+    """
+    if mode not in MODES:
+        raise ValueError(f"Unknown consumer mode {mode!r}")
+    if mode != "batch":
+        main.start_components()
+    try:
+        if mode == "message":
+            while running():
+                main.poll_messages(poll_timeout)
+        elif mode == "concurrent":
+            while running():
+                main.poll_concurrent(poll_timeout)
+            main.worker_pool.shutdown()
+        else:
+            failures = 0
+            while running():
+                failures = main.poll_batch(batch_size, batch_wait_ms, failures)
+    finally:
+        main.close_components()
+
+
+def peak_rss():
+    """Peak resident set size of the process in bytes, None if unknown."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def run(
+    locations=500,
+    timeslots=8,
+    mode="message",
+    format="json",
+    batch_size=None,
+    io_latency=0.0,
+    trace_memory=False,
+    seed=0,
+):
+    """
+    Run the benchmark once.
+    Args:
+        locations (int): Number of locations, ids 1 to `locations`.
+        timeslots (int): Consecutive 15-minute timeslots, one message per
+            location and timeslot.
+        mode (str): Consumer loop, one of `MODES`.
+        format (str): Message format, "json" or "avro".
+        batch_size (int, optional): Messages per batch in batch mode, by
+            default `BATCH_MAX_MESSAGES`.
+        io_latency (float): Seconds slept on every ADLS and MySQL round trip.
+        trace_memory (bool): Also trace the peak of Python allocations during
+            the run, which slows it down.
+        seed (int): Seed of the synthetic data.
+    Returns:
+        dict: Results, see `report`.
+    """
+    main = load_consumer(io_latency)
+    ids = list(range(1, locations + 1))
+    start = synthetic.start_timestamp()
+    seed_models(main, ids, start, seed)
+    messages = synthetic.encode_messages(
+        synthetic.observations(ids, timeslots, start, seed), format
+    )
+    main.kafka_consumer.produce(messages)
+
+    timer = StageTimer()
+    if trace_memory:
+        tracemalloc.start()
+    with timer.instrument(main):
+        started = time.perf_counter()
+        cpu_started = time.process_time()
+        consume(main, mode, lambda: len(main.kafka_consumer), batch_size)
+        seconds = time.perf_counter() - started
+        cpu_seconds = time.process_time() - cpu_started
+    traced_peak = None
+    if trace_memory:
+        traced_peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    n = len(messages)
+    return {
+        "benchmark": "pipeline",
+        "created": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "environment": {
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+        },
+        "parameters": {
+            "locations": locations,
+            "timeslots": timeslots,
+            "mode": mode,
+            "format": format,
+            "batch_size": batch_size,
+            "io_latency": io_latency,
+            "seed": seed,
+        },
+        "messages": n,
+        "seconds": seconds,
+        "cpu_seconds": cpu_seconds,
+        "messages_per_second": n / seconds if seconds else None,
+        "stages": {
+            stage: {
+                "seconds": timer.seconds[stage],
+                "calls": timer.calls[stage],
+                "us_per_message": 1e6 * timer.seconds[stage] / n if n else None,
+            }
+            for stage in STAGES
+        },
+        "peak_rss_bytes": peak_rss(),
+        "peak_traced_bytes": traced_peak,
+        "forecasts_written": len(main.mysql_client.forecasts),
+        "observations_logged": len(main.mysql_client.observations),
+        "io_calls": {
+            "adls": dict(main.adls_client.calls),
+            "mysql": dict(main.mysql_client.calls),
+        },
+    }
+
+
+def report(results):
+    print(
+        f"{results['messages']} messages for {results['parameters']['locations']} "
+        f"locations in {results['seconds']:.2f}s "
+        f"({results['cpu_seconds']:.2f}s CPU), "
+        f"{results['messages_per_second']:.0f} messages/s"
+    )
+    for stage, stats in results["stages"].items():
+        share = stats["seconds"] / results["seconds"] if results["seconds"] else 0
+        print(
+            f"  {stage:>15}: {stats['seconds']:8.3f}s {stats['us_per_message']:9.1f}"
+            f"us/message {share:6.1%} {stats['calls']:8d} calls"
+        )
+    if results["peak_rss_bytes"] is not None:
+        print(f"Peak RSS: {results['peak_rss_bytes'] / 1024**2:.1f} MiB")
+    if results["peak_traced_bytes"] is not None:
+        print(f"Peak traced memory: {results['peak_traced_bytes'] / 1024**2:.1f} MiB")
+    print(
+        f"Forecasts written: {results['forecasts_written']}, "
+        f"observations logged: {results['observations_logged']}"
+    )
+
+
+def compare(results, baseline, tolerance=0.1):
+    """
+    Print the change against a baseline run.
+    Returns:
+        bool: Whether throughput dropped by more than `tolerance`.
+    """
+    if results["parameters"] != baseline["parameters"]:
+        print(f"Warning: baseline parameters differ: {baseline['parameters']}")
+    before, after = baseline["messages_per_second"], results["messages_per_second"]
+    change = after / before - 1
+    print(f"Throughput: {before:.0f} -> {after:.0f} messages/s ({change:+.1%})")
+    for stage, stats in results["stages"].items():
+        old = baseline["stages"].get(stage, {}).get("us_per_message")
+        new = stats["us_per_message"]
+        if old:
+            print(
+                f"  {stage:>15}: {old:9.1f} -> {new:9.1f} us/message ({new / old - 1:+.1%})"
+            )
+    regressed = change < -tolerance
+    if regressed:
+        print(f"Throughput regressed by more than {tolerance:.0%}")
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--locations", type=int, default=500)
+    parser.add_argument("--timeslots", type=int, default=8)
+    parser.add_argument("--mode", choices=MODES, default="message")
+    parser.add_argument("--format", choices=["json", "avro"], default="json")
+    parser.add_argument("--batch-size", type=int)
+    parser.add_argument("--io-latency", type=float, default=0.0)
+    parser.add_argument("--trace-memory", action="store_true")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--save", help="Write the results to this JSON file")
+    parser.add_argument("--compare", help="Baseline results to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.1)
+    parser.add_argument("--log-level", default="WARNING")
+    args = parser.parse_args()
+
+    # The consumer logs every message at INFO, which would dominate the run
+    load_consumer()
+    logging.getLogger().setLevel(args.log_level)
+    results = run(
+        args.locations,
+        args.timeslots,
+        args.mode,
+        args.format,
+        args.batch_size,
+        args.io_latency,
+        args.trace_memory,
+        args.seed,
+    )
+    report(results)
+    if args.save:
+        os.makedirs(os.path.dirname(os.path.abspath(args.save)), exist_ok=True)
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            if compare(results, json.load(f), args.tolerance):
+                sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
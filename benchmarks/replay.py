@@ -0,0 +1,612 @@
+"""
+Record, synthesize and replay weather topic traffic for capacity planning.
+
+Recordings are Avro container files holding the raw message values, in the
+JSON or Avro shape `extract_data` decodes, with the time each message
+arrived. `record` captures them from a broker, `synthesize` generates them
+for every grid location. `replay` pushes a recording, or an endless
+synthetic stream, into the consumer of `main.py` as fast as possible, at a
+fixed rate or at N times real time. Messages go through the in-process
+stand-in for `KafkaConsumer` or through a broker, and are consumed in this
+process with fakes for ADLS and MySQL. Sustained throughput and the
+end-to-end lag, from handing a message to the transport until the consumer
+has processed it, are reported. `--sweep` offers increasing rates until the
+consumer saturates.
+
+Usage:
+    python -m benchmarks.replay synthesize traffic.avro --timeslots 4
+    python -m benchmarks.replay record traffic.avro --broker localhost:9092 --duration 600
+    python -m benchmarks.replay replay --recording traffic.avro --speed 60
+    python -m benchmarks.replay replay --synthetic --sweep 500,1000,2000,4000
+"""
+
+import argparse
+import collections
+import json
+import logging
+import os
+import threading
+import time
+
+import numpy as np
+
+from benchmarks import pipeline, synthetic
+from weather_predictions import avro_io, wire
+from weather_predictions.observation_log import SLOT_SECONDS
+
+RECORDING_SCHEMA = {
+    "type": "record",
+    "name": "RecordedMessage",
+    "fields": [
+        {"name": "time", "type": "double"},
+        {"name": "value", "type": "bytes"},
+    ],
+}
+# A step is saturated when the consumer falls behind the offered rate by more
+# than this fraction
+SATURATION_SHORTFALL = 0.05
+
+
+def grid_ids(step=0.2):
+    """
+    Location ids of the provisioned grid, which initialize_tables numbers
+    from 1 in grid order.
+    """
+    pipeline.ensure_env()
+    from weather_predictions.initialize_weather_tables import grid_points
+
+    return list(range(1, len(grid_points(step)) + 1))
+
+
+def record(kafka_consumer, path, duration=None, max_messages=None):
+    """
+    Append the messages of a topic to a recording.
+    Args:
+        kafka_consumer (KafkaConsumer): Consumer returning raw values.
+        path (str): Recording, created if needed.
+        duration (float, optional): Seconds to record for.
+        max_messages (int, optional): Stop once this many messages are
+            recorded, keeping the rest of the last poll.
+    Returns:
+        int: Number of recorded messages.
+    """
+    deadline = None if duration is None else time.monotonic() + duration
+    count = 0
+    while (deadline is None or time.monotonic() < deadline) and (
+        max_messages is None or count < max_messages
+    ):
+        values = kafka_consumer.consume_messages(timeout=0.5)
+        if not values:
+            continue
+        now = time.time()
+        avro_io.append(
+            path,
+            RECORDING_SCHEMA,
+            ({"time": now, "value": _to_bytes(value)} for value in values),
+        )
+        count += len(values)
+    return count
+
+
+def synthesize(path, ids, timeslots, start, format="json", seed=0):
+    """
+    Write a recording of synthetic messages, every message arriving at its
+    observation's timestamp.
+    Returns:
+        int: Number of messages.
+    """
+    batch = synthetic.observations(ids, timeslots, start, seed)
+    values = synthetic.encode_messages(batch, format)
+    avro_io.write(
+        path,
+        RECORDING_SCHEMA,
+        (
+            {"time": float(t), "value": value}
+            for t, value in zip(batch["timestamp"].tolist(), values)
+        ),
+    )
+    return len(values)
+
+
+def read_recording(path):
+    """
+    Iterate the messages of a recording.
+    Yields:
+        tuple[float, bytes]: Arrival time and message value.
+    """
+    for chunk in avro_io.iter_chunks(path):
+        yield from zip(chunk["time"].tolist(), chunk["value"].tolist())
+
+
+def synthetic_stream(ids, start, format="json", seed=0, timeslots=None):
+    """
+    Synthetic messages of consecutive timeslots, endless by default, in the
+    shape of `read_recording`.
+    """
+    slot = 0
+    while timeslots is None or slot < timeslots:
+        batch = synthetic.observations(
+            ids, 1, start + slot * SLOT_SECONDS, seed=seed + slot
+        )
+        values = synthetic.encode_messages(batch, format)
+        yield from zip(batch["timestamp"].astype(float).tolist(), values)
+        slot += 1
+
+
+class LagTracker:
+    """
+    Matches processed messages to the times they were sent by location id and
+    observation timestamp, and keeps the end-to-end lags.
+    """
+
+    def __init__(self):
+        self.lags = []
+        self.sent = 0
+        self.processed = 0
+        self._pending = collections.defaultdict(collections.deque)
+        self._lock = threading.Lock()
+        self._decoded = threading.local()
+
+    def sending(self, key, sent_at):
+        with self._lock:
+            self._pending[key].append(sent_at)
+            self.sent += 1
+
+    def processed_keys(self, keys):
+        now = time.perf_counter()
+        with self._lock:
+            for key in keys:
+                queue = self._pending.get(key)
+                if not queue:
+                    continue
+                self.lags.append((now, now - queue.popleft()))
+                if not queue:
+                    del self._pending[key]
+                self.processed += 1
+
+    @property
+    def backlog(self):
+        return self.sent - self.processed
+
+    def instrument(self, main):
+        """
+        Report processed messages from the consumer: when `process_observations`
+        returns, and for batches when `process_batch` returns, using the
+        observations `decode_batch` returned for it.
+        """
+        stack = pipeline.ExitStack()
+        process_observations = main.process_observations
+        process_batch = main.process_batch
+        decode_batch = main.wire.decode_batch
+
+        def tracked_observations(id, observations):
+            try:
+                return process_observations(id, observations)
+            finally:
+                self.processed_keys([(id, observations["timestamp"][0].item())])
+
+        def tracked_decode(payloads):
+            batch = decode_batch(payloads)
+            self._decoded.batch = batch
+            return batch
+
+        def tracked_batch(messages):
+            self._decoded.batch = None
+            try:
+                return process_batch(messages)
+            finally:
+                batch = self._decoded.batch
+                if batch is not None:
+                    self.processed_keys(
+                        zip(batch["id"].tolist(), batch["timestamp"].tolist())
+                    )
+
+        stack.enter_context(
+            pipeline.patched(main, "process_observations", tracked_observations)
+        )
+        stack.enter_context(pipeline.patched(main, "process_batch", tracked_batch))
+        stack.enter_context(pipeline.patched(main.wire, "decode_batch", tracked_decode))
+        return stack
+
+
+class InProcessTransport:
+    """Hands messages to the fake `KafkaConsumer` of the consumer."""
+
+    def __init__(self, kafka_consumer):
+        self.kafka_consumer = kafka_consumer
+
+    def send(self, values):
+        self.kafka_consumer.produce(values)
+
+    def flush(self):
+        pass
+
+
+class KafkaTransport:
+    """Produces messages to a topic of a broker."""
+
+    def __init__(self, broker, topic):
+        from confluent_kafka import Producer
+
+        self.topic = topic
+        self.producer = Producer({"bootstrap.servers": broker, "linger.ms": 5})
+
+    def send(self, values):
+        for value in values:
+            while True:
+                try:
+                    self.producer.produce(self.topic, value)
+                    break
+                except BufferError:
+                    # Local queue full, wait for deliveries
+                    self.producer.poll(0.1)
+        self.producer.poll(0)
+
+    def flush(self):
+        self.producer.flush()
+
+
+def pace(stream, rate=None, speed=None, duration=None, chunk=100):
+    """
+    Group a message stream into chunks with the offsets, in seconds from the
+    start, at which to send them.
+    Args:
+        stream (Iterator[tuple[float, bytes]]): Arrival times and values.
+        rate (float, optional): Messages per second.
+        speed (float, optional): Multiple of real time of the arrival times.
+        duration (float, optional): Stop after this many seconds of traffic.
+        chunk (int): Messages per chunk at full speed.
+    Yields:
+        tuple[float, list[bytes]]: Send offset and values.
+    """
+    first = None
+    values = []
+    i = 0
+    for arrival, value in stream:
+        if rate:
+            offset = i / rate
+        elif speed:
+            first = arrival if first is None else first
+            offset = (arrival - first) / speed
+        else:
+            offset = 0.0
+        if duration is not None and offset >= duration:
+            break
+        if rate or speed:
+            yield offset, [value]
+        else:
+            values.append(value)
+            if len(values) == chunk:
+                yield offset, values
+                values = []
+        i += 1
+    if values:
+        yield 0.0, values
+
+
+def send(transport, tracker, stream, rate=None, speed=None, duration=None):
+    """
+    Send paced messages, sleeping until each is due.
+    Returns:
+        tuple[int, float]: Number of messages sent and seconds taken.
+    """
+    started = time.perf_counter()
+    count = 0
+    for offset, values in pace(stream, rate, speed, duration):
+        delay = started + offset - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        sent_at = time.perf_counter()
+        for value in values:
+            try:
+                fields = wire.decode(value)
+            except ValueError:
+                continue
+            tracker.sending((fields[0], fields[1]), sent_at)
+        transport.send(values)
+        count += len(values)
+    transport.flush()
+    return count, time.perf_counter() - started
+
+
+def percentiles(lags):
+    if not lags:
+        return {"p50": None, "p95": None, "p99": None, "max": None}
+    lags = np.asarray(lags)
+    p50, p95, p99 = np.percentile(lags, [50, 95, 99])
+    return {"p50": p50, "p95": p95, "p99": p99, "max": lags.max()}
+
+
+def wait_for(tracker, timeout):
+    """Wait until every sent message was processed, or the timeout."""
+    deadline = time.monotonic() + timeout
+    while tracker.backlog and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+
+def run_step(
+    transport, tracker, stream, rate=None, speed=None, duration=None, drain_timeout=30
+):
+    """
+    Offer one load and measure how the consumer keeps up.
+    Returns:
+        dict: Offered rate, sustained throughput, lag percentiles of the
+            messages of the step and the backlog when sending ended.
+    """
+    done = len(tracker.lags)
+    sent, seconds = send(transport, tracker, stream, rate, speed, duration)
+    backlog = tracker.backlog
+    wait_for(tracker, drain_timeout)
+    lags = tracker.lags[done:]
+    # Between the first and the last processed message, which leaves out
+    # the wait for a first batch to fill up
+    span = lags[-1][0] - lags[0][0] if len(lags) > 1 else None
+    return {
+        "rate": rate,
+        "speed": speed,
+        "sent": sent,
+        "offered_per_second": sent / seconds if seconds else None,
+        "processed": len(lags),
+        "throughput_per_second": (len(lags) - 1) / span if span else None,
+        "backlog_at_end": backlog,
+        "unprocessed": tracker.backlog,
+        "lag_seconds": percentiles([lag for _, lag in lags]),
+    }
+
+
+def saturated(step, max_lag):
+    """
+    Whether the consumer could not keep up with a step: messages were left
+    unprocessed, the p95 lag exceeded `max_lag` or, at a fixed rate, the
+    throughput fell short of the offered rate.
+    """
+    if step["sent"] == 0:
+        return False
+    if step["unprocessed"]:
+        return True
+    offered, throughput = step["offered_per_second"], step["throughput_per_second"]
+    if step["rate"] and throughput < (1 - SATURATION_SHORTFALL) * offered:
+        return True
+    return step["lag_seconds"]["p95"] > max_lag
+
+
+def replay(
+    main,
+    transport,
+    stream,
+    mode="message",
+    rate=None,
+    speed=None,
+    duration=None,
+    sweep=None,
+    max_lag=1.0,
+    drain_timeout=30,
+):
+    """
+    Run the consumer in a thread and replay the stream into it.
+    Args:
+        main (module): Consumer module from `pipeline.load_consumer`.
+        transport (InProcessTransport | KafkaTransport): Where messages go.
+        stream (Iterator[tuple[float, bytes]]): Arrival times and values.
+        mode (str): Consumer loop, one of `pipeline.MODES`.
+        rate (float, optional): Messages per second, full speed by default.
+        speed (float, optional): Multiple of real time instead of a rate.
+        duration (float, optional): Seconds of traffic, per step of a sweep.
+        sweep (list[float], optional): Rates to offer one after another,
+            stopping at the first that saturates the consumer.
+        max_lag (float): p95 lag in seconds above which a step is saturated.
+        drain_timeout (float): Seconds to wait for the backlog after a step.
+    Returns:
+        dict: Steps and the saturation point of a sweep.
+    """
+    tracker = LagTracker()
+    stop = threading.Event()
+    consumer = threading.Thread(
+        target=pipeline.consume,
+        args=(main, mode, lambda: not stop.is_set()),
+        kwargs={"poll_timeout": 0.01, "batch_wait_ms": main.config.batch_max_wait_ms},
+        name="consumer",
+    )
+    steps = []
+    with tracker.instrument(main):
+        consumer.start()
+        try:
+            if sweep:
+                for step_rate in sweep:
+                    step = run_step(
+                        transport,
+                        tracker,
+                        stream,
+                        step_rate,
+                        None,
+                        duration,
+                        drain_timeout,
+                    )
+                    step["saturated"] = saturated(step, max_lag)
+                    steps.append(step)
+                    report_step(step)
+                    if step["saturated"]:
+                        break
+            else:
+                step = run_step(
+                    transport, tracker, stream, rate, speed, duration, drain_timeout
+                )
+                step["saturated"] = saturated(step, max_lag)
+                steps.append(step)
+                report_step(step)
+        finally:
+            stop.set()
+            consumer.join()
+
+    results = {"mode": mode, "steps": steps}
+    if sweep:
+        healthy = [step["rate"] for step in steps if not step["saturated"]]
+        results["max_sustained_rate"] = max(healthy) if healthy else None
+        results["saturation_rate"] = (
+            steps[-1]["rate"] if steps[-1]["saturated"] else None
+        )
+        results["peak_throughput_per_second"] = max(
+            step["throughput_per_second"] or 0 for step in steps
+        )
+    return results
+
+
+def report_step(step):
+    lag = step["lag_seconds"]
+    offered = step["rate"] or (f"{step['speed']}x" if step["speed"] else "max")
+    line = (
+        f"offered {offered}: sent {step['sent']} at "
+        f"{step['offered_per_second'] or 0:.0f}/s, processed {step['processed']} "
+        f"at {step['throughput_per_second'] or 0:.0f}/s"
+    )
+    if step["unprocessed"]:
+        line += f", {step['unprocessed']} unprocessed"
+    if lag["p50"] is not None:
+        line += (
+            f", lag p50 {1e3 * lag['p50']:.1f}ms p95 {1e3 * lag['p95']:.1f}ms "
+            f"p99 {1e3 * lag['p99']:.1f}ms max {1e3 * lag['max']:.1f}ms"
+        )
+    if step["saturated"]:
+        line += ", saturated"
+    print(line)
+
+
+def _to_bytes(value):
+    return value.encode("utf-8") if isinstance(value, str) else bytes(value)
+
+
+def _locations_of(path):
+    """Location ids and first observation timestamp of a recording."""
+    fields = [wire.decode(value) for _, value in read_recording(path)]
+    return sorted({f[0] for f in fields}), min(f[1] for f in fields)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    recorder = commands.add_parser("record", help="Record messages from a broker")
+    recorder.add_argument("path")
+    recorder.add_argument("--broker", required=True)
+    recorder.add_argument("--topic", default=os.environ.get("KAFKA_TOPIC"))
+    recorder.add_argument("--group-id", default=f"recorder-{int(time.time())}")
+    recorder.add_argument("--duration", type=float)
+    recorder.add_argument("--max-messages", type=int)
+
+    synthesizer = commands.add_parser("synthesize", help="Write synthetic messages")
+    synthesizer.add_argument("path")
+    synthesizer.add_argument("--timeslots", type=int, default=4)
+    synthesizer.add_argument("--grid-step", type=float, default=0.2)
+    synthesizer.add_argument(
+        "--locations", type=int, help="Ids 1 to N instead of the grid"
+    )
+    synthesizer.add_argument("--format", choices=["json", "avro"], default="json")
+    synthesizer.add_argument("--seed", type=int, default=0)
+
+    replayer = commands.add_parser("replay", help="Replay messages into the consumer")
+    source = replayer.add_mutually_exclusive_group(required=True)
+    source.add_argument("--recording")
+    source.add_argument("--synthetic", action="store_true")
+    replayer.add_argument("--grid-step", type=float, default=0.2)
+    replayer.add_argument(
+        "--locations", type=int, help="Ids 1 to N instead of the grid"
+    )
+    replayer.add_argument("--format", choices=["json", "avro"], default="json")
+    replayer.add_argument("--seed", type=int, default=0)
+    replayer.add_argument("--mode", choices=pipeline.MODES, default="message")
+    pacing = replayer.add_mutually_exclusive_group()
+    pacing.add_argument("--rate", type=float, help="Messages per second")
+    pacing.add_argument("--speed", type=float, help="Multiple of real time")
+    pacing.add_argument("--sweep", help="Comma separated rates to offer in turn")
+    replayer.add_argument("--duration", type=float, help="Seconds of traffic per step")
+    replayer.add_argument("--max-lag", type=float, default=1.0)
+    replayer.add_argument("--drain-timeout", type=float, default=30.0)
+    replayer.add_argument("--broker", help="Replay through this broker")
+    replayer.add_argument("--topic", default="weather-replay")
+    replayer.add_argument("--io-latency", type=float, default=0.0)
+    replayer.add_argument("--save", help="Write the results to this JSON file")
+    replayer.add_argument("--log-level", default="WARNING")
+    args = parser.parse_args()
+
+    if args.command == "record":
+        from clients.kafka import KafkaConsumer
+
+        consumer = KafkaConsumer(
+            args.broker, args.group_id, args.topic, decode_values=False
+        )
+        try:
+            count = record(consumer, args.path, args.duration, args.max_messages)
+        except KeyboardInterrupt:
+            count = None
+        finally:
+            consumer.close()
+        print(
+            f"Recorded {count if count is not None else 'some'} messages to {args.path}"
+        )
+        return
+
+    ids = (
+        list(range(1, args.locations + 1))
+        if args.locations
+        else grid_ids(args.grid_step)
+    )
+    if args.command == "synthesize":
+        start = synthetic.start_timestamp()
+        count = synthesize(
+            args.path, ids, args.timeslots, start, args.format, args.seed
+        )
+        print(f"Wrote {count} messages for {len(ids)} locations to {args.path}")
+        return
+
+    if args.recording:
+        ids, start = _locations_of(args.recording)
+        stream = read_recording(args.recording)
+    else:
+        start = synthetic.start_timestamp()
+        stream = synthetic_stream(ids, start, args.format, args.seed)
+        if not (args.duration or args.sweep):
+            parser.error("--synthetic needs --duration or --sweep")
+    sweep = [float(rate) for rate in args.sweep.split(",")] if args.sweep else None
+    if sweep and not args.duration:
+        args.duration = 10.0
+
+    if args.broker:
+        os.environ.update(
+            KAFKA_BROKER=args.broker,
+            KAFKA_TOPIC=args.topic,
+            KAFKA_GROUP_ID=f"replay-{int(time.time())}",
+        )
+    main = pipeline.load_consumer(args.io_latency, fake_kafka=not args.broker)
+    # The consumer logs every message at INFO, which would dominate the run
+    logging.getLogger().setLevel(args.log_level)
+    pipeline.seed_models(main, ids, start, args.seed)
+    transport = (
+        KafkaTransport(args.broker, args.topic)
+        if args.broker
+        else InProcessTransport(main.kafka_consumer)
+    )
+    results = replay(
+        main,
+        transport,
+        stream,
+        args.mode,
+        args.rate,
+        args.speed,
+        args.duration,
+        sweep,
+        args.max_lag,
+        args.drain_timeout,
+    )
+    if sweep:
+        print(
+            f"Max sustained rate: {results['max_sustained_rate']}, "
+            f"saturated at: {results['saturation_rate']}, "
+            f"peak throughput: {results['peak_throughput_per_second']:.0f}/s"
+        )
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2, default=float)
+
+
+if __name__ == "__main__":
+    main()
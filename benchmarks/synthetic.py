@@ -0,0 +1,137 @@
+"""
+Synthetic observations, messages and models for the consumer benchmarks.
+
+Observations follow a daily cycle with noise, one per location and 15-minute
+timeslot. Messages are encoded as the producers send them, legacy JSON with
+numbers as strings or schemaless Avro, and models are trained on the same
+kind of series so that their forecasts stay in a realistic range.
+"""
+
+import json
+import time
+
+import numpy as np
+
+from weather_predictions import state_codec, wire
+from weather_predictions.feature_history import FeatureHistory
+from weather_predictions.observation_log import POF, SLOT_SECONDS
+from weather_predictions.snarimax import NumpySNARIMAX
+
+# Exogenous features in the order main.to_record builds them
+FEATURES = [
+    "dt",
+    "temp",
+    "pressure",
+    "humidity",
+    "wind_speed",
+    "wind_deg",
+    "precipitation",
+]
+MODEL_ORDERS = dict(p=1, d=1, q=1, m=4 * 24, sp=1, sd=1, sq=1, l2=1)
+HISTORY_SLOTS = 8 * 4 * 24
+# Observations arrive a minute into their timeslot
+ARRIVAL_OFFSET = 60
+
+
+def start_timestamp(slot=None):
+    """Timestamp of the first observation, by default the current timeslot."""
+    if slot is None:
+        slot = (int(time.time()) - POF) // SLOT_SECONDS
+    return POF + slot * SLOT_SECONDS + ARRIVAL_OFFSET
+
+
+def observations(ids, timeslots, start, seed=0):
+    """
+    Observations of every location in `timeslots` consecutive timeslots.
+    Args:
+        ids (Sequence[int]): Location ids.
+        timeslots (int): Number of timeslots.
+        start (int): Timestamp of the first timeslot's observations.
+        seed (int): Seed of the noise.
+    Returns:
+        np.ndarray: Observations with dtype `OBSERVATION_DTYPE`, ordered by
+            timeslot and then by location like a live topic.
+    """
+    rng = np.random.default_rng(seed)
+    ids = np.asarray(ids, dtype=np.int64)
+    n = len(ids) * timeslots
+    batch = np.zeros(n, dtype=wire.OBSERVATION_DTYPE)
+    batch["id"] = np.tile(ids, timeslots)
+    batch["timestamp"] = (
+        start + np.repeat(np.arange(timeslots), len(ids)) * SLOT_SECONDS
+    )
+    # Every location has its own phase of the daily cycle
+    phase = (batch["id"] % 24) / 24
+    day = ((batch["timestamp"] - POF) % 86400) / 86400
+    cycle = np.sin(2 * np.pi * (day + phase))
+    batch["cloud_coverage"] = np.clip(
+        np.round(50 + 35 * cycle + rng.normal(0, 10, n)), 0, 100
+    )
+    batch["temperature"] = np.round(8 + 6 * cycle + rng.normal(0, 1, n), 2)
+    batch["pressure"] = np.round(1013 + rng.normal(0, 4, n))
+    batch["humidity"] = np.clip(np.round(70 - 15 * cycle + rng.normal(0, 5, n)), 0, 100)
+    batch["wind_speed"] = np.round(np.abs(rng.normal(4, 2, n)), 1)
+    batch["wind_direction"] = rng.integers(0, 360, n)
+    batch["precipitation"] = np.round(np.maximum(rng.normal(-0.5, 0.5, n), 0), 1)
+    return batch
+
+
+def encode_messages(batch, format="json"):
+    """
+    Encode observations as message values.
+    Args:
+        batch (np.ndarray): Observations with dtype `OBSERVATION_DTYPE`.
+        format (str): "json" for the legacy messages, "avro" for schemaless Avro.
+    Returns:
+        list[bytes]: One message per observation.
+    """
+    if format == "avro":
+        return [wire.encode(dict(zip(wire.FIELDS, row))) for row in batch.tolist()]
+    if format != "json":
+        raise ValueError(f"Unknown message format {format!r}")
+    return [
+        json.dumps({name: str(value) for name, value in zip(wire.FIELDS, row)}).encode()
+        for row in batch.tolist()
+    ]
+
+
+def model_data(start, seed=0):
+    """
+    Model data of a location as lunch_model stores it, trained on the
+    synthetic series of the days before `start`.
+    Returns:
+        dict: Model, timestamp of the last learned observation and the
+            feature window.
+    """
+    history = observations(
+        [0], HISTORY_SLOTS, start - HISTORY_SLOTS * SLOT_SECONDS, seed
+    )
+    # UTC hours, the consumer uses Polish time, which only shifts the cycle
+    hours = history["timestamp"] // 3600 % 24
+    X = np.column_stack(
+        [
+            hours,
+            history["temperature"],
+            history["pressure"],
+            history["humidity"],
+            history["wind_speed"],
+            history["wind_direction"],
+            history["precipitation"],
+        ]
+    ).astype(float)
+    y = history["cloud_coverage"].astype(float)
+    horizon = MODEL_ORDERS["m"]
+
+    model = NumpySNARIMAX(**MODEL_ORDERS)
+    model.set_exog(FEATURES)
+    model.learn_many(y[horizon:], X[:-horizon])
+    return {
+        "model": model,
+        "timestamp": int(history["timestamp"][-1]),
+        "x_hist": FeatureHistory.from_array(FEATURES, X[-horizon:]),
+    }
+
+
+def model_blob(start, seed=0):
+    """Serialized `model_data`, as stored in ADLS."""
+    return state_codec.dumps(model_data(start, seed))
@@ -47,6 +47,21 @@ class ADLSClient:
         except Exception as e:
             print(e)
 
+    def upload_bytes(self, container_name, file_name, data):
+        # Unlike upload_pickle, errors are propagated so callers can tell
+        # whether the blob is durable.
+        # upload_data creates the file when overwriting, a separate
+        # create_file would only add a round trip.
+        file_client = self.service_client.get_file_client(container_name, file_name)
+        file_client.upload_data(data, overwrite=True)
+
+    def download_bytes(self, container_name, file_name):
+        file_system_client = self.service_client.get_file_system_client(
+            file_system=container_name
+        )
+        file_client = file_system_client.get_file_client(file_name)
+        return file_client.download_file().readall()
+
     def download_file_from_container(self, container_name, file_name, download_path):
         try:
             file_system_client = self.service_client.get_file_system_client(
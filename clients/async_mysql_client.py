@@ -0,0 +1,107 @@
+import asyncio
+import time
+from contextlib import asynccontextmanager
+
+from mysql import connector
+from mysql.connector import aio
+
+
+class AsyncMySQLClient:
+    """
+    Asyncio MySQL client with a connection pool.
+    Queries of concurrent requests run on separate pooled connections, so
+    independent lookups can be awaited together with `asyncio.gather`. Idle
+    connections are pinged before reuse and replaced after `pool_max_lifetime`
+    seconds; at most `pool_size` connections are open at the same time.
+    """
+
+    def __init__(
+        self,
+        host,
+        user,
+        password,
+        database,
+        port=3306,
+        debug=False,
+        pool_size=10,
+        pool_max_lifetime=3600,
+    ):
+        self.host = host
+        self.user = user
+        self.password = password
+        self.database = database
+        self.port = port
+        self.debug = debug
+        self.pool_size = pool_size
+        self.pool_max_lifetime = pool_max_lifetime
+        self._idle = []
+        self._slots = None
+
+    async def _open(self):
+        try:
+            connection = await aio.connect(
+                host=self.host,
+                user=self.user,
+                password=self.password,
+                database=self.database,
+                port=self.port,
+            )
+        except connector.Error as err:
+            raise RuntimeError(f"Failed to connect to MySQL: {err}")
+        if self.debug:
+            print(f"Connected to {self.database} on {self.host}:{self.port}")
+        return connection, time.monotonic()
+
+    async def _checkout(self):
+        while self._idle:
+            connection, created_at = self._idle.pop()
+            if time.monotonic() - created_at > self.pool_max_lifetime:
+                await self._close(connection)
+                continue
+            try:
+                await connection.ping()
+                return connection, created_at
+            except connector.Error:
+                await self._close(connection)
+        return await self._open()
+
+    @asynccontextmanager
+    async def connection(self):
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.pool_size)
+        async with self._slots:
+            connection, created_at = await self._checkout()
+            try:
+                yield connection
+            except BaseException:
+                await self._close(connection)
+                raise
+            else:
+                # Ends the read transaction so the next query sees fresh data
+                await connection.rollback()
+                self._idle.append((connection, created_at))
+
+    async def read(self, query, params=None):
+        async with self.connection() as connection:
+            cursor = await connection.cursor(dictionary=True)
+            try:
+                await cursor.execute(query, params)
+                result = await cursor.fetchall()
+                if self.debug:
+                    print(f"Query executed: {query} with params: {params}")
+                return result
+            except connector.Error as err:
+                raise RuntimeError(f"Failed to execute read: {err}")
+            finally:
+                await cursor.close()
+
+    async def close(self):
+        while self._idle:
+            connection, _ = self._idle.pop()
+            await self._close(connection)
+
+    async def _close(self, connection):
+        try:
+            await connection.close()
+        except connector.Error:
+            pass
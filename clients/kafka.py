@@ -1,13 +1,18 @@
-from confluent_kafka import Consumer, KafkaException, KafkaError
-import os
+from confluent_kafka import Consumer, KafkaException, KafkaError, OFFSET_BEGINNING
+import time
 
 
 class KafkaConsumer:
-    def __init__(self, broker, group_id, topic):
+    def __init__(
+        self, broker, group_id, topic, enable_auto_commit=True, decode_values=True
+    ):
+        # decode_values=False returns the raw bytes, e.g. for binary payloads
+        self.decode_values = decode_values
         self.conf = {
             "bootstrap.servers": broker,
             "group.id": group_id,
             "auto.offset.reset": "earliest",
+            "enable.auto.commit": enable_auto_commit,
         }
         self.consumer = Consumer(self.conf)
         self.consumer.subscribe([topic])
@@ -24,10 +29,50 @@ class KafkaConsumer:
                         continue
                     else:
                         raise KafkaException(msg.error())
-                messages.append(msg.value().decode("utf-8"))
+                messages.append(self._value(msg))
         except KeyboardInterrupt:
             pass
         return messages
 
+    def consume_batch(self, max_messages=500, max_wait_ms=1000):
+        """
+        Consume a bounded batch of messages.
+        Args:
+            max_messages (int): Maximum number of messages in the batch.
+            max_wait_ms (int): Maximum time to wait for the batch to fill up.
+        Returns:
+            list[str | bytes]: Message values, in partition order.
+        """
+        messages = []
+        deadline = time.monotonic() + max_wait_ms / 1000
+        while len(messages) < max_messages:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            for msg in self.consumer.consume(
+                num_messages=max_messages - len(messages), timeout=remaining
+            ):
+                if msg.error():
+                    if msg.error().code() == KafkaError._PARTITION_EOF:
+                        continue
+                    raise KafkaException(msg.error())
+                messages.append(self._value(msg))
+        return messages
+
+    def _value(self, msg):
+        value = msg.value()
+        return value.decode("utf-8") if self.decode_values else value
+
+    def commit(self):
+        """Synchronously commit the offsets of everything consumed so far."""
+        self.consumer.commit(asynchronous=False)
+
+    def rewind(self):
+        """Seek every assigned partition back to its last committed offset."""
+        for partition in self.consumer.committed(self.consumer.assignment()):
+            if partition.offset < 0:
+                partition.offset = OFFSET_BEGINNING
+            self.consumer.seek(partition)
+
     def close(self):
         self.consumer.close()
@@ -1,25 +1,122 @@
 from mysql import connector
+import queue
+import threading
+import time
+
+
+class ConnectionPool:
+    """
+    Thread-safe pool of MySQL connections.
+    Idle connections are pinged before they are handed out and replaced once
+    they are older than `max_lifetime` seconds. At most `size` connections are
+    checked out at the same time, further checkouts wait up to `timeout`.
+    """
+
+    def __init__(self, connect, size=5, max_lifetime=3600, timeout=30):
+        self._connect = connect
+        self.size = size
+        self.max_lifetime = max_lifetime
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+
+    def acquire(self):
+        if not self._slots.acquire(timeout=self.timeout):
+            raise RuntimeError("Timed out waiting for a pooled MySQL connection")
+        try:
+            while True:
+                try:
+                    connection, created_at = self._idle.get_nowait()
+                except queue.Empty:
+                    return self._connect(), time.monotonic()
+                if time.monotonic() - created_at > self.max_lifetime:
+                    self._close(connection)
+                    continue
+                try:
+                    connection.ping(reconnect=False)
+                    return connection, created_at
+                except connector.Error:
+                    self._close(connection)
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def release(self, connection, created_at):
+        try:
+            # Drop uncommitted work so the next borrower gets a clean session
+            connection.rollback()
+            self._idle.put((connection, created_at))
+        except connector.Error:
+            self._close(connection)
+        finally:
+            self._slots.release()
+
+    def close(self):
+        while True:
+            try:
+                connection, _ = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            self._close(connection)
+
+    def _close(self, connection):
+        try:
+            connection.close()
+        except connector.Error:
+            pass
 
 
 class MySQLClient:
-    def __init__(self, host, user, password, database, port=3306, debug=False):
+    def __init__(
+        self,
+        host,
+        user,
+        password,
+        database,
+        port=3306,
+        debug=False,
+        pool_size=5,
+        pool_max_lifetime=3600,
+    ):
         self.host = host
         self.user = user
         self.password = password
         self.database = database
         self.port = port
-        self.connection = None
+        # Connections are kept per thread so one client can be shared by
+        # concurrent workers using `with client as db:`
+        self._local = threading.local()
         self.debug = debug
+        # pool_size=0 opens a new connection for every `with` block
+        self.pool = (
+            ConnectionPool(self._open, size=pool_size, max_lifetime=pool_max_lifetime)
+            if pool_size
+            else None
+        )
+
+    @property
+    def connection(self):
+        return getattr(self._local, "connection", None)
+
+    @connection.setter
+    def connection(self, connection):
+        self._local.connection = connection
+
+    def _open(self):
+        return connector.connect(
+            host=self.host,
+            user=self.user,
+            password=self.password,
+            database=self.database,
+            port=self.port,
+        )
 
     def connect(self):
         try:
-            self.connection = connector.connect(
-                host=self.host,
-                user=self.user,
-                password=self.password,
-                database=self.database,
-                port=self.port,
-            )
+            if self.pool:
+                self.connection, self._local.created_at = self.pool.acquire()
+            else:
+                self.connection = self._open()
             if self.debug:
                 print(f"Connected to {self.database} on {self.host}:{self.port}")
         except connector.Error as err:
@@ -27,7 +124,11 @@ class MySQLClient:
 
     def disconnect(self):
         if self.connection:
-            self.connection.close()
+            if self.pool:
+                self.pool.release(self.connection, self._local.created_at)
+            else:
+                self.connection.close()
+            self.connection = None
             if self.debug:
                 print("Database connection closed.")
 
@@ -56,11 +157,12 @@ class MySQLClient:
         finally:
             cursor.close()
 
-    def execute(self, query, params=None):
+    def execute(self, query, params=None, commit=True):
         try:
             cursor = self.connection.cursor()
             cursor.execute(query, params)
-            self.connection.commit()
+            if commit:
+                self.connection.commit()
             if self.debug:
                 print(f"Query executed: {query} with params: {params}")
         except connector.Error as err:
@@ -68,6 +170,27 @@ class MySQLClient:
         finally:
             cursor.close()
 
+    def executemany(self, query, seq_params, commit=True):
+        # commit=False leaves the transaction open for further statements
+        try:
+            cursor = self.connection.cursor()
+            cursor.executemany(query, seq_params)
+            if commit:
+                self.connection.commit()
+            if self.debug:
+                print(f"Query executed: {query} for {len(seq_params)} parameter sets")
+        except connector.Error as err:
+            self.connection.rollback()
+            raise RuntimeError(f"Failed to execute executemany: {err}")
+        finally:
+            cursor.close()
+
+    def commit(self):
+        try:
+            self.connection.commit()
+        except connector.Error as err:
+            raise RuntimeError(f"Failed to commit: {err}")
+
     def fetch_one(self, query):
         try:
             cursor = self.connection.cursor()
@@ -82,8 +205,14 @@ class MySQLClient:
             cursor.close()
 
     def __enter__(self):
-        self.connect()
+        # Nested blocks on the same thread share the outer connection
+        depth = getattr(self._local, "depth", 0)
+        if depth == 0:
+            self.connect()
+        self._local.depth = depth + 1
         return self
 
     def __exit__(self, exc_type, exc_value, traceback):
-        self.disconnect()
+        self._local.depth -= 1
+        if self._local.depth == 0:
+            self.disconnect()
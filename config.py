@@ -19,6 +19,28 @@ class EnvConfig:
     cosmosdb_account_key: str
     cosmosdb_database: str
     cosmosdb_container: str
+    consumer_mode: str
+    batch_max_messages: int
+    batch_max_wait_ms: int
+    batch_retry_backoff: float
+    batch_retry_max_backoff: float
+    worker_lanes: int
+    lane_capacity: int
+    model_cache_bytes: int
+    model_flush_interval: float
+    forecast_batch_rows: int
+    forecast_flush_interval: float
+    mysql_pool_size: int
+    mysql_pool_max_lifetime: float
+    satellite_catalog_refresh: float
+    location_index_refresh: float
+    trajectory_index_horizon: float
+    trajectory_index_refresh: float
+    trajectory_index_reload: float
+    forecast_cache_ttl: float
+    forecast_version_check_interval: float
+    observation_batch_rows: int
+    observation_retention: float
 
     def __init__(self, config: dict):
         self.weather_api_key = config["WEATHER_API_KEY"]
@@ -41,3 +63,34 @@ class EnvConfig:
         self.cosmosdb_account_key = config["COSMOSDB_ACCOUNT_KEY"]
         self.cosmosdb_database = config["COSMOSDB_DATABASE"]
         self.cosmosdb_container = config["COSMOSDB_CONTAINER"]
+        # Optional consumer tuning, defaults keep the original behaviour
+        self.consumer_mode = config.get("CONSUMER_MODE", "message")
+        self.batch_max_messages = int(config.get("BATCH_MAX_MESSAGES", 500))
+        self.batch_max_wait_ms = int(config.get("BATCH_MAX_WAIT_MS", 1000))
+        self.batch_retry_backoff = float(config.get("BATCH_RETRY_BACKOFF", 1))
+        self.batch_retry_max_backoff = float(config.get("BATCH_RETRY_MAX_BACKOFF", 60))
+        self.worker_lanes = int(config.get("WORKER_LANES", 4))
+        self.lane_capacity = int(config.get("LANE_CAPACITY", 100))
+        self.model_cache_bytes = int(config.get("MODEL_CACHE_BYTES", 512 * 1024**2))
+        self.model_flush_interval = float(config.get("MODEL_FLUSH_INTERVAL", 300))
+        self.forecast_batch_rows = int(config.get("FORECAST_BATCH_ROWS", 500))
+        self.forecast_flush_interval = float(config.get("FORECAST_FLUSH_INTERVAL", 5))
+        self.mysql_pool_size = int(config.get("MYSQL_POOL_SIZE", 5))
+        self.mysql_pool_max_lifetime = float(config.get("MYSQL_POOL_MAX_LIFETIME", 3600))
+        self.satellite_catalog_refresh = float(
+            config.get("SATELLITE_CATALOG_REFRESH", 3600)
+        )
+        self.location_index_refresh = float(config.get("LOCATION_INDEX_REFRESH", 300))
+        self.trajectory_index_horizon = float(
+            config.get("TRAJECTORY_INDEX_HORIZON", 48 * 3600)
+        )
+        self.trajectory_index_refresh = float(config.get("TRAJECTORY_INDEX_REFRESH", 60))
+        self.trajectory_index_reload = float(config.get("TRAJECTORY_INDEX_RELOAD", 3600))
+        self.forecast_cache_ttl = float(config.get("FORECAST_CACHE_TTL", 60))
+        self.forecast_version_check_interval = float(
+            config.get("FORECAST_VERSION_CHECK_INTERVAL", 1)
+        )
+        self.observation_batch_rows = int(config.get("OBSERVATION_BATCH_ROWS", 1000))
+        self.observation_retention = float(
+            config.get("OBSERVATION_RETENTION", 14 * 24 * 3600)
+        )
@@ -0,0 +1,147 @@
+"""
+Compare the direct forecasts of `NumpySNARIMAX` with the step by step
+recursion on a history file.
+
+The history is replayed message by message the way the consumer does it:
+the model learns the observation, the feature window moves on and 24 hourly
+values are forecast from 96 quarter-hourly steps. Both forecasting modes are
+timed on the same model state and compared with each other and with the
+observed hourly cloud cover.
+
+Usage:
+    python forecast_report.py --data weatherbatch.avro --messages 2000
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+from train_batch import LR, preprocess_data, read_avro
+from weather_predictions.feature_history import FeatureHistory
+from weather_predictions.snarimax import NumpySNARIMAX
+
+HORIZON = 4 * 24
+
+
+def hourly(forecasts):
+    """Clip and average the quarter-hourly forecasts like the consumer."""
+    return np.clip(np.array(forecasts), 0, 100).reshape(-1, 4).mean(axis=1)
+
+
+def replay(X, y, model, messages):
+    """
+    Learn the first part of the history, then forecast after every one of
+    the last `messages` observations with both modes.
+    Returns:
+        dict: Hourly forecasts of both modes, the observed hourly values
+            where the history covers the horizon, and the learning and
+            forecast times.
+    """
+    columns = list(X.columns)
+    X = X.to_numpy(dtype=float)
+    y = y.to_numpy(dtype=float)
+    start = max(HORIZON, len(y) - messages)
+    model.learn_many(y[HORIZON:start], X[: start - HORIZON])
+    x_hist = FeatureHistory.from_array(columns, X[start - HORIZON : start])
+
+    direct, recursive, actual = [], [], []
+    learn_time = direct_time = recursive_time = 0.0
+    for i in range(start, len(y)):
+        started = time.perf_counter()
+        model.learn_one(y[i], x_hist.values()[0])
+        x_hist.push(X[i])
+        learn_time += time.perf_counter() - started
+
+        started = time.perf_counter()
+        direct.append(hourly(model.forecast(HORIZON, x_hist.values())))
+        direct_time += time.perf_counter() - started
+        started = time.perf_counter()
+        recursive.append(
+            hourly(model.forecast(HORIZON, x_hist.values(), recursive=True))
+        )
+        recursive_time += time.perf_counter() - started
+
+        future = y[i + 1 : i + 1 + HORIZON]
+        actual.append(
+            future.reshape(-1, 4).mean(axis=1)
+            if len(future) == HORIZON
+            else np.full(HORIZON // 4, np.nan)
+        )
+    return {
+        "direct": np.array(direct),
+        "recursive": np.array(recursive),
+        "actual": np.array(actual),
+        "learn_time": learn_time,
+        "direct_time": direct_time,
+        "recursive_time": recursive_time,
+    }
+
+
+def report(result):
+    """
+    Print how far the modes differ and how close they are to the observations.
+    A diverging model overflows, the recursion to infinity, which clips to
+    100, and the direct forecasts possibly to NaN, so values are only compared
+    on the messages where both modes gave finite hourly values.
+    """
+    direct, recursive, actual = result["direct"], result["recursive"], result["actual"]
+    n = len(direct)
+    finite = np.isfinite(direct).all(axis=1) & np.isfinite(recursive).all(axis=1)
+    scored = finite & ~np.isnan(actual).any(axis=1)
+    print(f"Messages: {n}, diverged: {n - finite.sum()}, scored: {scored.sum()}")
+    difference = np.abs(direct[finite] - recursive[finite])
+    print(f"Max abs difference direct vs recursive: {difference.max(initial=0):.3g}")
+    learn = result["learn_time"]
+    for name, forecasts in (("recursive", recursive), ("direct", direct)):
+        errors = forecasts[scored] - actual[scored]
+        print(
+            f"{name:>9}: MAE {np.abs(errors).mean():.4f} "
+            f"RMSE {np.sqrt((errors**2).mean()):.4f} "
+            f"{1e6 * result[name + '_time'] / n:.0f}us per forecast, "
+            f"{1e6 * (learn + result[name + '_time']) / n:.0f}us per message"
+        )
+    speedup = (learn + result["recursive_time"]) / (learn + result["direct_time"])
+    print(
+        f"Speedup: {result['recursive_time'] / result['direct_time']:.1f}x "
+        f"per forecast, {speedup:.1f}x per message"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--data", default="weatherbatch.avro")
+    parser.add_argument("--messages", type=int, default=2000)
+    for name, default in (
+        ("p", 1),
+        ("d", 1),
+        ("q", 1),
+        ("sp", 1),
+        ("sd", 1),
+        ("sq", 1),
+    ):
+        parser.add_argument(f"--{name}", type=int, default=default)
+    parser.add_argument("--m", type=int, default=HORIZON)
+    # The hyperparameters the models are trained with
+    parser.add_argument("--l2", type=float, default=0.1)
+    parser.add_argument("--lr", type=float, default=LR)
+    args = parser.parse_args()
+
+    X, y = preprocess_data(read_avro(args.data))
+    model = NumpySNARIMAX(
+        args.p,
+        args.d,
+        args.q,
+        args.m,
+        args.sp,
+        args.sd,
+        args.sq,
+        l2=args.l2,
+        lr=args.lr,
+        intercept_lr=args.lr,
+    )
+    report(replay(X, y, model, args.messages))
+
+
+if __name__ == "__main__":
+    main()
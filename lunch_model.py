@@ -1,11 +1,15 @@
-import requests
-import json
+import argparse
+import asyncio
+import numpy as np
 import sys
 import time
-import fastavro
-from train_batch import train_model
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from train_batch import fit_model
+from train_search import best_candidate, load_results
 from clients.adls import ADLSClient
-import pickle
+from weather_predictions import state_codec
+from weather_predictions.backfill import Backfill
+from weather_predictions.model_publisher import ModelPublisher
 from dotenv import load_dotenv
 from config import EnvConfig
 import os
@@ -24,96 +28,132 @@ mysql_client = MySQLClient(
     "weather_db",
 )
 
-def get_historical_weather():
-    end_time = int(time.time())
-    start_time = end_time - 60*60*24*364
-    data = []
-    counter = 0
-    while start_time < end_time:
-        print(counter)
-        counter += 1
-        if counter > 100:
-            print("API request limit reached. Exiting.")
-            break
-        api_key = config.openweather_api_key
-        api_url = f"https://history.openweathermap.org/data/2.5/history/city?lat=51.7&lon=19.5&type=hour&start={start_time}&end={end_time}&units=metric&appid={api_key}"
-        response = requests.get(api_url)
-        # Check if the request was successful
-        if response.status_code == 200:
-            partial_data = response.json()['list']
-        else:
-            print(f"Failed to fetch API data. Status code: {response.status_code}, Message: {response.text}")
-            sys.exit(1)
-        start_time = partial_data[-1]['dt'] + 3600
-        data.extend(partial_data)
-        time.sleep(0.01)
-
-
-    # with open("output.json", "w") as file:
-    #     json.dump(data, file, indent=4)
-    # print("API output saved to output.json")
-    return data
-
-def save_avro(data):
-    data_new = []
-    for d in data:
-        d_new = {}
-        d_new['dt'] = d['dt']
-        d_new['temp'] = d['main']['temp']
-        d_new['pressure'] = d['main']['pressure']
-        d_new['humidity'] = d['main']['humidity']
-        d_new['wind_speed'] = d['wind']['speed']
-        d_new['wind_deg'] = d['wind']['deg']
-        d_new['precipitation'] = 0.0
-        if 'rain' in d:
-            d_new['precipitation'] += d['rain']['1h']
-        if 'snow' in d:
-            d_new['precipitation'] += d['snow']['1h']
-        d_new['clouds'] = d['clouds']['all']
-        data_new.append(d_new)
+def get_locations():
+    query = "SELECT id, latitude, longitude FROM locations"
+    with mysql_client as db:
+        return db.read(query, ()) or []
 
-            # Define the Avro schema
-    schema = {
-        "type": "record",
-        "name": "WeatherData",
-        "fields": [
-            {"name": "dt", "type": "long"},
-            {"name": "temp", "type": "float"},
-            {"name": "pressure", "type": "int"},
-            {"name": "humidity", "type": "int"},
-            {"name": "wind_speed", "type": "float"},
-            {"name": "wind_deg", "type": "int"},
-            {"name": "precipitation", "type": "float"},
-            {"name": "clouds", "type": "int"}
-        ]
-    }
+# Models whose backtest MAE is this many robust standard deviations above the
+# median of all locations are not uploaded
+OUTLIER_THRESHOLD = 5.0
+# Models are held back until this many scores can be compared
+OUTLIER_MIN_SCORES = 30
 
-    # Save the DataFrame as Avro
-    avro_path = "weatherbatch.avro"
-    with open(avro_path, "wb") as out_file:
-        fastavro.writer(out_file, schema, data_new)
+def train_location(location, history_dir, params=None):
+    """
+    Train the model of one location from its own history.
+    The history is read from `history_dir/<id>.avro`, as written by the backfill.
+    Args:
+        params (dict, optional): Hyperparameters of `fit_model`.
+    Returns:
+        tuple: Location id, encoded model state, training seconds and the
+            (mse, mae, n_scored) of the backtest.
+    """
+    started = time.perf_counter()
+    file_path = os.path.join(history_dir, f"{location['id']}.avro")
+    model_data, score = fit_model(file_path, **(params or {}))
+    return location['id'], state_codec.dumps(model_data), time.perf_counter() - started, score
 
-def send_to_adls(model_data, id):
-    model_data_pickle = pickle.dumps(model_data)
-    adls_client.upload_pickle("models", f"model_{id}.pkl", model_data_pickle)
+def outlier_limit(maes, threshold=OUTLIER_THRESHOLD):
+    """
+    MAE above which a model is an outlier, by the median and the median
+    absolute deviation of the finite scores so far.
+    Args:
+        maes (list[float]): Finite backtest MAEs.
+    Returns:
+        float: The limit, inf while it cannot be told yet.
+    """
+    if len(maes) < OUTLIER_MIN_SCORES:
+        return np.inf
+    maes = np.asarray(maes)
+    median = np.median(maes)
+    mad = 1.4826 * np.median(np.abs(maes - median))
+    return median + threshold * mad if mad > 0 else np.inf
 
-def get_location_ids():
-    query = "SELECT id FROM locations"
-    with mysql_client as db:
-        result = db.read(query, ())
-        if result:
-            return [row['id'] for row in result]
-        else:
-            return None
+def train_all_locations(locations, history_dir="histories", workers=None, upload_concurrency=16, params=None, outlier_threshold=OUTLIER_THRESHOLD):
+    """
+    Backfill the missing histories, then train one model per location over a
+    process pool, score every model with its one-step backtest and upload
+    every model as soon as its score is finite and not an outlier among the
+    scores so far. Only the first models wait until there are enough scores
+    to compare. Uploads run concurrently and are retried on transient errors.
+    Locations that fail to train, score or upload are reported and keep their
+    current model.
+    Args:
+        locations (list[dict]): Rows with `id`, `latitude` and `longitude`.
+        history_dir (str): Directory of the per-location history files.
+        workers (int, optional): Pool size, the number of CPUs by default.
+        upload_concurrency (int): Number of concurrent uploads.
+        params (dict, optional): Hyperparameters of `fit_model`.
+        outlier_threshold (float): Robust standard deviations above the median
+            MAE at which a model is rejected.
+    Returns:
+        dict: Ids of the locations that failed, with their errors.
+    """
+    missing = [location for location in locations if not os.path.exists(os.path.join(history_dir, f"{location['id']}.avro"))]
+    failed = {}
+    if missing:
+        print(f"Backfilling the history of {len(missing)} locations")
+        backfill = Backfill(config.openweather_api_key, history_dir)
+        failed.update(asyncio.run(backfill.run(missing)))
+        locations = [location for location in locations if location['id'] not in failed]
+    workers = workers or os.cpu_count()
+    print(f"Training {len(locations)} models on {workers} workers")
+    started = time.perf_counter()
+    maes = []
+    held = {}
+    publisher = ModelPublisher(adls_client, "models", upload_concurrency)
+    with publisher, ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(train_location, location, history_dir, params): location['id'] for location in locations}
+        for done, future in enumerate(as_completed(futures), 1):
+            try:
+                id, model_data_blob, _, (_, mae, _) = future.result()
+                if not np.isfinite(mae):
+                    raise ValueError("Model diverged")
+                maes.append(mae)
+                held[id] = (model_data_blob, mae)
+            except Exception as e:
+                print(f"Failed to train model {futures[future]}: {e}")
+                failed[futures[future]] = e
+            limit = outlier_limit(maes, outlier_threshold)
+            if limit < np.inf or done == len(futures):
+                for id, (model_data_blob, mae) in held.items():
+                    if mae > limit:
+                        failed[id] = ValueError(f"Outlying backtest MAE of {mae:.2f}, above {limit:.2f}")
+                    else:
+                        publisher.submit_bytes(id, model_data_blob)
+                held.clear()
+            if done % 50 == 0 or done == len(futures):
+                elapsed = time.perf_counter() - started
+                rate = done / elapsed
+                eta = (len(futures) - done) / rate
+                print(f"Trained {done}/{len(futures)} models, {rate:.1f} models/s, {elapsed:.0f}s elapsed, ETA {eta:.0f}s")
+    stats = publisher.stats()
+    failed.update(stats["failed"])
+    print(f"Uploaded {stats['uploaded']} models, {stats['uploaded_bytes'] / 1024**2:.1f} MiB, {stats['retried']} retries")
+    if failed:
+        print(f"{len(failed)} locations failed:")
+        for id in sorted(failed):
+            print(f"  {id}: {failed[id]!r}")
+    return failed
 
 if __name__ == "__main__":
-    #data = get_historical_weather()
-    #save_avro(data)
-    model_data = train_model()
-    ids = get_location_ids()
-    counter = 0
-    for id in ids:
-        counter += 1
-        if counter % 100 == 0:
-            print(f"Trained {counter} models")
-        send_to_adls(model_data, id)
+    parser = argparse.ArgumentParser(description="Train and upload one model per location")
+    parser.add_argument("--history-dir", default="histories")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--upload-concurrency", type=int, default=16)
+    parser.add_argument("--search-results", help="Train with the best candidate of a train_search.py results CSV")
+    parser.add_argument("--lr", type=float, help="Learning rate, train_batch.LR by default")
+    parser.add_argument("--outlier-threshold", type=float, default=OUTLIER_THRESHOLD)
+    args = parser.parse_args()
+    params = {}
+    if args.search_results:
+        params = best_candidate(load_results(args.search_results))
+        if params is None:
+            sys.exit(f"Every candidate in {args.search_results} diverged")
+        print(f"Training with {params}")
+    if args.lr is not None:
+        params["lr"] = args.lr
+    failed = train_all_locations(get_locations(), args.history_dir, args.workers, args.upload_concurrency, params, args.outlier_threshold)
+    if failed:
+        sys.exit(1)
@@ -5,22 +5,23 @@ from clients.kafka import KafkaConsumer
 from clients.mysql_client import MySQLClient
 from dotenv import load_dotenv
 import os
-import json
 from config import EnvConfig
 import numpy as np
-import pickle
-import math
 import datetime
 import pytz
-from concurrent.futures import ThreadPoolExecutor
-from queue import Queue
-
-POF = 1737288000
-
-
-def timeslot_id(timestamp):
-    return math.floor((timestamp - POF) / 60 * 15)
-
+from services.location_index import LOCATIONS_QUERY, LocationIndex
+from weather_predictions import state_codec, wire
+from weather_predictions.feature_history import FeatureHistory
+from weather_predictions.forecast_writer import ForecastWriter
+from weather_predictions.model_cache import ModelCache
+from weather_predictions.snarimax import NumpySNARIMAX
+from weather_predictions.observation_log import (
+    ObservationLog,
+    missing_slots,
+    timeslot_id,
+    timeslot_ids,
+)
+from weather_predictions.worker_pool import KeyedWorkerPool
 
 # Configure logging
 logging.basicConfig(
@@ -36,211 +37,420 @@ kafka_consumer = KafkaConsumer(
     broker=config.kafka_broker,
     group_id=config.kafka_group_id,
     topic=config.kafka_topic,
+    # Values may be Avro, wire.decode tells the formats apart
+    decode_values=False,
+    # Batch mode commits offsets itself once a batch is durable
+    enable_auto_commit=config.consumer_mode != "batch",
 )
 adls_client = ADLSClient(config.storage_account_name, config.storage_account_key)
 mysql_client = MySQLClient(
-    config.mysql_host, "weather_admin", config.mysql_password, "weather_db"
+    config.mysql_host,
+    "weather_admin",
+    config.mysql_password,
+    "weather_db",
+    pool_size=config.mysql_pool_size,
+    pool_max_lifetime=config.mysql_pool_max_lifetime,
 )
 
-# Create a thread pool for parallel processing
-executor = ThreadPoolExecutor(max_workers=4)
+model_cache = ModelCache(
+    adls_client,
+    config.container_name,
+    max_bytes=config.model_cache_bytes,
+    flush_interval=config.model_flush_interval,
+    dumps=state_codec.dumps,
+    loads=state_codec.loads,
+)
 
-# Queue for message processing
-message_queue = Queue()
+forecast_writer = ForecastWriter(
+    mysql_client,
+    max_rows=config.forecast_batch_rows,
+    flush_interval=config.forecast_flush_interval,
+)
+
+observation_log = ObservationLog(
+    mysql_client,
+    max_rows=config.observation_batch_rows,
+    flush_interval=config.forecast_flush_interval,
+    retention=config.observation_retention,
+)
+
+# Worker lanes keyed by location id for the concurrent consumer
+worker_pool = KeyedWorkerPool(
+    lanes=config.worker_lanes, lane_capacity=config.lane_capacity
+)
 
 
 def extract_data(message):
     try:
-        message = json.loads(message)
-        id = int(message["id"])
-        y = int(message["cloud_coverage"])
-        timestamp = int(message["timestamp"])
-
-        x = {
-            "dt": timestamp,
-            "temp": float(message["temperature"]),
-            "pressure": int(message["pressure"]),
-            "humidity": int(message["humidity"]),
-            "wind_speed": float(message["wind_speed"]),
-            "wind_deg": int(message["wind_direction"]),
-            "precipitation": float(message["precipitation"]),
-        }
-
-        return id, y, timestamp, x
-    except KeyError as e:
-        logging.error(f"Missing key in message: {e}")
+        return to_record(wire.decode(message))
+    except ValueError as e:
+        logging.error(e)
         return None
 
+
+def to_record(fields):
+    (
+        id,
+        timestamp,
+        y,
+        temperature,
+        pressure,
+        humidity,
+        wind_speed,
+        wind_direction,
+        precipitation,
+    ) = fields
+    x = {
+        "dt": timestamp,
+        "temp": temperature,
+        "pressure": pressure,
+        "humidity": humidity,
+        "wind_speed": wind_speed,
+        "wind_deg": wind_direction,
+        "precipitation": precipitation,
+    }
+    return id, y, timestamp, x
+
+
+def from_record(id, y, timestamp, x):
+    return np.array(
+        [
+            (
+                id,
+                timestamp,
+                y,
+                x["temp"],
+                x["pressure"],
+                x["humidity"],
+                x["wind_speed"],
+                x["wind_deg"],
+                x["precipitation"],
+            )
+        ],
+        dtype=wire.OBSERVATION_DTYPE,
+    )
+
 def unix_to_hour_pol(time):
     poland_tz = pytz.timezone("Europe/Warsaw")
     return datetime.datetime.fromtimestamp(time, poland_tz).hour
 
 
-def update_model(model, id, prev_timestamp, timestamp):
-    try:
-        time_id = timeslot_id(timestamp)
-        prev_timestamp_id = timeslot_id(prev_timestamp)
-
-        data = []
-        X = []
-        Y = []
-        seen_timeslot_ids = set()
-
-        # Assume data is fetched here
-        for weather in data:
-            ts_id = timeslot_id(weather["dt"])
-            if (
-                ts_id not in seen_timeslot_ids
-                and ts_id > prev_timestamp_id
-                and ts_id < time_id
-            ):
-                seen_timeslot_ids.add(ts_id)
-                x = {
-                    "dt": timestamp,
-                    "temp": float(weather["temperature"]),
-                    "pressure": int(weather["pressure"]),
-                    "humidity": int(weather["humidity"]),
-                    "wind_speed": float(weather["wind_speed"]),
-                    "wind_deg": int(weather["wind_direction"]),
-                    "precipitation": float(weather["precipitation"]),
-                }
-                y = int(weather["cloud_coverage"])
-                X.append(x)
-                Y.append(y)
-
-        if len(seen_timeslot_ids) == time_id - prev_timestamp_id - 1:
-            logging.info("All data available")
-        else:
-            logging.warning("Some data missing")
-
-        for x, y in zip(X, Y):
-            model.learn_one(y, x)
-
-    except Exception as e:
-        logging.error(f"Error in update_model: {e}")
+def update_model(model_data, id, observations):
+    """
+    Learn the observations of a location that are newer than its model.
+    Timeslots the model already learned are skipped, so replayed messages are
+    no-ops, and only the first observation of a timeslot is used. Timeslots
+    missing between the model and the observations are read back from the
+    observation log and replayed first, in timestamp order. Without a known
+    last timeslot every observation is learned and nothing is replayed.
+    Args:
+        model_data (dict): Checked out model data, updated in place.
+        id (int): Location id.
+        observations (np.ndarray): Observations with dtype `OBSERVATION_DTYPE`
+            in timestamp order.
+    Returns:
+        int: Number of observations learned.
+    """
+    last_slot = learned_slot(model_data)
+    slots = timeslot_ids(observations["timestamp"])
+    if last_slot is not None:
+        newer = slots > last_slot
+        observations, slots = observations[newer], slots[newer]
+    slots, first = np.unique(slots, return_index=True)
+    observations = observations[first]
+    if len(observations) == 0:
+        logging.info(f"Location {id} already learned these timeslots, skipping")
+        return 0
+
+    if last_slot is not None and len(slots) < slots[-1] - last_slot:
+        # np.unique keeps the first occurrence, so observations win over the log
+        logged = observation_log.fetch(id, last_slot, slots[-1])
+        observations = np.concatenate([observations, logged])
+        slots, first = np.unique(
+            timeslot_ids(observations["timestamp"]), return_index=True
+        )
+        observations = observations[first]
+        missing = missing_slots(slots, last_slot, slots[-1])
+        logging.info(
+            f"Location {id} catching up {len(observations)} timeslots, "
+            f"{len(missing)} missing"
+        )
 
+    model = model_data["model"]
+    x_hist = feature_history(model_data)
+    for fields in observations.tolist():
+        _, y, timestamp, x = to_record(fields)
+        learn_observation(model, x_hist, y, x)
+    model_data["timestamp"] = timestamp
+    return len(observations)
 
-def process_message(message):
-    #try:
-        logging.info(f"Processing message: {message}")
-        id, y, timestamp, x = extract_data(message)
 
-        if id is None:
-            return None
+def learned_slot(model_data):
+    """Timeslot of the last observation the model learned, None if unknown."""
+    timestamp = model_data.get("timestamp")
+    # Models saved before the observation log may hold their forecast here
+    if isinstance(timestamp, (int, np.integer)) and not isinstance(timestamp, bool):
+        return timeslot_id(timestamp)
+    return None
 
-        model_data = adls_client.load_pickled_model_from_container(
-            config.container_name, f"model_{id}.pkl"
-        )
-        model, previous_timestamp, x_hist = (
-            model_data["model"],
-            model_data["timestamp"],
-            model_data["x_hist"],
-        )
 
-        x["dt"] = unix_to_hour_pol(x["dt"])
+def learn_observation(model, x_hist, y, x):
+    x["dt"] = unix_to_hour_pol(x["dt"])
 
+    if uses_arrays(model, x_hist):
+        model.learn_one(y, x_hist.values()[0])
+    else:
         model.learn_one(y, x_hist[0])
 
-        x_hist = x_hist[1:] + [x]
-        forecast = (
-            np.clip(np.array(model.forecast(4 * 24, x_hist)), 0, 100)
-            .reshape(-1, 4)
-            .mean(axis=1)
-        )
+    x_hist.push(x)
+    return x_hist
 
-        update_forecast_to_mysql(id, forecast)
-        logging.info(f"Updated forecast for location {id}")
-        save_model(id, model, x_hist, forecast)
 
-    #except Exception as e:
-    #    logging.error(f"Error processing message: {message}")
+def feature_history(model_data):
+    x_hist = model_data["x_hist"]
+    if not isinstance(x_hist, FeatureHistory):
+        # Models saved before the ring buffer carry a list of dicts
+        x_hist = model_data["x_hist"] = FeatureHistory.from_records(x_hist)
+    return x_hist
 
 
-def update_forecast_to_mysql(id, forecast):
-    try:
-        update_query = """
-            UPDATE cloud_cover_forecasts SET
-                forecast_hour_1 = %s, forecast_hour_2 = %s, forecast_hour_3 = %s, 
-                forecast_hour_4 = %s, forecast_hour_5 = %s, forecast_hour_6 = %s, 
-                forecast_hour_7 = %s, forecast_hour_8 = %s, forecast_hour_9 = %s, 
-                forecast_hour_10 = %s, forecast_hour_11 = %s, forecast_hour_12 = %s, 
-                forecast_hour_13 = %s, forecast_hour_14 = %s, forecast_hour_15 = %s, 
-                forecast_hour_16 = %s, forecast_hour_17 = %s, forecast_hour_18 = %s, 
-                forecast_hour_19 = %s, forecast_hour_20 = %s, forecast_hour_21 = %s, 
-                forecast_hour_22 = %s, forecast_hour_23 = %s, forecast_hour_24 = %s
-            WHERE location_id = %s
-        """
-        values = tuple(forecast) + (id,)
-
-        with mysql_client as db:
-            db.execute(update_query, values)
+def uses_arrays(model, x_hist):
+    # The engine reads the window as array views when the columns line up
+    return isinstance(model, NumpySNARIMAX) and x_hist.columns == model.exog
 
-    except Exception as e:
-        logging.error(f"Error updating forecast to MySQL: {e}")
 
+def forecast_hourly(model, x_hist):
+    if uses_arrays(model, x_hist):
+        xs = x_hist.values()
+    else:
+        xs = x_hist.records()
+    return (
+        np.clip(np.array(model.forecast(4 * 24, xs)), 0, 100)
+        .reshape(-1, 4)
+        .mean(axis=1)
+    )
 
-def save_model(id, model, x_hist, timestamp):
-    try:
-        model_data_pickle = pickle.dumps(
-            {"model": model, "timestamp": timestamp, "x_hist": x_hist}
-        )
-        adls_client.upload_pickle("models", f"model_{id}.pkl", model_data_pickle)
 
-        # Save the forecast in ADLS or other storage
-    except Exception as e:
-        logging.error(f"Error saving model and forecast: {e}")
+def process_message(message):
+    #try:
+        logging.info(f"Processing message: {message}")
+        record = extract_data(message)
+
+        if record is None:
+            return None
+
+        process_record(*record)
+
+    #except Exception as e:
+    #    logging.error(f"Error processing message: {message}")
+
+
+def process_record(id, y, timestamp, x):
+    observations = from_record(id, y, timestamp, x)
+    observation_log.add(observations)
+    process_observations(id, observations)
+
+
+def process_observations(id, observations):
+    """
+    Learn logged observations of a location and write its forecast.
+    Args:
+        id (int): Location id.
+        observations (np.ndarray): Observations with dtype `OBSERVATION_DTYPE`,
+            already recorded in the observation log.
+    """
+    with model_cache.checkout(id) as model_data:
+        if model_data is None:
+            logging.error(f"No model found for location {id}, skipping")
+            return
+        if not update_model(model_data, id, observations):
+            return
+        forecast = forecast_hourly(model_data["model"], model_data["x_hist"])
+
+    forecast_writer.add(id, forecast)
+    logging.info(f"Updated forecast for location {id}")
+
+
+def process_batch(messages):
+    """
+    Process a batch of messages with one model round trip per location.
+    Messages are recorded in the observation log, grouped by location id and
+    applied in timestamp order after any timeslots the model missed, the
+    forecasts are written in a single transaction and every touched model is
+    checkpointed once. A location that fails, e.g. on a corrupt model, is
+    logged and skipped, its observations stay in the observation log. Errors
+    while persisting are propagated so that the caller does not commit the
+    offsets of a batch that is not durable.
+    Args:
+        messages (list[bytes]): Raw Kafka message values, JSON or Avro.
+    """
+    batch = wire.decode_batch(messages)
+    observation_log.add(batch)
+
+    ids = []
+    for id, location_observations in wire.group_by_location(batch):
+        try:
+            with model_cache.checkout(id) as model_data:
+                if model_data is None:
+                    logging.error(f"No model found for location {id}, skipping")
+                    continue
+                if not update_model(model_data, id, location_observations):
+                    continue
+                forecast = forecast_hourly(model_data["model"], model_data["x_hist"])
+        except Exception as e:
+            logging.error(f"Error processing location {id}, skipping: {e}")
+            continue
+        forecast_writer.add(id, forecast)
+        ids.append(id)
+
+    observation_log.flush()
+    forecast_writer.flush()
+    # Also models whose checkpoint failed in an earlier batch, a replay of
+    # that batch skips them because the cache already learned its timeslots
+    model_cache.flush()
+    logging.info(f"Processed batch of {len(messages)} messages for {len(ids)} locations")
+
+
+location_index = None
+
+
+def load_location_index():
+    global location_index
+    with mysql_client as db:
+        rows = db.read(LOCATIONS_QUERY)
+    location_index = LocationIndex.from_rows(rows) if rows else None
+    return location_index
 
 
 def get_location_id(lat, lon):
     try:
-        query = "SELECT id FROM locations WHERE latitude = %s AND longitude = %s"
-        values = (lat, lon)
-        with mysql_client as db:
-            result = db.read(query, values)
-            if result:
-                return result[0]["id"]
-            else:
-                return None
+        index = location_index or load_location_index()
+        id = index.lookup(lat, lon) if index is not None else None
+        if id is None:
+            # The location may have been added after the index was loaded
+            index = load_location_index()
+            id = index.lookup(lat, lon) if index is not None else None
+        return id
     except Exception as e:
         logging.error(f"Error fetching location ID: {e}")
         return None
 
 
-# def run_consumer():
-#     try:
-#         logging.info("Starting Kafka consumer...")
-#         while True:
-#             messages = kafka_consumer.consume_messages(timeout=0.01)
-#             logging.info("Batch of messages received")
-#             for message in messages:
-#                 logging.info("Processing message...")
-#                 message_queue.put(message)
-
-#            #ThreadPoolExecutor
-#             while not message_queue.empty():
-#                 message = message_queue.get()
-#                 executor.submit(process_message, message)
+def start_components():
+    """Start the background flushes of the streaming consumers."""
+    model_cache.start()
+    forecast_writer.start()
+    observation_log.start()
+
+
+def close_components():
+    """Stop the background flushes and write everything pending."""
+    observation_log.close()
+    forecast_writer.close()
+    model_cache.close()
+
+
+def poll_messages(timeout=0.01):
+    """Process the messages of one poll, one after the other."""
+    for message in kafka_consumer.consume_messages(timeout=timeout):
+        process_message(message)
+
+
+def poll_concurrent(timeout=0.01):
+    """Hand the messages of one poll to the worker lanes."""
+    for message in kafka_consumer.consume_messages(timeout=timeout):
+        record = extract_data(message)
+        if record is None:
+            continue
+        # Offsets are committed once polled, so log the observation
+        # before it waits in a lane, to be replayed after a crash
+        observations = from_record(*record)
+        observation_log.add(observations)
+        # Same location -> same lane, so x_hist and the model state
+        # are always updated in message order
+        worker_pool.submit(record[0], process_observations, record[0], observations)
+
+
+def poll_batch(max_messages=None, max_wait_ms=None, failures=0):
+    """
+    Process one batch and commit its offsets once it is durable. A failed
+    batch is rewound after an exponential backoff, to be consumed again.
+    Args:
+        max_messages (int, optional): By default `BATCH_MAX_MESSAGES`.
+        max_wait_ms (int, optional): By default `BATCH_MAX_WAIT_MS`.
+        failures (int): Number of consecutive failed batches so far.
+    Returns:
+        int: Number of consecutive failed batches.
+    """
+    messages = kafka_consumer.consume_batch(
+        max_messages=max_messages or config.batch_max_messages,
+        max_wait_ms=config.batch_max_wait_ms if max_wait_ms is None else max_wait_ms,
+    )
+    if not messages:
+        return failures
+    try:
+        process_batch(messages)
+    except Exception as e:
+        delay = min(
+            config.batch_retry_max_backoff,
+            config.batch_retry_backoff * 2**failures,
+        )
+        logging.error(f"Batch failed, rewinding to last commit in {delay:.1f}s: {e}")
+        time.sleep(delay)
+        kafka_consumer.rewind()
+        return failures + 1
+    kafka_consumer.commit()
+    return 0
 
-#     except KeyboardInterrupt:
-#         logging.info("Stopping Kafka consumer...")
-#     finally:
-#         kafka_consumer.close()
-#         executor.shutdown()
 
 def run_consumer():
     try:
         logging.info("Starting Kafka consumer...")
+        start_components()
+        while True:
+            poll_messages()
+    except KeyboardInterrupt:
+        logging.info("Stopping Kafka consumer...")
+    finally:
+        close_components()
+        kafka_consumer.close()
+
+
+def run_concurrent_consumer():
+    try:
+        logging.info(
+            f"Starting Kafka consumer with {config.worker_lanes} worker lanes..."
+        )
+        start_components()
+        while True:
+            poll_concurrent()
+    except KeyboardInterrupt:
+        logging.info("Stopping Kafka consumer...")
+    finally:
+        worker_pool.shutdown()
+        close_components()
+        kafka_consumer.close()
+
+
+def run_batch_consumer():
+    try:
+        logging.info("Starting Kafka consumer in batch mode...")
+        failures = 0
         while True:
-            messages = kafka_consumer.consume_messages(timeout=0.01)
-            for message in messages:
-                process_message(message)
+            failures = poll_batch(failures=failures)
     except KeyboardInterrupt:
         logging.info("Stopping Kafka consumer...")
     finally:
+        close_components()
         kafka_consumer.close()
 
 
 if __name__ == "__main__":
-    run_consumer()
+    if config.consumer_mode == "batch":
+        run_batch_consumer()
+    elif config.consumer_mode == "concurrent":
+        run_concurrent_consumer()
+    else:
+        run_consumer()
     #message = '{"precipitation":"0.0","cloud_coverage":"4","temperature":"4.45","humidity":"64","wind_speed":"3","wind_direction":"167","id":"918","pressure":"1021","timestamp":"1737375847"}'
     #process_message(message)
@@ -0,0 +1,137 @@
+import asyncio
+import logging
+import time
+
+from weather_predictions.forecast_writer import (
+    CHANGED_SINCE_QUERY,
+    FORECAST_VERSION_QUERY,
+)
+
+FORECAST_QUERY = "SELECT * FROM cloud_cover_forecasts WHERE location_id = %s"
+
+
+class _Entry:
+    __slots__ = ("row", "loaded_at")
+
+    def __init__(self, row, loaded_at):
+        self.row = row
+        self.loaded_at = loaded_at
+
+
+class ForecastCache:
+    """
+    Process-local cache of `cloud_cover_forecasts` rows keyed by location id.
+    The consumer bumps the `forecast_version` marker in the transaction that
+    writes new forecasts and records it as the version of every written
+    location in `forecast_changes`. When the marker moved, only the entries of
+    the locations changed since the last seen marker are dropped, including
+    loads in flight. The marker is polled at most every
+    `version_check_interval` seconds, and entries older than `ttl` seconds are
+    reloaded regardless, in case the marker cannot be read. Concurrent misses
+    of one location share a single query.
+    Args:
+        mysql_client (AsyncMySQLClient): Client of the weather database.
+        ttl (float): Maximum age of an entry in seconds.
+        version_check_interval (float): Seconds between marker polls.
+    """
+
+    def __init__(self, mysql_client, ttl=60, version_check_interval=1.0):
+        self.mysql_client = mysql_client
+        self.ttl = ttl
+        self.version_check_interval = version_check_interval
+        self.hits = 0
+        self.misses = 0
+        self._entries = {}
+        self._loading = {}
+        # Locations changed while their load was in flight
+        self._stale = set()
+        self._version = None
+        self._checked_at = None
+        self._lock = asyncio.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "version": self._version,
+        }
+
+    async def get(self, location_id):
+        """
+        Get the forecast row of a location.
+        Args:
+            location_id (int): Location id.
+        Returns:
+            dict | None: The row, None if the location has no forecast.
+        """
+        await self._check_version()
+        entry = self._entries.get(location_id)
+        if entry is not None and time.monotonic() - entry.loaded_at <= self.ttl:
+            self.hits += 1
+            return entry.row
+
+        self.misses += 1
+        loading = self._loading.get(location_id)
+        if loading is None:
+            loading = asyncio.ensure_future(self._load(location_id))
+            self._loading[location_id] = loading
+            loading.add_done_callback(lambda _: self._loading.pop(location_id, None))
+        return await asyncio.shield(loading)
+
+    def invalidate(self, location_id=None):
+        if location_id is None:
+            self._entries.clear()
+        else:
+            self._entries.pop(location_id, None)
+
+    async def _load(self, location_id):
+        self._stale.discard(location_id)
+        loaded_at = time.monotonic()
+        data = await self.mysql_client.read(FORECAST_QUERY, (location_id,))
+        row = data[0] if data else None
+        # A row changed during the query may be older than the change
+        if row is not None and location_id not in self._stale:
+            self._entries[location_id] = _Entry(row, loaded_at)
+        self._stale.discard(location_id)
+        return row
+
+    def _drop(self, location_ids):
+        for location_id in location_ids:
+            self._entries.pop(location_id, None)
+            if location_id in self._loading:
+                self._stale.add(location_id)
+
+    async def _check_version(self):
+        if (
+            self._checked_at is not None
+            and time.monotonic() - self._checked_at <= self.version_check_interval
+        ):
+            return
+        async with self._lock:
+            if (
+                self._checked_at is not None
+                and time.monotonic() - self._checked_at <= self.version_check_interval
+            ):
+                return
+            version = self._version
+            try:
+                data = await self.mysql_client.read(FORECAST_VERSION_QUERY)
+                version = data[0]["version"] if data else 0
+                if self._version is None or version < self._version:
+                    # First check, or the tables were reset
+                    self._drop(list(self._entries) + list(self._loading))
+                elif version > self._version:
+                    changed = await self.mysql_client.read(
+                        CHANGED_SINCE_QUERY, (self._version, version)
+                    )
+                    self._drop(row["location_id"] for row in changed)
+            except RuntimeError as e:
+                # Without the marker entries only expire through the TTL
+                logging.error(f"Error reading forecast version: {e}")
+                version = self._version
+            self._version = version
+            self._checked_at = time.monotonic()
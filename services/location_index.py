@@ -0,0 +1,251 @@
+import asyncio
+import math
+import time
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+# Matches the 111.045 km per degree used by the former SQL distance
+KM_PER_DEGREE = 111.045
+
+
+def _unit_vectors(latitudes, longitudes):
+    lat = np.radians(np.asarray(latitudes, dtype=float))
+    lon = np.radians(np.asarray(longitudes, dtype=float))
+    return np.stack(
+        [np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)], axis=-1
+    )
+
+
+def great_circle_km(lat1, lon1, lat2, lon2):
+    """Spherical law of cosines distance, as computed by the old SQL query."""
+    if np.isscalar(lat1) and np.isscalar(lat2):
+        lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+        cos_angle = math.sin(lat1) * math.sin(lat2) + math.cos(lat1) * math.cos(
+            lat2
+        ) * math.cos(lon1 - lon2)
+        return KM_PER_DEGREE * math.degrees(math.acos(min(max(cos_angle, -1), 1)))
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    cos_angle = np.sin(lat1) * np.sin(lat2) + np.cos(lat1) * np.cos(lat2) * np.cos(
+        lon1 - lon2
+    )
+    return KM_PER_DEGREE * np.degrees(np.arccos(np.clip(cos_angle, -1, 1)))
+
+
+class _Grid:
+    """Regular latitude/longitude grid, as generated by initialize_tables."""
+
+    def __init__(self, lat0, lat_step, lon0, lon_step, ids):
+        self.lat0 = lat0
+        self.lat_step = lat_step
+        self.lon0 = lon0
+        self.lon_step = lon_step
+        self.ids = ids
+
+    @classmethod
+    def detect(cls, ids, latitudes, longitudes):
+        lat_axis = cls._axis(latitudes)
+        lon_axis = cls._axis(longitudes)
+        if lat_axis is None or lon_axis is None:
+            return None
+        (lat0, lat_step, n_lat), (lon0, lon_step, n_lon) = lat_axis, lon_axis
+        if n_lat * n_lon != len(ids):
+            return None
+        rows = np.rint((latitudes - lat0) / lat_step).astype(int)
+        cols = np.rint((longitudes - lon0) / lon_step).astype(int)
+        grid_ids = np.full((n_lat, n_lon), -1, dtype=np.int64)
+        grid_ids[rows, cols] = ids
+        if (grid_ids < 0).any():
+            return None
+        return cls(lat0, lat_step, lon0, lon_step, grid_ids)
+
+    @staticmethod
+    def _axis(values):
+        # Coordinates may come back from a FLOAT column, hence the rounding
+        axis = np.unique(np.round(values, 4))
+        if len(axis) < 2:
+            return None
+        steps = np.diff(axis)
+        step = steps.mean()
+        if not np.allclose(steps, step, rtol=1e-3, atol=0):
+            return None
+        if not np.allclose(
+            values,
+            axis[0] + np.rint((values - axis[0]) / step) * step,
+            atol=1e-3 * step,
+        ):
+            return None
+        return axis[0], step, len(axis)
+
+    def nearest(self, latitudes, longitudes):
+        n_lat, n_lon = self.ids.shape
+        latitudes = np.asarray(latitudes, dtype=float)
+        longitudes = np.asarray(longitudes, dtype=float)
+        # For a fixed row the closest column is the closest longitude
+        cols = np.clip(np.rint((longitudes - self.lon0) / self.lon_step), 0, n_lon - 1)
+        col_lons = self.lon0 + cols * self.lon_step
+        # Along that column the great circle distance is smallest at the
+        # latitude psi, slightly poleward of the query latitude
+        lat = np.radians(latitudes)
+        psi = np.degrees(
+            np.arctan2(
+                np.sin(lat), np.cos(lat) * np.cos(np.radians(longitudes - col_lons))
+            )
+        )
+        lower = np.clip(np.floor((psi - self.lat0) / self.lat_step), 0, n_lat - 1)
+        upper = np.clip(lower + 1, 0, n_lat - 1)
+        lower_km = great_circle_km(
+            latitudes, longitudes, self.lat0 + lower * self.lat_step, col_lons
+        )
+        upper_km = great_circle_km(
+            latitudes, longitudes, self.lat0 + upper * self.lat_step, col_lons
+        )
+        rows = np.where(upper_km < lower_km, upper, lower)
+        return self.ids[rows.astype(int), cols.astype(int)]
+
+    def nearest_one(self, lat, lon):
+        # Scalar version of `nearest`, avoids numpy overhead for single queries
+        n_lat, n_lon = self.ids.shape
+        col = min(max(round((lon - self.lon0) / self.lon_step), 0), n_lon - 1)
+        col_lon = self.lon0 + col * self.lon_step
+        psi = math.degrees(
+            math.atan2(
+                math.sin(math.radians(lat)),
+                math.cos(math.radians(lat)) * math.cos(math.radians(lon - col_lon)),
+            )
+        )
+        lower = min(max(math.floor((psi - self.lat0) / self.lat_step), 0), n_lat - 1)
+        upper = min(lower + 1, n_lat - 1)
+        lower_km = great_circle_km(lat, lon, self.lat0 + lower * self.lat_step, col_lon)
+        upper_km = great_circle_km(lat, lon, self.lat0 + upper * self.lat_step, col_lon)
+        row = upper if upper_km < lower_km else lower
+        return int(self.ids[row, col])
+
+
+class LocationIndex:
+    """
+    Nearest-location index over the `locations` table.
+    Regular grids are answered with grid arithmetic, everything else (and
+    k-nearest queries) with a KD-tree over unit vectors, whose chord distance
+    orders points like the great circle distance.
+    Args:
+        ids (Sequence[int]): Location ids.
+        latitudes (Sequence[float]): Latitudes in degrees.
+        longitudes (Sequence[float]): Longitudes in degrees.
+    """
+
+    def __init__(self, ids, latitudes, longitudes):
+        self.ids = np.asarray(ids, dtype=np.int64)
+        self.latitudes = np.asarray(latitudes, dtype=float)
+        self.longitudes = np.asarray(longitudes, dtype=float)
+        if len(self.ids) == 0:
+            raise ValueError("Cannot build a location index without locations")
+        self._tree = cKDTree(_unit_vectors(self.latitudes, self.longitudes))
+        self._grid = _Grid.detect(self.ids, self.latitudes, self.longitudes)
+        self._positions = {id: i for i, id in enumerate(self.ids.tolist())}
+
+    @classmethod
+    def from_rows(cls, rows):
+        """Build the index from `{"id", "latitude", "longitude"}` rows."""
+        return cls(
+            [row["id"] for row in rows],
+            [float(row["latitude"]) for row in rows],
+            [float(row["longitude"]) for row in rows],
+        )
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def is_grid(self):
+        return self._grid is not None
+
+    def nearest(self, lat: float, lon: float) -> int:
+        if self._grid is not None:
+            return self._grid.nearest_one(lat, lon)
+        _, position = self._tree.query(_unit_vectors(lat, lon))
+        return int(self.ids[position])
+
+    def nearest_many(self, latitudes, longitudes) -> np.ndarray:
+        """
+        Find the nearest location of many coordinates at once.
+        Args:
+            latitudes (array-like): Latitudes in degrees.
+            longitudes (array-like): Longitudes in degrees.
+        Returns:
+            np.ndarray: Location ids.
+        """
+        if self._grid is not None:
+            return self._grid.nearest(latitudes, longitudes)
+        _, positions = self._tree.query(_unit_vectors(latitudes, longitudes))
+        return self.ids[positions]
+
+    def k_nearest(self, lat: float, lon: float, k: int) -> list[int]:
+        k = min(k, len(self.ids))
+        _, positions = self._tree.query(_unit_vectors(lat, lon), k=k)
+        return self.ids[np.atleast_1d(positions)].tolist()
+
+    def lookup(self, lat: float, lon: float, tolerance: float = 1e-4):
+        """
+        Get the id of the location at the given coordinates.
+        Returns:
+            int | None: The id, or None if no location is within `tolerance` degrees.
+        """
+        id = self.nearest(lat, lon)
+        i = self._positions[id]
+        if (
+            abs(self.latitudes[i] - lat) <= tolerance
+            and abs(self.longitudes[i] - lon) <= tolerance
+        ):
+            return id
+        return None
+
+
+LOCATIONS_QUERY = "SELECT id, latitude, longitude FROM locations"
+LOCATIONS_VERSION_QUERY = "SELECT COUNT(*) AS count, MAX(id) AS max_id FROM locations"
+
+
+class AsyncLocationIndex:
+    """
+    Location index of the API, rebuilt when the locations table changes.
+    At most every `refresh_interval` seconds the row count and the highest id
+    are compared with the ones the index was built from, and the index is
+    reloaded if they differ.
+    Args:
+        mysql_client (AsyncMySQLClient): Client of the weather database.
+        refresh_interval (float): Seconds between change checks.
+    """
+
+    def __init__(self, mysql_client, refresh_interval=300):
+        self.mysql_client = mysql_client
+        self.refresh_interval = refresh_interval
+        self._index = None
+        self._version = None
+        self._checked_at = None
+        self._lock = asyncio.Lock()
+
+    async def get(self):
+        """
+        Returns:
+            LocationIndex | None: The current index, None if there are no locations.
+        """
+        if (
+            self._checked_at is None
+            or time.monotonic() - self._checked_at > self.refresh_interval
+        ):
+            async with self._lock:
+                if (
+                    self._checked_at is None
+                    or time.monotonic() - self._checked_at > self.refresh_interval
+                ):
+                    await self.refresh()
+        return self._index
+
+    async def refresh(self):
+        version = await self.mysql_client.read(LOCATIONS_VERSION_QUERY)
+        version = (version[0]["count"], version[0]["max_id"])
+        if self._index is None or version != self._version:
+            rows = await self.mysql_client.read(LOCATIONS_QUERY)
+            self._index = LocationIndex.from_rows(rows) if rows else None
+            self._version = version
+        self._checked_at = time.monotonic()
@@ -0,0 +1,64 @@
+import asyncio
+import time
+
+
+class SatelliteCatalog:
+    """
+    In-memory map of satellite ids to names.
+    The whole `satellites` table is loaded in one query and reloaded every
+    `refresh_interval` seconds. Ids that are not in the map yet, e.g. satellites
+    NiFi inserted since the last load, are fetched together with a single
+    `WHERE id IN (...)` query and added to the map.
+    Args:
+        mysql_client (AsyncMySQLClient): Client of the satellite database.
+        refresh_interval (float): Seconds between full reloads.
+    """
+
+    def __init__(self, mysql_client, refresh_interval=3600):
+        self.mysql_client = mysql_client
+        self.refresh_interval = refresh_interval
+        self._names = {}
+        self._loaded_at = None
+        self._lock = asyncio.Lock()
+
+    def __len__(self):
+        return len(self._names)
+
+    async def load(self):
+        data = await self.mysql_client.read("SELECT id, name FROM satellites")
+        self._names = {row["id"]: row["name"] for row in data}
+        self._loaded_at = time.monotonic()
+
+    async def names(self, ids) -> dict[int, str]:
+        """
+        Get names of satellites.
+        Args:
+            ids (Iterable[int]): Satellite ids.
+        Returns:
+            dict[int, str]: Names of the satellites that exist in the database.
+        """
+        ids = set(ids)
+        if (
+            self._loaded_at is None
+            or time.monotonic() - self._loaded_at > self.refresh_interval
+        ):
+            async with self._lock:
+                # Another request may have reloaded while we were waiting
+                if (
+                    self._loaded_at is None
+                    or time.monotonic() - self._loaded_at > self.refresh_interval
+                ):
+                    await self.load()
+
+        missing = [id for id in ids if id not in self._names]
+        if missing:
+            await self._fetch(missing)
+        return {id: self._names[id] for id in ids if id in self._names}
+
+    async def _fetch(self, ids):
+        placeholders = ", ".join(["%s"] * len(ids))
+        data = await self.mysql_client.read(
+            f"SELECT id, name FROM satellites WHERE id IN ({placeholders})", tuple(ids)
+        )
+        for row in data:
+            self._names[row["id"]] = row["name"]
@@ -0,0 +1,208 @@
+import asyncio
+import time
+
+import numpy as np
+
+TRAJECTORIES_QUERY = """
+    SELECT satid, startUTC, endUTC, startAz, endAz FROM trajectories
+    WHERE endUTC > %s AND endUTC <= %s
+    ORDER BY endUTC
+"""
+
+
+class TrajectoryIndex:
+    """
+    Immutable index of satellite passes sorted by end time.
+    Range queries use the predicate of the former SQL queries: a pass matches
+    [t0, t1] if it ends after t0 and before `t1 + end_slack` and starts before
+    t1. The end bounds select a contiguous slice found by binary search, the
+    start condition is then applied to that slice only. Passes are also
+    grouped by satellite, each group sorted by end time.
+    Args:
+        satids, starts, ends (array-like): Pass columns, sorted by `ends`.
+        start_azimuths, end_azimuths (array-like): Pass azimuths.
+    """
+
+    def __init__(self, satids, starts, ends, start_azimuths, end_azimuths):
+        self.satids = np.asarray(satids, dtype=np.int64)
+        self.starts = np.asarray(starts, dtype=np.int64)
+        self.ends = np.asarray(ends, dtype=np.int64)
+        self.start_azimuths = np.asarray(start_azimuths, dtype=float)
+        self.end_azimuths = np.asarray(end_azimuths, dtype=float)
+
+        order = np.lexsort((self.ends, self.satids))
+        grouped = self.satids[order]
+        bounds = np.flatnonzero(np.diff(grouped)) + 1
+        self._by_satellite = {
+            int(self.satids[positions[0]]): positions
+            for positions in np.split(order, bounds)
+            if len(positions)
+        }
+
+    @classmethod
+    def empty(cls):
+        return cls([], [], [], [], [])
+
+    @classmethod
+    def from_rows(cls, rows):
+        """Build the index from trajectory rows sorted by `endUTC`."""
+        return cls(
+            [row["satid"] for row in rows],
+            [row["startUTC"] for row in rows],
+            [row["endUTC"] for row in rows],
+            [row["startAz"] for row in rows],
+            [row["endAz"] for row in rows],
+        )
+
+    def __len__(self):
+        return len(self.ends)
+
+    def extend(self, rows):
+        """Return a new index with passes ending after every indexed pass added."""
+        if not rows:
+            return self
+        added = TrajectoryIndex.from_rows(rows)
+        return TrajectoryIndex(
+            *(
+                np.concatenate([old, new])
+                for old, new in zip(self._columns(), added._columns())
+            )
+        )
+
+    def expire(self, before):
+        """Return a new index without the passes that ended at or before `before`."""
+        first = np.searchsorted(self.ends, before, side="right")
+        if first == 0:
+            return self
+        return TrajectoryIndex(*(column[first:] for column in self._columns()))
+
+    def overlapping(self, t0, t1, end_slack=600):
+        """
+        Get the passes overlapping [t0, t1].
+        Returns:
+            list[dict]: Passes in the `trajectories` row format.
+        """
+        first = np.searchsorted(self.ends, t0, side="right")
+        last = np.searchsorted(self.ends, t1 + end_slack, side="left")
+        positions = np.arange(first, last)
+        return self._rows(positions[self.starts[first:last] < t1])
+
+    def satellite_passes(self, satid, t0, t1, end_slack=1200):
+        """
+        Get the passes of one satellite overlapping [t0, t1].
+        Returns:
+            list[dict]: Passes in the `trajectories` row format.
+        """
+        positions = self._by_satellite.get(satid)
+        if positions is None:
+            return []
+        ends = self.ends[positions]
+        first = np.searchsorted(ends, t0, side="right")
+        last = np.searchsorted(ends, t1 + end_slack, side="left")
+        positions = positions[first:last]
+        return self._rows(positions[self.starts[positions] < t1])
+
+    def _columns(self):
+        return (
+            self.satids,
+            self.starts,
+            self.ends,
+            self.start_azimuths,
+            self.end_azimuths,
+        )
+
+    def _rows(self, positions):
+        return [
+            {
+                "satid": satid,
+                "startUTC": start,
+                "endUTC": end,
+                "startAz": start_az,
+                "endAz": end_az,
+            }
+            for satid, start, end, start_az, end_az in zip(
+                *(column[positions].tolist() for column in self._columns())
+            )
+        ]
+
+
+class AsyncTrajectoryIndex:
+    """
+    Trajectory index of the API covering the passes of the next `horizon`
+    seconds, plus those that ended in the last `retention` seconds.
+    Every `refresh_interval` seconds passes ending beyond the covered window
+    are appended and expired ones dropped. Passes inserted inside the already
+    covered window are picked up by a full reload every `reload_interval`
+    seconds. Queries reaching outside the window return None, so the caller
+    can fall back to MySQL.
+    Args:
+        mysql_client (AsyncMySQLClient): Client of the satellite database.
+        horizon (float): Seconds ahead of now to index.
+        retention (float): Seconds to keep passes after they ended.
+        refresh_interval (float): Seconds between incremental loads.
+        reload_interval (float): Seconds between full reloads.
+    """
+
+    def __init__(
+        self,
+        mysql_client,
+        horizon=48 * 3600,
+        retention=3600,
+        refresh_interval=60,
+        reload_interval=3600,
+    ):
+        self.mysql_client = mysql_client
+        self.horizon = horizon
+        self.retention = retention
+        self.refresh_interval = refresh_interval
+        self.reload_interval = reload_interval
+        self._index = None
+        self._covered = None
+        self._refreshed_at = None
+        self._reloaded_at = None
+        self._lock = asyncio.Lock()
+
+    async def overlapping(self, t0, t1, end_slack=600):
+        index = await self._get(t0, t1 + end_slack)
+        return None if index is None else index.overlapping(t0, t1, end_slack)
+
+    async def satellite_passes(self, satid, t0, t1, end_slack=1200):
+        index = await self._get(t0, t1 + end_slack)
+        return (
+            None if index is None else index.satellite_passes(satid, t0, t1, end_slack)
+        )
+
+    async def _get(self, t0, t1):
+        if self._refreshed_at is None or self._stale(
+            self._refreshed_at, self.refresh_interval
+        ):
+            async with self._lock:
+                if self._refreshed_at is None or self._stale(
+                    self._refreshed_at, self.refresh_interval
+                ):
+                    await self.refresh()
+        covered_from, covered_until = self._covered
+        if t0 < covered_from or t1 > covered_until:
+            return None
+        return self._index
+
+    async def refresh(self):
+        now = int(time.time())
+        covered_from, covered_until = now - self.retention, now + self.horizon
+        if self._index is None or self._stale(self._reloaded_at, self.reload_interval):
+            rows = await self.mysql_client.read(
+                TRAJECTORIES_QUERY, (covered_from, covered_until)
+            )
+            self._index = TrajectoryIndex.from_rows(rows)
+            self._reloaded_at = time.monotonic()
+        else:
+            rows = await self.mysql_client.read(
+                TRAJECTORIES_QUERY, (self._covered[1], covered_until)
+            )
+            self._index = self._index.extend(rows).expire(covered_from)
+        self._covered = (covered_from, covered_until)
+        self._refreshed_at = time.monotonic()
+
+    @staticmethod
+    def _stale(timestamp, interval):
+        return time.monotonic() - timestamp > interval
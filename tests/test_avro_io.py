@@ -0,0 +1,59 @@
+import fastavro
+import numpy as np
+import pytest
+
+from weather_predictions import avro_io
+
+SCHEMA = {
+    "type": "record",
+    "name": "Row",
+    "fields": [{"name": "dt", "type": "long"}, {"name": "temp", "type": "double"}],
+}
+
+
+@pytest.fixture
+def path(tmp_path):
+    path = tmp_path / "history.avro"
+    records = ({"dt": 3600 * i, "temp": i / 10} for i in range(2000))
+    # Small blocks, so ranges start and end inside many of them
+    avro_io.write(path, SCHEMA, records, sync_interval=256)
+    return path
+
+
+def test_first_value_leaves_the_block_readable(path):
+    # _first_value rewinds fastavro's private buffer, fail loudly if it changes
+    with open(path, "rb") as f:
+        blocks = list(fastavro.block_reader(f))
+    assert len(blocks) > 10
+    first = 0
+    for block in blocks:
+        assert hasattr(block, "bytes_")
+        assert avro_io._first_value(block, "dt") == first
+        records = list(block)
+        assert len(records) == block.num_records
+        assert records[0]["dt"] == first
+        first = records[-1]["dt"] + 3600
+
+
+@pytest.mark.parametrize(
+    "start, end",
+    [
+        (None, None),
+        (0, 3600),
+        (1800, 900000),
+        (3600 * 1500, None),
+        (None, 1),
+        (10**9, None),
+    ],
+)
+def test_ranges_match_a_full_scan(path, start, end):
+    with open(path, "rb") as f:
+        rows = list(fastavro.reader(f))
+    expected = [
+        row["dt"]
+        for row in rows
+        if (start is None or row["dt"] >= start) and (end is None or row["dt"] < end)
+    ]
+    columns = avro_io.read_columns(path, start, end, chunk_size=100)
+    np.testing.assert_array_equal(columns["dt"], expected)
+    assert columns["temp"].dtype == np.float64
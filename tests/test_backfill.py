@@ -0,0 +1,116 @@
+import asyncio
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import fastavro
+import pytest
+
+from weather_predictions.backfill import HISTORY_SECONDS, Backfill
+
+END_TIME = 1_700_000_000 - 1_700_000_000 % 3600
+PAGE_SIZE = 24 * 7
+
+
+class StubHistoryAPI(BaseHTTPRequestHandler):
+    """Pages hourly items like the history API, lat 0 is an unknown city."""
+
+    requests = []
+    throttle = set()
+
+    def do_GET(self):
+        query = {k: v[0] for k, v in parse_qs(urlparse(self.path).query).items()}
+        self.requests.append(query)
+        key = (query["lat"], query["start"])
+        if key in self.throttle:
+            self.throttle.discard(key)
+            return self._reply(429, {"message": "Too many requests"})
+        if float(query["lat"]) == 0:
+            return self._reply(404, {"message": "city not found"})
+        start, end = int(query["start"]), int(query["end"])
+        # Align to the hour, like the API, so pages may overlap
+        first = start - start % 3600
+        items = [
+            {
+                "dt": dt,
+                "main": {"temp": 1.5, "pressure": 1000, "humidity": 80},
+                "wind": {"speed": 2.0, "deg": 90},
+                "clouds": {"all": dt // 3600 % 100},
+                "rain": {"1h": 0.5},
+            }
+            for dt in range(first, min(end, first + PAGE_SIZE * 3600), 3600)
+        ]
+        self._reply(200, {"list": items})
+
+    def _reply(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def api():
+    StubHistoryAPI.requests = []
+    StubHistoryAPI.throttle = set()
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubHistoryAPI)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_port}/history/city", StubHistoryAPI
+    server.shutdown()
+    server.server_close()
+
+
+def read_dts(path):
+    with open(path, "rb") as f:
+        return [record["dt"] for record in fastavro.reader(f)]
+
+
+def backfill(url, out_dir):
+    return Backfill(
+        "key",
+        str(out_dir),
+        rate=1000,
+        concurrency=4,
+        chunk_size=500,
+        backoff=0.01,
+        url=url,
+    )
+
+
+def test_backfill_resumes_and_reports_failures(api, tmp_path):
+    url, stub = api
+    locations = [
+        {"id": 1, "latitude": 51.7, "longitude": 19.5},
+        {"id": 2, "latitude": 52.1, "longitude": 21.0},
+        {"id": 3, "latitude": 0.0, "longitude": 0.0},
+    ]
+    first_end = END_TIME - 24 * 3600
+    stub.throttle.add(("51.7", str(first_end - HISTORY_SECONDS)))
+    failed = asyncio.run(backfill(url, tmp_path).run(locations, end_time=first_end))
+
+    assert list(failed) == [3]
+    assert not stub.throttle
+    expected = list(range(first_end - HISTORY_SECONDS, first_end, 3600))
+    assert read_dts(tmp_path / "1.avro") == expected
+    assert read_dts(tmp_path / "2.avro") == expected
+    assert not (tmp_path / "3.avro").exists()
+    assert all(query["appid"] == "key" for query in stub.requests)
+
+    # A later run only fetches the new day and appends it
+    stub.requests.clear()
+    failed = asyncio.run(backfill(url, tmp_path).run(locations[:2], end_time=END_TIME))
+
+    assert failed == {}
+    assert len(stub.requests) == 2
+    assert read_dts(tmp_path / "1.avro") == expected + list(
+        range(first_end, END_TIME, 3600)
+    )
+    with open(tmp_path / "checkpoint.json") as f:
+        assert json.load(f) == {"1": END_TIME - 3600, "2": END_TIME - 3600}
@@ -0,0 +1,30 @@
+from benchmarks import pipeline, replay, synthetic
+
+
+def test_pipeline_benchmark_runs_offline():
+    results = pipeline.run(locations=5, timeslots=3, mode="batch", format="avro")
+
+    assert results["messages"] == 15
+    assert results["forecasts_written"] == 5
+    assert results["observations_logged"] == 15
+    assert results["io_calls"]["adls"] == {"download_bytes": 5, "upload_bytes": 5}
+    assert set(results["stages"]) == set(pipeline.STAGES)
+    assert results["stages"]["forecast"]["calls"] == 5
+    assert results["messages_per_second"] > 0
+
+
+def test_replay_recording_in_process(tmp_path):
+    path = str(tmp_path / "traffic.avro")
+    ids = [101, 102, 103]
+    start = synthetic.start_timestamp()
+    assert replay.synthesize(path, ids, 2, start, format="avro") == 6
+
+    main = pipeline.load_consumer()
+    pipeline.seed_models(main, ids, start)
+    transport = replay.InProcessTransport(main.kafka_consumer)
+    results = replay.replay(main, transport, replay.read_recording(path))
+
+    (step,) = results["steps"]
+    assert step["sent"] == step["processed"] == 6
+    assert step["unprocessed"] == 0
+    assert step["lag_seconds"]["max"] > 0
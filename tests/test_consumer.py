@@ -0,0 +1,143 @@
+import pickle
+
+import numpy as np
+import pytest
+
+from benchmarks import pipeline, synthetic
+from weather_predictions import state_codec
+from weather_predictions.feature_history import FeatureHistory
+from weather_predictions.observation_log import OBSERVATIONS_QUERY, SLOT_SECONDS
+from weather_predictions.wire import FIELDS
+
+
+@pytest.fixture(scope="module")
+def main():
+    return pipeline.load_consumer()
+
+
+def store_model(main, id, blob):
+    main.adls_client.upload_bytes(
+        main.config.container_name, main.model_cache.blob_name(id), blob
+    )
+
+
+def stored_model(main, id):
+    main.model_cache.flush([id])
+    return state_codec.loads(
+        main.adls_client.download_bytes(
+            main.config.container_name, main.model_cache.blob_name(id)
+        )
+    )
+
+
+@pytest.mark.parametrize("batch", [False, True])
+@pytest.mark.parametrize("legacy", [True, False])
+def test_models_without_a_timestamp_learn_the_message(main, batch, legacy):
+    id = 9000 + 2 * legacy + batch
+    start = synthetic.start_timestamp()
+    model_data = synthetic.model_data(start)
+    if legacy:
+        # The original consumer stored the forecast under "timestamp"
+        model_data["timestamp"] = np.full(24, 50.0)
+        model_data["x_hist"] = model_data["x_hist"].records()
+        blob = pickle.dumps(model_data)
+    else:
+        model_data["timestamp"] = None
+        blob = state_codec.dumps(model_data)
+    store_model(main, id, blob)
+
+    (message,) = synthetic.encode_messages(synthetic.observations([id], 1, start))
+    if batch:
+        main.process_batch([message])
+    else:
+        main.process_message(message)
+    main.forecast_writer.flush()
+
+    assert id in main.mysql_client.forecasts
+    assert stored_model(main, id)["timestamp"] == start
+
+
+class RecordingModel:
+    """Remembers the targets it learned, in order."""
+
+    def __init__(self):
+        self.learned = []
+
+    def learn_one(self, y, x):
+        self.learned.append(y)
+
+
+def observations(id, start, slots, ys):
+    batch = synthetic.observations([id], max(slots) + 1, start)[slots]
+    batch["cloud_coverage"] = ys
+    return batch
+
+
+def test_update_model_replays_missing_timeslots_in_order(main):
+    id = 9100
+    start = synthetic.start_timestamp()
+    model_data = {
+        "model": RecordingModel(),
+        "timestamp": int(start),
+        "x_hist": FeatureHistory.from_array(synthetic.FEATURES, np.zeros((96, 7))),
+    }
+    # Slot 1 is stored, slot 2 still pending, slot 3 arrives with the
+    # observations and wins over its stored row, slot 4 is lost
+    stored = observations(id, start, [3, 1], [50, 11])
+    main.mysql_client.add_result(
+        OBSERVATIONS_QUERY, [dict(zip(FIELDS, fields)) for fields in stored.tolist()]
+    )
+    main.observation_log.add(observations(id, start, [2], [12]))
+    try:
+        learned = main.update_model(
+            model_data, id, observations(id, start, [0, 3, 3, 5], [0, 13, 99, 15])
+        )
+    finally:
+        del main.mysql_client.results[OBSERVATIONS_QUERY]
+    assert learned == 4
+    assert model_data["model"].learned == [11, 12, 13, 15]
+    assert model_data["timestamp"] == start + 5 * SLOT_SECONDS
+
+    # Replayed messages of learned timeslots are no-ops
+    again = observations(id, start, [3, 5], [13, 15])
+    assert main.update_model(model_data, id, again) == 0
+    assert model_data["model"].learned == [11, 12, 13, 15]
+    assert model_data["timestamp"] == start + 5 * SLOT_SECONDS
+
+
+def test_batch_skips_a_location_with_a_corrupt_model(main):
+    start = synthetic.start_timestamp()
+    store_model(main, 9200, b"not a model")
+    store_model(main, 9201, synthetic.model_blob(start))
+    messages = synthetic.encode_messages(
+        synthetic.observations([9200, 9201], 1, start)
+    )
+    main.process_batch(messages)
+
+    assert 9200 not in main.mysql_client.forecasts
+    assert 9201 in main.mysql_client.forecasts
+    assert stored_model(main, 9201)["timestamp"] == start
+
+
+def test_batch_checkpoints_models_of_a_failed_batch(main, monkeypatch):
+    start = synthetic.start_timestamp()
+    for id in (9300, 9301):
+        store_model(main, id, synthetic.model_blob(start))
+    container, blob_name = main.config.container_name, main.model_cache.blob_name
+
+    def failing_upload(container_name, file_name, data):
+        raise ConnectionError("storage unavailable")
+
+    with monkeypatch.context() as patch:
+        patch.setattr(main.adls_client, "upload_bytes", failing_upload)
+        with pytest.raises(RuntimeError):
+            main.process_batch(
+                synthetic.encode_messages(synthetic.observations([9300], 1, start))
+            )
+
+    # The replayed batch is a no-op for 9300, its model must still be saved
+    main.process_batch(
+        synthetic.encode_messages(synthetic.observations([9300, 9301], 1, start))
+    )
+    blob = main.adls_client.download_bytes(container, blob_name(9300))
+    assert state_codec.loads(blob)["timestamp"] == start
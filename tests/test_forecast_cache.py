@@ -0,0 +1,88 @@
+import asyncio
+
+from services.forecast_cache import FORECAST_QUERY, ForecastCache
+from weather_predictions.forecast_writer import (
+    CHANGED_SINCE_QUERY,
+    FORECAST_VERSION_QUERY,
+)
+
+
+class Database:
+    """Forecast rows with the version marker and changes the writer keeps."""
+
+    def __init__(self):
+        self.forecasts = {}
+        self.version = 0
+        self.changes = {}
+        self.reads = 0
+
+    def write(self, id, value):
+        self.version += 1
+        self.forecasts[id] = {"location_id": id, "forecast_hour_1": value}
+        self.changes[id] = self.version
+
+    async def read(self, query, params=None):
+        if query == FORECAST_VERSION_QUERY:
+            return [{"version": self.version}] if self.version else []
+        if query == CHANGED_SINCE_QUERY:
+            after, upto = params
+            return [
+                {"location_id": id}
+                for id, version in self.changes.items()
+                if after < version <= upto
+            ]
+        assert query == FORECAST_QUERY
+        self.reads += 1
+        row = self.forecasts.get(params[0])
+        return [row] if row else []
+
+
+def test_version_bump_invalidates_only_changed_locations():
+    async def scenario():
+        db = Database()
+        db.write(1, 10.0)
+        db.write(2, 20.0)
+        cache = ForecastCache(db, ttl=60, version_check_interval=0)
+
+        assert (await cache.get(1))["forecast_hour_1"] == 10.0
+        assert (await cache.get(2))["forecast_hour_1"] == 20.0
+        assert db.reads == 2
+
+        db.write(1, 11.0)
+        assert (await cache.get(1))["forecast_hour_1"] == 11.0
+        assert (await cache.get(2))["forecast_hour_1"] == 20.0
+        assert db.reads == 3
+        assert cache.stats()["version"] == 3
+
+    asyncio.run(scenario())
+
+
+def test_change_during_a_load_is_not_cached():
+    async def scenario():
+        db = Database()
+        db.write(1, 10.0)
+        cache = ForecastCache(db, ttl=60, version_check_interval=0)
+        await cache.get(1)
+        db.write(1, 11.0)
+
+        read = db.read
+
+        async def slow_read(query, params=None):
+            row = await read(query, params)
+            if query == FORECAST_QUERY:
+                # The forecast changes after the row was read
+                db.write(1, 12.0)
+                await asyncio.sleep(0.01)
+            return row
+
+        db.read = slow_read
+        load = asyncio.ensure_future(cache.get(1))
+        await asyncio.sleep(0)
+        other = await cache.get(2)
+        assert other is None
+        assert (await load)["forecast_hour_1"] == 11.0
+
+        db.read = read
+        assert (await cache.get(1))["forecast_hour_1"] == 12.0
+
+    asyncio.run(scenario())
@@ -0,0 +1,73 @@
+import pytest
+
+from benchmarks.fakes import FakeMySQLClient
+from weather_predictions.forecast_writer import ForecastWriter
+
+
+class FailingMySQLClient(FakeMySQLClient):
+    """Fails the next forecast upsert, running `during` before it fails."""
+
+    def __init__(self):
+        super().__init__()
+        self.fail = False
+        self.during = None
+
+    def executemany(self, query, seq_params, commit=True):
+        if self.fail and "cloud_cover_forecasts" in query:
+            self.fail = False
+            if self.during:
+                self.during()
+            raise RuntimeError("Failed to execute executemany: lost connection")
+        super().executemany(query, seq_params, commit)
+
+
+def forecast(value):
+    return [value] * 24
+
+
+def test_failed_write_keeps_the_rows_for_the_next_flush():
+    db = FailingMySQLClient()
+    writer = ForecastWriter(db)
+    writer.add(1, forecast(10))
+    writer.add(2, forecast(20))
+    db.fail = True
+    with pytest.raises(RuntimeError):
+        writer.flush()
+    assert len(writer) == 2
+    assert db.forecasts == {}
+    assert db.version == 0
+
+    writer.flush()
+    assert len(writer) == 0
+    assert db.forecasts == {1: tuple(forecast(10.0)), 2: tuple(forecast(20.0))}
+    assert db.changes == {1: 1, 2: 1}
+
+
+def test_forecasts_added_during_a_failed_write_win():
+    db = FailingMySQLClient()
+    writer = ForecastWriter(db)
+    writer.add(1, forecast(10))
+    writer.add(2, forecast(20))
+    db.fail = True
+    db.during = lambda: writer.add(1, forecast(11))
+    with pytest.raises(RuntimeError):
+        writer.flush()
+
+    writer.flush()
+    assert db.forecasts[1] == tuple(forecast(11.0))
+    assert db.forecasts[2] == tuple(forecast(20.0))
+
+
+def test_only_the_latest_forecast_of_a_location_is_written():
+    db = FakeMySQLClient()
+    writer = ForecastWriter(db, max_rows=2)
+    writer.add(1, forecast(10))
+    writer.add(1, forecast(11))
+    assert db.calls["executemany"] == 0
+    # The second pending location triggers the flush
+    writer.add(2, forecast(20))
+    assert len(writer) == 0
+    assert db.forecasts[1] == tuple(forecast(11.0))
+
+    with pytest.raises(ValueError):
+        writer.add(3, forecast(30)[:-1])
@@ -0,0 +1,85 @@
+import pytest
+
+from benchmarks import pipeline
+from benchmarks.fakes import FakeMySQLClient
+from services.location_index import LOCATIONS_QUERY
+
+
+@pytest.fixture(scope="module")
+def tables():
+    pipeline.ensure_env()
+    from weather_predictions import initialize_weather_tables
+
+    return initialize_weather_tables
+
+
+class RecordingMySQLClient(FakeMySQLClient):
+    """Keeps every statement with its parameters and the commits."""
+
+    def __init__(self, locations):
+        super().__init__()
+        self.add_result(LOCATIONS_QUERY, locations)
+        self.log = []
+
+    def execute(self, query, params=None, commit=True):
+        self.log.append(("execute", query, params, commit))
+        super().execute(query, params, commit)
+
+    def executemany(self, query, seq_params, commit=True):
+        self.log.append(("executemany", query, list(seq_params), commit))
+        super().executemany(query, seq_params, commit)
+
+    def commit(self):
+        self.log.append(("commit", None, None, None))
+
+    def statements_of(self, query):
+        return [params for _, logged, params, _ in self.log if logged == query]
+
+
+def test_grid_points_match_the_original_loops(tables):
+    points = []
+    lat = 49.1
+    while lat < 55:
+        lon = 14.1
+        while lon < 24:
+            points.append((lat, lon))
+            lon += 0.2
+        lat += 0.2
+    grid = tables.grid_points()
+    assert len(grid) == len(points)
+    assert all(tables._key(*a) == tables._key(*b) for a, b in zip(grid, points))
+
+
+def test_only_the_difference_to_the_grid_is_written(tables, monkeypatch):
+    monkeypatch.setattr(tables, "CHUNK_ROWS", 2)
+    db = RecordingMySQLClient(
+        [
+            {"id": 1, "latitude": 50.0, "longitude": 20.0},
+            # Stored coordinates are not exactly the grid values
+            {"id": 2, "latitude": 50.20000001, "longitude": 20.0},
+            {"id": 3, "latitude": 60.0, "longitude": 10.0},
+        ]
+    )
+    points = [(50.0, 20.0), (50.2, 20.0), (50.4, 20.0), (50.6, 20.0), (50.8, 20.0)]
+    assert tables.provision_grid(db, points) == (3, 1)
+
+    inserts = db.statements_of(tables.INSERT_LOCATIONS_QUERY)
+    assert inserts == [[(50.4, 20.0), (50.6, 20.0)], [(50.8, 20.0)]]
+    assert db.statements_of(tables.DELETE_FORECASTS_QUERY.format("%s")) == [[3]]
+    assert db.statements_of(tables.DELETE_LOCATIONS_QUERY.format("%s")) == [[3]]
+    assert db.statements_of(tables.INSERT_MISSING_FORECASTS_QUERY) == [None]
+    # The removed location is invalidated in API caches
+    assert db.changes == {3: 1}
+
+    # Everything after the DDL is one transaction
+    writes = [entry for entry in db.log if "CREATE TABLE" not in (entry[1] or "")]
+    assert writes[-1][0] == "commit"
+    assert not any(commit for _, _, _, commit in writes[:-1])
+
+
+def test_locations_are_kept_without_prune(tables):
+    db = RecordingMySQLClient([{"id": 3, "latitude": 60.0, "longitude": 10.0}])
+    points = [(60.0, 10.0), (50.0, 20.0)]
+    assert tables.provision_grid(db, points, prune=False) == (1, 0)
+    assert db.statements_of(tables.DELETE_LOCATIONS_QUERY.format("%s")) == []
+    assert db.version == 0
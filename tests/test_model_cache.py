@@ -0,0 +1,43 @@
+import pickle
+import threading
+import time
+
+from benchmarks.fakes import FakeADLSClient
+from weather_predictions.model_cache import ModelCache
+
+CONTAINER = "models"
+
+
+def test_concurrent_updates_survive_eviction(monkeypatch):
+    adls = FakeADLSClient()
+    ids = [1, 2, 3, 4]
+    for id in ids:
+        adls.upload_bytes(CONTAINER, f"model_{id}.pkl", pickle.dumps({"updates": 0}))
+    # Every model is over the limit, so each checkout evicts the idle ones
+    cache = ModelCache(adls, CONTAINER, max_bytes=0)
+    get_entry = cache._get_entry
+
+    def slow_get_entry(id):
+        entry = get_entry(id)
+        # Widen the window between finding an entry and locking it
+        time.sleep(0.0005)
+        return entry
+
+    monkeypatch.setattr(cache, "_get_entry", slow_get_entry)
+
+    def update(rounds):
+        for _ in range(rounds):
+            for id in ids:
+                with cache.checkout(id) as model_data:
+                    model_data["updates"] += 1
+
+    threads = [threading.Thread(target=update, args=(25,)) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    cache.close()
+
+    for id in ids:
+        blob = adls.download_bytes(CONTAINER, f"model_{id}.pkl")
+        assert pickle.loads(blob) == {"updates": 200}
@@ -0,0 +1,102 @@
+import threading
+
+import pytest
+from mysql import connector
+
+from clients import mysql_client
+from clients.mysql_client import ConnectionPool
+
+
+class Connection:
+    def __init__(self):
+        self.alive = True
+        self.closed = False
+        self.rollbacks = 0
+
+    def ping(self, reconnect=False):
+        if not self.alive:
+            raise connector.errors.OperationalError("MySQL server has gone away")
+
+    def rollback(self):
+        self.rollbacks += 1
+
+    def close(self):
+        self.closed = True
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(mysql_client.time, "monotonic", clock.monotonic)
+    return clock
+
+
+def test_released_connections_are_reused(clock):
+    opened = []
+
+    def connect():
+        opened.append(Connection())
+        return opened[-1]
+
+    pool = ConnectionPool(connect, size=2)
+
+    first = pool.acquire()
+    pool.release(*first)
+    again = pool.acquire()
+    assert again[0] is first[0]
+    assert len(opened) == 1
+    # Uncommitted work of the previous borrower is dropped
+    assert first[0].rollbacks == 1
+
+    other = pool.acquire()
+    assert other[0] is not again[0]
+    assert len(opened) == 2
+
+
+def test_expired_and_dead_connections_are_replaced(clock):
+    pool = ConnectionPool(Connection, size=2, max_lifetime=60)
+    old = pool.acquire()
+    pool.release(*old)
+    clock.now += 61
+    new = pool.acquire()
+    assert new[0] is not old[0]
+    assert old[0].closed
+    assert new[1] == clock.now
+
+    pool.release(*new)
+    new[0].alive = False
+    replaced = pool.acquire()
+    assert replaced[0] is not new[0]
+    assert new[0].closed
+
+
+def test_checkouts_wait_for_a_free_slot(clock):
+    pool = ConnectionPool(Connection, size=1, timeout=0.05)
+    held = pool.acquire()
+    with pytest.raises(RuntimeError):
+        pool.acquire()
+
+    pool.timeout = 5
+    acquired = []
+    waiter = threading.Thread(target=lambda: acquired.append(pool.acquire()))
+    waiter.start()
+    pool.release(*held)
+    waiter.join()
+    assert acquired[0][0] is held[0]
+
+
+def test_close_closes_idle_connections(clock):
+    pool = ConnectionPool(Connection, size=2)
+    connections = [pool.acquire(), pool.acquire()]
+    for connection in connections:
+        pool.release(*connection)
+    pool.close()
+    assert all(connection.closed for connection, _ in connections)
@@ -0,0 +1,70 @@
+import numpy as np
+
+from benchmarks import synthetic
+from benchmarks.fakes import FakeMySQLClient
+from weather_predictions.observation_log import (
+    OBSERVATIONS_QUERY,
+    SLOT_SECONDS,
+    ObservationLog,
+    missing_slots,
+    timeslot_id,
+    timeslot_ids,
+)
+from weather_predictions.wire import FIELDS
+
+
+def test_missing_slots():
+    slots = np.array([3, 5, 6, 12, 20, 40])
+    assert missing_slots(slots, 2, 13).tolist() == [4, 7, 8, 9, 10, 11]
+    assert missing_slots(slots, 4, 7).tolist() == []
+    assert missing_slots([], 10, 11).tolist() == []
+    assert missing_slots([], 0, 20).tolist() == list(range(1, 20))
+
+
+def test_timeslot_ids_match_timeslot_id():
+    start = synthetic.start_timestamp()
+    timestamps = start + np.arange(-3, 4) * SLOT_SECONDS + 7
+    assert timeslot_ids(timestamps).tolist() == [timeslot_id(t) for t in timestamps]
+
+
+def test_fetch_merges_stored_and_pending_observations():
+    start = synthetic.start_timestamp()
+    batch = synthetic.observations([1], 5, start)
+    slots = timeslot_ids(batch["timestamp"])
+    mysql = FakeMySQLClient()
+    # Slots 1 and 3 are written, slot 3 again and slot 2 are still pending
+    mysql.add_result(
+        OBSERVATIONS_QUERY,
+        [dict(zip(FIELDS, fields)) for fields in batch[[3, 1]].tolist()],
+    )
+    log = ObservationLog(mysql)
+    pending = batch[[2, 3]].copy()
+    pending["cloud_coverage"] = [-1, -1]
+    log.add(pending)
+
+    fetched = log.fetch(1, slots[0], slots[4])
+    assert timeslot_ids(fetched["timestamp"]).tolist() == slots[1:4].tolist()
+    # The stored row of a timeslot wins over a later pending one
+    assert fetched["cloud_coverage"].tolist() == [
+        batch["cloud_coverage"][1],
+        -1,
+        batch["cloud_coverage"][3],
+    ]
+
+
+def test_flush_keeps_the_first_observation_of_a_timeslot():
+    start = synthetic.start_timestamp()
+    first = synthetic.observations([1, 2], 2, start, seed=0)
+    replayed = synthetic.observations([1, 2], 2, start, seed=1)
+    mysql = FakeMySQLClient()
+    log = ObservationLog(mysql)
+    log.add(first)
+    log.add(replayed)
+    assert len(log) == 4
+    log.flush()
+
+    assert len(log) == 0
+    assert len(mysql.observations) == 4
+    for fields in first.tolist():
+        key = (fields[0], timeslot_id(fields[1]))
+        assert mysql.observations[key] == fields[1:]
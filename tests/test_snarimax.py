@@ -0,0 +1,155 @@
+import pickle
+
+import numpy as np
+import pandas as pd
+import pytest
+from river import compose, linear_model, optim, preprocessing, time_series
+
+from weather_predictions import state_codec
+from weather_predictions.snarimax import NumpySNARIMAX
+
+ORDERS = dict(p=1, d=1, q=1, m=24, sp=1, sd=1, sq=1)
+
+
+def make_series(n=800, m=24, seed=0):
+    rng = np.random.default_rng(seed)
+    t = np.arange(n)
+    y = 50 + 30 * np.sin(2 * np.pi * t / m) + rng.normal(0, 5, n)
+    X = pd.DataFrame(
+        {
+            "dt": (t % m).astype(float),
+            "temp": 10 + rng.normal(0, 1, n),
+            "pressure": np.full(n, 1013.0),
+        }
+    )
+    return y, X
+
+
+def river_model():
+    return time_series.SNARIMAX(
+        **ORDERS,
+        regressor=compose.Pipeline(
+            preprocessing.StandardScaler(),
+            linear_model.LinearRegression(
+                optimizer=optim.SGD(0.001), intercept_lr=0.001, l2=0.1
+            ),
+        ),
+    )
+
+
+def engine():
+    return NumpySNARIMAX(**ORDERS, lr=0.001, intercept_lr=0.001, l2=0.1)
+
+
+def test_matches_river():
+    y, X = make_series()
+    rows = X.to_dict(orient="records")
+    reference = river_model()
+    streaming = engine()
+    for target, x in zip(y, rows):
+        reference.learn_one(target, x)
+        streaming.learn_one(target, x)
+    batch = engine()
+    batch.learn_many(y[:300], X[:300])
+    batch.learn_many(y[300:], X[300:])
+
+    expected = reference.forecast(96, rows[:96])
+    np.testing.assert_allclose(streaming.forecast(96, rows[:96]), expected, rtol=1e-9)
+    np.testing.assert_allclose(batch.forecast(96, rows[:96]), expected, rtol=1e-9)
+
+
+def test_one_step_forecasts_match_river():
+    y, X = make_series(n=300)
+    rows = X.to_dict(orient="records")
+    reference = river_model()
+    expected = []
+    for target, x in zip(y, rows):
+        ready = len(reference.y_hist) >= reference.differencer.n_required_past_values
+        expected.append(reference.forecast(1, [x])[0] if ready else np.nan)
+        reference.learn_one(target, x)
+
+    forecasts = engine().learn_many(y, X)
+    np.testing.assert_allclose(forecasts, expected, rtol=1e-9)
+
+
+def test_from_river_and_codec_round_trip():
+    y, X = make_series(n=300)
+    rows = X.to_dict(orient="records")
+    reference = river_model()
+    for target, x in zip(y, rows):
+        reference.learn_one(target, x)
+
+    model = NumpySNARIMAX.from_river(reference)
+    expected = reference.forecast(24, rows[:24])
+    np.testing.assert_allclose(model.forecast(24, rows[:24]), expected, rtol=1e-12)
+
+    model_data = {"model": model, "timestamp": 1737375847, "x_hist": rows[:24]}
+    decoded = state_codec.loads(state_codec.dumps(model_data))
+    assert isinstance(decoded["model"], NumpySNARIMAX)
+    assert decoded["timestamp"] == 1737375847
+    assert decoded["model"].forecast(24, decoded["x_hist"]) == model.forecast(24, rows[:24])
+
+
+def test_river_codec_round_trip():
+    y, X = make_series(n=300)
+    rows = X.to_dict(orient="records")
+    reference = river_model()
+    for target, x in zip(y, rows):
+        reference.learn_one(target, x)
+
+    model_data = {"model": reference, "timestamp": 1737375847, "x_hist": rows[:24]}
+    blob = state_codec.dumps(model_data)
+    assert blob[:4] == state_codec.MAGIC
+    decoded = state_codec.loads(blob)
+    assert isinstance(decoded["model"], time_series.SNARIMAX)
+    assert decoded["timestamp"] == 1737375847
+    np.testing.assert_allclose(
+        decoded["model"].forecast(24, decoded["x_hist"].records()),
+        reference.forecast(24, rows[:24]),
+        rtol=1e-12,
+    )
+
+
+def test_legacy_pickle_loads():
+    y, X = make_series(n=100)
+    rows = X.to_dict(orient="records")
+    reference = river_model()
+    for target, x in zip(y, rows):
+        reference.learn_one(target, x)
+    forecast = np.array(reference.forecast(24, rows[:24]))
+
+    # The consumer used to store the forecast under "timestamp"
+    legacy = {"model": reference, "timestamp": forecast, "x_hist": rows[:24]}
+    decoded = state_codec.loads(pickle.dumps(legacy))
+    assert decoded["x_hist"] == rows[:24]
+    np.testing.assert_array_equal(decoded["timestamp"], forecast)
+    assert decoded["model"].forecast(24, rows[:24]) == list(forecast)
+
+
+def test_codec_timestamps():
+    model = engine()
+    model.learn_many(*make_series(n=50))
+    model_data = {"model": model, "x_hist": []}
+    for timestamp, expected in [
+        (None, None),
+        (np.int64(1737375847), 1737375847),
+        (1737375847.0, 1737375847),
+        (np.array(1737375847), 1737375847),
+    ]:
+        model_data["timestamp"] = timestamp
+        assert state_codec.loads(state_codec.dumps(model_data))["timestamp"] == expected
+
+    for timestamp in [1737375847.5, np.zeros(24), "1737375847"]:
+        model_data["timestamp"] = timestamp
+        with pytest.raises(ValueError):
+            state_codec.dumps(model_data)
+
+
+def test_codec_round_trip_before_learning():
+    model_data = {"model": engine(), "timestamp": None, "x_hist": []}
+    decoded = state_codec.loads(state_codec.dumps(model_data))["model"]
+    assert decoded.exog is None
+
+    y, X = make_series(n=200)
+    expected = engine().learn_many(y, X)
+    np.testing.assert_allclose(decoded.learn_many(y, X), expected, rtol=1e-12)
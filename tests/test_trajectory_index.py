@@ -0,0 +1,77 @@
+import numpy as np
+import pytest
+
+from services.trajectory_index import TrajectoryIndex
+
+
+def passes(n=2000, seed=0):
+    rng = np.random.default_rng(seed)
+    starts = rng.integers(0, 100000, n)
+    ends = starts + rng.integers(60, 1200, n)
+    order = np.argsort(ends, kind="stable")
+    return [
+        {
+            "satid": int(rng.integers(0, 30)),
+            "startUTC": int(starts[i]),
+            "endUTC": int(ends[i]),
+            "startAz": float(rng.uniform(0, 360)),
+            "endAz": float(rng.uniform(0, 360)),
+        }
+        for i in order
+    ]
+
+
+def windows(seed=1):
+    rng = np.random.default_rng(seed)
+    t0s = rng.integers(-2000, 102000, 50)
+    return [
+        (int(t0), int(t0 + length))
+        for t0, length in zip(t0s, rng.integers(0, 5000, 50))
+    ]
+
+
+def ordered(rows):
+    return sorted(rows, key=lambda row: (row["endUTC"], row["startUTC"], row["satid"]))
+
+
+def brute_force(rows, t0, t1, end_slack, satid=None):
+    # The predicate of the former SQL queries
+    return ordered(
+        row
+        for row in rows
+        if t0 < row["endUTC"] < t1 + end_slack
+        and row["startUTC"] < t1
+        and satid in (None, row["satid"])
+    )
+
+
+@pytest.mark.parametrize("t0, t1", windows())
+def test_lookups_match_a_full_scan(t0, t1):
+    rows = passes()
+    index = TrajectoryIndex.from_rows(rows)
+    assert ordered(index.overlapping(t0, t1)) == brute_force(rows, t0, t1, 600)
+    for satid in (0, 7, 29, 99):
+        assert ordered(index.satellite_passes(satid, t0, t1)) == brute_force(
+            rows, t0, t1, 1200, satid
+        )
+
+
+def test_extend_and_expire_match_a_fresh_index():
+    rows = passes()
+    half = len(rows) // 2
+    cutoff = rows[half // 2]["endUTC"]
+    index = TrajectoryIndex.from_rows(rows[:half]).extend(rows[half:]).expire(cutoff)
+    kept = [row for row in rows if row["endUTC"] > cutoff]
+    assert len(index) == len(kept)
+    for t0, t1 in windows(2):
+        assert ordered(index.overlapping(t0, t1)) == brute_force(kept, t0, t1, 600)
+        assert ordered(index.satellite_passes(3, t0, t1)) == brute_force(
+            kept, t0, t1, 1200, 3
+        )
+
+
+def test_empty_index():
+    index = TrajectoryIndex.empty()
+    assert len(index) == 0
+    assert index.overlapping(0, 100) == []
+    assert index.satellite_passes(1, 0, 100) == []
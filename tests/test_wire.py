@@ -0,0 +1,89 @@
+import json
+
+import numpy as np
+
+from weather_predictions import wire
+
+INT32 = (-(2**31), 2**31 - 1)
+INT64 = (-(2**63), 2**63 - 1)
+
+
+def observations(n, seed=0):
+    rng = np.random.default_rng(seed)
+    # One to five byte varints of both signs, and the extremes
+    ints = np.concatenate(
+        [
+            [0, -1, 1, 63, -64, 64, -65, 8191, -8192, 8192, *INT32],
+            rng.integers(*INT32, n),
+        ]
+    )
+    longs = np.concatenate([[0, -1, 2**35, -(2**35), *INT64], rng.integers(*INT64, n)])
+    floats = np.concatenate(
+        [[0.0, -0.0, np.nan, np.inf, -np.inf, 1e-40, 3.4e38], rng.normal(0, 1e3, n)]
+    )
+    for i in range(n):
+        id = int(ints[(i + 3) % len(ints)])
+        yield {
+            # A location id of -62 encodes to "{", the start of a JSON object
+            "id": 1 if id == -62 else id,
+            "timestamp": int(longs[i % len(longs)]),
+            "cloud_coverage": int(ints[i % len(ints)]),
+            "temperature": float(floats[i % len(floats)]),
+            "pressure": int(ints[(i + 1) % len(ints)]),
+            "humidity": int(ints[(i + 2) % len(ints)]),
+            "wind_speed": float(floats[(i + 1) % len(floats)]),
+            "wind_direction": int(ints[(i + 5) % len(ints)]),
+            "precipitation": float(floats[(i + 2) % len(floats)]),
+        }
+
+
+def assert_matches_scalar_decode(batch, payloads):
+    expected = [wire.decode(payload) for payload in payloads]
+    assert len(batch) == len(expected)
+    for name, column in zip(wire.FIELDS, zip(*expected)):
+        np.testing.assert_array_equal(
+            batch[name], np.array(column, dtype=wire.OBSERVATION_DTYPE[name])
+        )
+
+
+def test_avro_batch_matches_fastavro():
+    payloads = [wire.encode(o) for o in observations(500)]
+    assert_matches_scalar_decode(wire.decode_batch(payloads), payloads)
+
+
+def test_malformed_avro_messages_are_dropped():
+    payloads = [wire.encode(o) for o in observations(100)]
+    malformed = [
+        payloads[0][:-1],
+        payloads[1][:3],
+        payloads[2] + b"\x00",
+        b"",
+        # A varint that never ends
+        b"\xff" * 40,
+    ]
+    mixed = []
+    for i, payload in enumerate(payloads):
+        mixed.append(payload)
+        if i % 20 == 10:
+            mixed.append(malformed[i // 20])
+
+    batch = wire.decode_batch(mixed)
+    assert_matches_scalar_decode(batch, payloads)
+    # The last message is malformed, reads past it must stay in bounds
+    batch = wire.decode_batch(payloads + [b"\xff" * 3])
+    assert_matches_scalar_decode(batch, payloads)
+
+
+def test_mixed_json_and_avro_batch():
+    items = list(observations(100, seed=1))
+    payloads = []
+    for i, observation in enumerate(items):
+        if i % 3:
+            payloads.append(wire.encode(observation))
+        else:
+            message = json.dumps({k: str(v) for k, v in observation.items()})
+            payloads.append(message if i % 2 else message.encode())
+    payloads.insert(50, b'{"id": "1"}')
+
+    batch = wire.decode_batch(payloads)
+    assert_matches_scalar_decode(batch, payloads[:50] + payloads[51:])
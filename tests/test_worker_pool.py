@@ -0,0 +1,68 @@
+import random
+import threading
+import time
+
+from weather_predictions.worker_pool import KeyedWorkerPool
+
+
+def test_tasks_of_a_key_run_in_submission_order():
+    pool = KeyedWorkerPool(lanes=4, lane_capacity=8)
+    done = {key: [] for key in range(20)}
+    running = set()
+    overlaps = []
+    lock = threading.Lock()
+
+    def task(key, i):
+        with lock:
+            if key in running:
+                overlaps.append(key)
+            running.add(key)
+        time.sleep(random.random() / 5000)
+        with lock:
+            running.discard(key)
+        done[key].append(i)
+
+    for i in range(50):
+        for key in done:
+            pool.submit(key, task, key, i)
+    pool.shutdown()
+
+    assert not overlaps
+    assert all(order == list(range(50)) for order in done.values())
+
+
+def test_failed_task_does_not_stop_its_lane():
+    pool = KeyedWorkerPool(lanes=1)
+    done = []
+
+    def fail():
+        raise ValueError("bad message")
+
+    pool.submit(1, fail)
+    pool.submit(1, done.append, 1)
+    pool.join()
+    pool.shutdown()
+    assert done == [1]
+
+
+def test_submitting_to_a_full_lane_blocks():
+    pool = KeyedWorkerPool(lanes=1, lane_capacity=2)
+    release = threading.Event()
+    submitted = threading.Event()
+
+    def producer():
+        # The first task runs and waits, two more fill the lane
+        for _ in range(4):
+            pool.submit(1, release.wait)
+        submitted.set()
+
+    thread = threading.Thread(target=producer, daemon=True)
+    thread.start()
+    assert not submitted.wait(0.2)
+    assert pool.pending() == 2
+
+    release.set()
+    assert submitted.wait(5)
+    thread.join()
+    pool.shutdown()
+    assert pool.pending() == 0
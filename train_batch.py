@@ -1,55 +1,76 @@
 import numpy as np
 import pandas as pd
-import fastavro
-from river import time_series, linear_model, metrics, preprocessing, optim, compose
+from weather_predictions import avro_io
+from weather_predictions.feature_history import FeatureHistory
+from weather_predictions.snarimax import NumpySNARIMAX
 #import matplotlib.pyplot as plt
 from sklearn.metrics import mean_squared_error, mean_absolute_error
 import datetime
 import pytz
 import copy
-import pickle
 
-def read_avro(file_path):
-    with open(file_path, 'rb') as f:
-        avro_reader = fastavro.reader(f)
-        records = [record for record in avro_reader]
-    return pd.DataFrame(records)
+def read_avro(file_path, start=None, end=None):
+    """
+    Read a history file into a DataFrame, optionally only the rows with
+    `start <= dt < end`. Records are decoded block by block into columns.
+    """
+    return pd.DataFrame(avro_io.read_columns(file_path, start, end))
 
 def unix_to_hour_pol(time):
     poland_tz = pytz.timezone('Europe/Warsaw')
     return datetime.datetime.fromtimestamp(time, poland_tz).hour
 
-def preprocess_data(df):
+def unix_to_hour_pol_many(times):
+    return (
+        pd.to_datetime(np.asarray(times), unit='s', utc=True)
+        .tz_convert('Europe/Warsaw')
+        .hour.to_numpy()
+        .astype(np.int64)
+    )
+
+def upsample_quarter_hourly(df):
+    """
+    Linearly interpolate hourly rows into 15-minute rows.
+    The three rows between two source rows are built by adding a quarter of
+    the difference step by step, the same way the original row-wise loop did,
+    so the result is bit-for-bit identical.
+    """
+    values = df.to_numpy(dtype=np.float64)
     n = df.shape[0] * 4 - 3
-    df_extra = pd.DataFrame(np.nan, index=range(n), columns=df.columns)
-    for i in range(df.shape[0]-1):
-        df_extra.iloc[4*i] = df.iloc[i]
-        diff = (df.iloc[i+1] - df.iloc[i]) / 4
+    out = np.empty((max(n, 1), values.shape[1]))
+    if len(values) > 1:
+        current = values[:-1]
+        diff = (values[1:] - current) / 4
+        out[0:-1:4] = current
         for j in range(1, 4):
-            df_extra.iloc[4*i+j] = df_extra.iloc[4*i+j-1] + diff
-    df_extra.iloc[-1] = df.iloc[-1]
+            current = current + diff
+            out[j:-1:4] = current
+    out[-1] = values[-1]
+    return pd.DataFrame(out, columns=df.columns)
+
+def preprocess_data(df):
+    df_extra = upsample_quarter_hourly(df)
     df_extra['dt'] = df_extra['dt'].astype(int)
     df_extra['pressure'] = df_extra['pressure'].round().astype(int)
     df_extra['humidity'] = df_extra['humidity'].round().astype(int)
     df_extra['wind_deg'] = df_extra['wind_deg'].round().astype(int)
     df_extra['clouds'] = df_extra['clouds'].round().astype(int)
     X = df_extra.drop(columns=["clouds"])
-    X['dt'] = X['dt'].apply(unix_to_hour_pol)
+    X['dt'] = unix_to_hour_pol_many(X['dt'])
     y = df_extra["clouds"]
     return X, y
 
-def batch_train(X, y, p, d, q, sp, sd, sq, m, l2):
-
-    Xtrain = X
-    ytrain = y[24*4:]
+# Learning rate of the weights and the intercept. Faster rates, e.g. the
+# engine's default of 0.01, make the day-ahead forecasts diverge on
+# weatherbatch.avro even where the one-step forecasts look fine
+LR = 0.0003
 
+def batch_train(X, y, p, d, q, sp, sd, sq, m, l2, lr=LR):
 
-    pipeline = compose.Pipeline(
-        preprocessing.StandardScaler(),
-        linear_model.LinearRegression(l2=l2)
-    )
+    Xtrain = X[:len(y) - 24*4]
+    ytrain = y[24*4:]
 
-    model = time_series.SNARIMAX(
+    model = NumpySNARIMAX(
         p=p,
         d=d,
         q=q,
@@ -57,45 +78,70 @@ def batch_train(X, y, p, d, q, sp, sd, sq, m, l2):
         sd=sd,
         sq=sq,
         m=m,
-        regressor=pipeline,
+        l2=l2,
+        lr=lr,
+        intercept_lr=lr,
     )
 
-    forecasts = []
-    for i in range(len(ytrain)):
-        x1 = Xtrain.iloc[i].to_dict()
-        
-        target = ytrain.iloc[i]
-        model.learn_one(target, x1)
-        if i != len(ytrain)-1:
-            x2 = Xtrain.iloc[i+1].to_dict()
-            forecasts.append(model.forecast(1, [x2]))   
-
-    forecasts = np.array(forecasts).flatten()
+    # One-step forecasts made before each target was learned, the first
+    # one precedes the first target and is dropped
+    forecasts = model.learn_many(ytrain.to_numpy(), Xtrain)[1:]
     return model, forecasts
 
+def score_forecasts(y_true, forecasts, burn_in=7*24*4):
+    """
+    Score one-step forecasts as served, i.e. clipped to 0-100.
+    Forecasts of the warm-up and the first `burn_in` steps are skipped.
+    Returns (mse, mae, number of scored forecasts), inf errors for a diverged model.
+    """
+    y_true = np.asarray(y_true, dtype=float)
+    forecasts = np.asarray(forecasts, dtype=float)
+    # Warm-up forecasts are NaN, any later NaN means the model diverged
+    start = max(burn_in, int(np.argmax(~np.isnan(forecasts))))
+    y_true, forecasts = y_true[start:], forecasts[start:]
+    if len(forecasts) == 0 or not np.isfinite(forecasts).all():
+        return np.inf, np.inf, len(forecasts)
+    forecasts = np.clip(forecasts, 0, 100)
+    return (
+        mean_squared_error(y_true, forecasts),
+        mean_absolute_error(y_true, forecasts),
+        len(forecasts),
+    )
+
 def plot_batch_train(forecasts):
     plt.scatter(range(len(forecasts)), np.clip(forecasts, 0, 100))
     plt.show()
 
-def train_model():
-    file_path = 'weatherbatch.avro'
+def fit_model(file_path='weatherbatch.avro', p=1, d=1, q=1, sp=1, sd=1, sq=1, m=4*24, l2=0.1, lr=LR):
+    """
+    Train a model on a history file and score it.
+    Returns:
+        tuple: Model data and the (mse, mae, n_scored) of its one-step
+            forecasts, inf errors if they or the day-ahead forecast diverged.
+    """
     df = read_avro(file_path)
     X,y = preprocess_data(df)
-    p = 1
-    d = 1
-    q = 1
-    sp = 1
-    sd = 1
-    sq = 1
-    m = 4*24
-    l2 = 1
-    #model, forecasts = batch_train(X, y, p, d, q, sp, sd, sq, m, l2)
-    with open('model.pkl', 'rb') as f:
-        model = pickle.load(f)
-    #plot_batch_train(forecasts)
-    x_hist = X[-24*4:].to_dict(orient='records')
+    with np.errstate(all='ignore'):
+        model, forecasts = batch_train(X, y, p, d, q, sp, sd, sq, m, l2, lr)
+        #plot_batch_train(forecasts)
+        x_hist = FeatureHistory.from_array(list(X.columns), X[-24*4:].to_numpy(dtype=float))
+        horizon = np.asarray(model.forecast(24*4, x_hist.values()))
     timestamp = df['dt'].iloc[-1]
     model_data = {"model": model, "timestamp": timestamp, "x_hist": x_hist,}
+    score = score_forecasts(y[24*4 + 1:], forecasts)
+    if not np.isfinite(horizon).all():
+        score = (np.inf, np.inf, score[2])
+    return model_data, score
+
+def train_model(file_path='weatherbatch.avro', p=1, d=1, q=1, sp=1, sd=1, sq=1, m=4*24, l2=0.1, lr=LR):
+    """
+    Train a model on a history file.
+    Raises:
+        ValueError: If the model diverged.
+    """
+    model_data, (mse, mae, _) = fit_model(file_path, p, d, q, sp, sd, sq, m, l2, lr)
+    if not np.isfinite(mse):
+        raise ValueError(f"Model diverged on {file_path}")
     return model_data
 
 
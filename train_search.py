@@ -0,0 +1,209 @@
+"""
+Hyperparameter search for the batch SNARIMAX model.
+
+Every candidate is scored with the rolling one-step backtest of `batch_train`:
+the model forecasts each target before learning it. Candidates run in a
+process pool; the preprocessed features and targets are placed in shared
+memory once and attached by every worker instead of being pickled per task.
+Results are appended to a CSV as candidates finish, so an interrupted search
+resumes where it stopped. The best candidate is refit and saved with
+`state_codec`.
+
+Usage:
+    python train_search.py --search random --samples 40 --workers 4
+"""
+
+import argparse
+import csv
+import itertools
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from train_batch import LR, preprocess_data, read_avro, score_forecasts, train_model
+from weather_predictions import state_codec
+from weather_predictions.snarimax import NumpySNARIMAX
+
+SEARCH_SPACE = {
+    "p": [0, 1, 2, 3],
+    "d": [0, 1],
+    "q": [0, 1, 2],
+    "sp": [0, 1],
+    "sd": [0, 1],
+    "sq": [0, 1],
+    "m": [24, 4 * 24],
+    "l2": [0.0, 0.01, 0.1, 1.0],
+}
+PARAMS = list(SEARCH_SPACE)
+RESULT_FIELDS = PARAMS + ["mse", "mae", "n_scored", "seconds"]
+HORIZON = 4 * 24
+
+# Shared arrays of a worker process, set by `_attach`
+_shared = {}
+
+
+def grid_candidates(space=SEARCH_SPACE):
+    return [dict(zip(space, values)) for values in itertools.product(*space.values())]
+
+
+def random_candidates(samples, seed=0, space=SEARCH_SPACE):
+    """
+    Draw up to `samples` distinct candidates from the grid. With the same seed
+    a larger sample extends a smaller one, so a search can be resumed with more.
+    """
+    grid = grid_candidates(space)
+    order = np.random.default_rng(seed).permutation(len(grid))
+    return [grid[i] for i in order[:samples]]
+
+
+def candidate_key(candidate):
+    return tuple(str(candidate[name]) for name in PARAMS)
+
+
+def share_array(array):
+    """Copy an array into a new shared memory block."""
+    block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    np.ndarray(array.shape, array.dtype, buffer=block.buf)[...] = array
+    return block, (block.name, array.shape, array.dtype.str)
+
+
+def _attach(specs, columns):
+    for name, (block_name, shape, dtype) in specs.items():
+        # Workers share the resource tracker of the parent, which unlinks
+        block = shared_memory.SharedMemory(name=block_name)
+        _shared[name] = np.ndarray(shape, np.dtype(dtype), buffer=block.buf)
+        _shared[f"_{name}_block"] = block
+    _shared["columns"] = columns
+
+
+def evaluate(candidate, burn_in):
+    """
+    Backtest one candidate on the shared arrays.
+    Args:
+        candidate (dict): SNARIMAX orders and `l2`.
+        burn_in (int): Forecasts to skip before scoring.
+    Returns:
+        dict: The candidate with its scores.
+    """
+    started = time.perf_counter()
+    X, y = _shared["X"], _shared["y"]
+    model = NumpySNARIMAX(**candidate, lr=LR, intercept_lr=LR)
+    model.set_exog(_shared["columns"])
+    # Same alignment as `batch_train`: features lead the target by a day
+    with np.errstate(all="ignore"):
+        forecasts = model.learn_many(y[HORIZON:], X[: len(y) - HORIZON])
+    mse, mae, n_scored = score_forecasts(y[HORIZON:], forecasts, burn_in)
+    return {
+        **candidate,
+        "mse": mse,
+        "mae": mae,
+        "n_scored": n_scored,
+        "seconds": round(time.perf_counter() - started, 3),
+    }
+
+
+def load_results(path):
+    if not os.path.exists(path):
+        return []
+    with open(path, newline="") as f:
+        return list(csv.DictReader(f))
+
+
+def run_search(X, y, candidates, results_path, workers=None, burn_in=7 * 24 * 4):
+    """
+    Evaluate the candidates not yet in `results_path` and append their rows.
+    Returns:
+        list[dict]: All result rows, including those of earlier runs.
+    """
+    results = load_results(results_path)
+    done = {candidate_key(row) for row in results}
+    pending = [c for c in candidates if candidate_key(c) not in done]
+    print(f"{len(done)} candidates already evaluated, {len(pending)} to go")
+    if not pending:
+        return results
+
+    columns = [str(column) for column in X.columns]
+    blocks, specs = [], {}
+    for name, array in (
+        ("X", X.to_numpy(dtype=np.float64)),
+        ("y", y.to_numpy(dtype=np.float64)),
+    ):
+        block, specs[name] = share_array(np.ascontiguousarray(array))
+        blocks.append(block)
+
+    new_file = not os.path.exists(results_path)
+    started = time.perf_counter()
+    try:
+        with open(results_path, "a", newline="") as f, ProcessPoolExecutor(
+            max_workers=workers, initializer=_attach, initargs=(specs, columns)
+        ) as pool:
+            writer = csv.DictWriter(f, fieldnames=RESULT_FIELDS)
+            if new_file:
+                writer.writeheader()
+            futures = [pool.submit(evaluate, c, burn_in) for c in pending]
+            for i, future in enumerate(as_completed(futures), 1):
+                row = future.result()
+                writer.writerow(row)
+                f.flush()
+                results.append(row)
+                rate = i / (time.perf_counter() - started)
+                print(
+                    f"[{i}/{len(pending)}] {candidate_key(row)} "
+                    f"mse={row['mse']:.2f} mae={row['mae']:.2f} ({rate:.2f}/s)"
+                )
+    finally:
+        for block in blocks:
+            block.close()
+            block.unlink()
+    return results
+
+
+def best_candidate(results):
+    best = min(results, key=lambda row: float(row["mse"]))
+    if not np.isfinite(float(best["mse"])):
+        return None
+    return {
+        name: float(best[name]) if name == "l2" else int(best[name]) for name in PARAMS
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--data", default="weatherbatch.avro")
+    parser.add_argument("--search", choices=["grid", "random"], default="random")
+    parser.add_argument("--samples", type=int, default=40)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--burn-in", type=int, default=7 * 24 * 4)
+    parser.add_argument("--results", default="search_results.csv")
+    parser.add_argument("--best-model", default="best_model.bin")
+    args = parser.parse_args()
+
+    X, y = preprocess_data(read_avro(args.data))
+    if args.search == "grid":
+        candidates = grid_candidates()
+    else:
+        candidates = random_candidates(args.samples, args.seed)
+    results = run_search(X, y, candidates, args.results, args.workers, args.burn_in)
+
+    best = best_candidate(results)
+    if best is None:
+        print("Every candidate diverged, no model saved")
+        return
+    print(f"Best candidate: {best}")
+    try:
+        model_data = train_model(args.data, **best)
+    except ValueError as e:
+        # The backtest only scores one-step forecasts
+        print(f"Best candidate diverged on the day-ahead forecast: {e}")
+        return
+    with open(args.best_model, "wb") as f:
+        f.write(state_codec.dumps(model_data))
+    print(f"Saved best model to {args.best_model}")
+
+
+if __name__ == "__main__":
+    main()
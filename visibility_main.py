@@ -1,11 +1,17 @@
 from fastapi import FastAPI, HTTPException
+import asyncio
+from contextlib import asynccontextmanager
 import pandas as pd
 from typing import List
 from retry_requests import retry
 from config import EnvConfig
 from dotenv import load_dotenv
-from clients.mysql_client import MySQLClient
+from clients.async_mysql_client import AsyncMySQLClient
 from clients.cosmos_db import CosmosDBClient
+from services.forecast_cache import ForecastCache
+from services.location_index import AsyncLocationIndex
+from services.satellite_catalog import SatelliteCatalog
+from services.trajectory_index import AsyncTrajectoryIndex
 import os
 from models.satellites import (
     Satellite,
@@ -21,29 +27,63 @@ load_dotenv()
 
 config = EnvConfig(os.environ)
 
-app = FastAPI()
-
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["http://localhost:3000", "http://13.74.48.118:3000"],
-    allow_credentials=True,
-    allow_methods=["*"],  # Zezwalaj na wszystkie metody HTTP (GET, POST itp.)
-    allow_headers=["*"],  # Zezwalaj na wszystkie nagłówki
-)
-
-satellite_mysql_client = MySQLClient(
+satellite_mysql_client = AsyncMySQLClient(
     config.mysql_host,
     "satellite_admin",
     config.mysql_password,
     "satellite_db",
+    pool_size=config.mysql_pool_size,
+    pool_max_lifetime=config.mysql_pool_max_lifetime,
 )
 
-weather_mysql_client = MySQLClient(
+weather_mysql_client = AsyncMySQLClient(
     config.mysql_host,
     "weather_admin",
     config.mysql_password,
     "weather_db",
+    pool_size=config.mysql_pool_size,
+    pool_max_lifetime=config.mysql_pool_max_lifetime,
+)
+
+satellite_catalog = SatelliteCatalog(
+    satellite_mysql_client, refresh_interval=config.satellite_catalog_refresh
+)
+
+location_index = AsyncLocationIndex(
+    weather_mysql_client, refresh_interval=config.location_index_refresh
+)
+
+trajectory_index = AsyncTrajectoryIndex(
+    satellite_mysql_client,
+    horizon=config.trajectory_index_horizon,
+    refresh_interval=config.trajectory_index_refresh,
+    reload_interval=config.trajectory_index_reload,
 )
+
+forecast_cache = ForecastCache(
+    weather_mysql_client,
+    ttl=config.forecast_cache_ttl,
+    version_check_interval=config.forecast_version_check_interval,
+)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    yield
+    await satellite_mysql_client.close()
+    await weather_mysql_client.close()
+
+
+app = FastAPI(lifespan=lifespan)
+
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=["http://localhost:3000", "http://13.74.48.118:3000"],
+    allow_credentials=True,
+    allow_methods=["*"],  # Zezwalaj na wszystkie metody HTTP (GET, POST itp.)
+    allow_headers=["*"],  # Zezwalaj na wszystkie nagłówki
+)
+
 cosmos_db_client_1 = CosmosDBClient(
     config=config, container_name="satellite_visibility_1"
 )
@@ -52,7 +92,7 @@ cosmos_db_client_2 = CosmosDBClient(
 )
 
 
-def get_satellite_trajectory(
+async def get_satellite_trajectory(
     satellite: Satellite, startUTC: int, endUTC: int
 ) -> List[SatelliteTrajectory]:
     """
@@ -62,27 +102,29 @@ def get_satellite_trajectory(
     Returns:
         SatelliteTrajectory: Satellite trajectory data.
     """
-    query = """
-        SELECT * FROM (
-        SELECT satid, startUTC, endUTC, startAz, endAz FROM trajectories
-        WHERE endUTC > %s AND endUTC < (%s + 1200)
-    ) AS candidates
-    WHERE startUTC < %s AND satid = %s;
-    """
-    values = (
-        startUTC,
-        endUTC,
-        endUTC,
-        satellite.id,
-    )
-    with satellite_mysql_client as db:
-        data = db.read(query, values)
+    data = await trajectory_index.satellite_passes(satellite.id, startUTC, endUTC)
+    if data is None:
+        # Outside of the indexed window
+        query = """
+            SELECT * FROM (
+            SELECT satid, startUTC, endUTC, startAz, endAz FROM trajectories
+            WHERE endUTC > %s AND endUTC < (%s + 1200)
+        ) AS candidates
+        WHERE startUTC < %s AND satid = %s;
+        """
+        values = (
+            startUTC,
+            endUTC,
+            endUTC,
+            satellite.id,
+        )
+        data = await satellite_mysql_client.read(query, values)
     if not data:
         raise HTTPException(status_code=404, detail="Satellite not found")
     return [SatelliteTrajectory(**item) for item in data]
 
 
-def get_satellites_in_time_range(
+async def get_satellites_in_time_range(
     start_time: int, end_time: int
 ) -> list[SatelliteTrajectory]:
     """
@@ -93,22 +135,24 @@ def get_satellites_in_time_range(
     Returns:
         list[Satellite]: List of satellites.
     """
-    query = """
-    SELECT * FROM (
-        SELECT satid, startUTC, endUTC, startAz, endAz FROM trajectories
-        WHERE endUTC > %s AND endUTC < (%s + 600)
-    ) AS candidates
-    WHERE startUTC < %s;
-    """
-    values = (start_time, end_time, end_time)
-    with satellite_mysql_client as db:
-        data = db.read(query, values)
+    data = await trajectory_index.overlapping(start_time, end_time)
+    if data is None:
+        # Outside of the indexed window
+        query = """
+        SELECT * FROM (
+            SELECT satid, startUTC, endUTC, startAz, endAz FROM trajectories
+            WHERE endUTC > %s AND endUTC < (%s + 600)
+        ) AS candidates
+        WHERE startUTC < %s;
+        """
+        values = (start_time, end_time, end_time)
+        data = await satellite_mysql_client.read(query, values)
     if not data:
         raise HTTPException(status_code=404, detail="Satellites not found")
     return [SatelliteTrajectory(**item) for item in data]
 
 
-def get_weather_forecast(location: Location) -> WeatherForecast:
+async def get_weather_forecast(location: Location) -> WeatherForecast:
     """
     Get weather forecast data.
     Args:
@@ -116,13 +160,10 @@ def get_weather_forecast(location: Location) -> WeatherForecast:
     Returns:
         WeatherForecast: Weather forecast data.
     """
-    query = "SELECT * from cloud_cover_forecasts WHERE location_id=%s"
-    values = (location.id,)
-    with weather_mysql_client as db:
-        data = db.read(query, values)
-    if not data:
+    data = await forecast_cache.get(location.id)
+    if data is None:
         raise HTTPException(status_code=404, detail="Location not found")
-    return WeatherForecast(**data[0])
+    return WeatherForecast(**data)
 
 
 def convert_utc_to_local(utc_time: int) -> pd.Timestamp:
@@ -146,43 +187,15 @@ def get_forecast_value(forecast: WeatherForecast, forecast_window: int) -> float
     return getattr(forecast, attribute_name)
 
 
-def get_visibility_of_satellite(
-    satellite: Satellite, location: Location
-) -> SatelliteVisibility:
-    """
-    Get visibility of satellite.
-    Args:
-        satellite (Satellite): Satellite object.
-        location (Location): Location object.
-    Returns:
-        dict: Visibility of satellite.
-    """
-    current_time = int(time.time())
-    trajectory = get_satellite_trajectory(
-        satellite,
-        current_time,
-        current_time + 3600 * 24,
-    )
-    forecast = get_weather_forecast(location)
-
-    return SatelliteVisibility(
-        satellite=satellite,
-        passes=trajectory,
-        cloud_cover=forecast,
-    )
-
-
-def get_name_for_sat_id(sat_id: int) -> str:
-    query = "SELECT name FROM satellites WHERE id = %s"
-    with satellite_mysql_client as db:
-        data = db.read(query, (sat_id,))
-    if not data:
+async def get_names_for_sat_ids(sat_ids: List[int]) -> dict[int, str]:
+    names = await satellite_catalog.names(sat_ids)
+    if len(names) < len(set(sat_ids)):
         raise HTTPException(status_code=404, detail="Satellite not found")
-    return data[0]["name"]
+    return names
 
 
 @app.post("/visibility_of_satellite", tags=["visibility"])
-def get_visibility_of_satellite(
+async def get_visibility_of_satellite(
     satellite: Satellite, location: Location
 ) -> SatelliteVisibility:
     """
@@ -194,10 +207,10 @@ def get_visibility_of_satellite(
         dict: Visibility of satellite.
     """
     current_time = int(time.time())
-    trajectory = get_satellite_trajectory(
-        satellite, current_time, current_time + 3600 * 24
+    trajectory, forecast = await asyncio.gather(
+        get_satellite_trajectory(satellite, current_time, current_time + 3600 * 24),
+        get_weather_forecast(location),
     )
-    forecast = get_weather_forecast(location)
 
     return SatelliteVisibility(
         satellite=satellite,
@@ -206,28 +219,20 @@ def get_visibility_of_satellite(
     )
 
 
-def get_closes_location(lat: float, long: float) -> Location:
-    query = """
-    SELECT id
-    FROM locations
-    ORDER BY
-        111.045 * DEGREES(ACOS(LEAST(1, COS(RADIANS(%s))
-        * COS(RADIANS(latitude))
-        * COS(RADIANS(%s) - RADIANS(longitude))
-        + SIN(RADIANS(%s))
-        * SIN(RADIANS(latitude))))) ASC
-    LIMIT 1;
-    """
-    values = (lat, long, lat)
-    with weather_mysql_client as db:
-        data = db.read(query, values)
-    if not data:
+async def get_closes_location(lat: float, long: float) -> Location:
+    index = await location_index.get()
+    if index is None:
         raise HTTPException(status_code=404, detail="Location not found")
-    return Location(id=data[0]["id"], latitude=lat, longitude=long)
+    return Location(id=index.nearest(lat, long), latitude=lat, longitude=long)
+
+
+async def get_closest_forecast(lat: float, long: float) -> WeatherForecast:
+    location = await get_closes_location(lat, long)
+    return await get_weather_forecast(location)
 
 
 @app.post("/visibile_satellites", tags=["visibility"])
-def _get_visibile_satellites(
+async def _get_visibile_satellites(
     lat: float, long: float, start_time: int = 1737327887
 ) -> VisibleSatellites:
     """
@@ -238,16 +243,18 @@ def _get_visibile_satellites(
     Returns:
         VisibleSatellites: An object containing the list of visible satellites, their passes, and the cloud cover forecast.
     """
-    satellites = get_satellites_in_time_range(start_time, start_time + 3599)
-    location = get_closes_location(lat, long)
-    forecast = get_weather_forecast(location)
+    satellites, forecast = await asyncio.gather(
+        get_satellites_in_time_range(start_time, start_time + 3599),
+        get_closest_forecast(lat, long),
+    )
     current_time = int(time.time())
     start_forecast = (start_time - current_time) // 3600
     relevant_forecast = get_forecast_value(forecast, start_forecast)
+    names = await get_names_for_sat_ids([satellite.satid for satellite in satellites])
 
     return VisibleSatellites(
         satellites=[
-            Satellite(id=satellite.satid, name=get_name_for_sat_id(satellite.satid))
+            Satellite(id=satellite.satid, name=names[satellite.satid])
             for satellite in satellites
         ],
         passes=satellites,
@@ -0,0 +1,175 @@
+"""
+Streaming Avro container I/O for the weather histories.
+
+Files are read block by block into columnar NumPy chunks, so memory is
+bounded by the chunk size rather than the file size. Time ranges are
+answered by decoding only the first record of every block: in a file whose
+records are ordered by the time field, as the backfill writes them, a block
+is skipped when the next block already starts before the range. Writers
+stream records into blocks and append blocks to existing files.
+"""
+
+import os
+
+import fastavro
+import numpy as np
+
+_DTYPES = {
+    "int": np.int64,
+    "long": np.int64,
+    "float": np.float64,
+    "double": np.float64,
+    "boolean": bool,
+}
+
+
+def _columns_of(schema):
+    return [
+        (field["name"], _DTYPES.get(field["type"], object))
+        for field in schema["fields"]
+    ]
+
+
+def _first_value(block, field):
+    record = next(iter(block))
+    # Iterating a block continues where the previous iteration stopped
+    block.bytes_.seek(0)
+    return record[field]
+
+
+def iter_blocks(f, start=None, end=None, time_field="dt"):
+    """
+    Iterate the blocks of an open Avro file that may hold records in
+    [start, end). The records of a yielded block are not filtered.
+    Args:
+        f (BinaryIO): File opened in binary mode.
+        start (int, optional): Inclusive lower bound of `time_field`.
+        end (int, optional): Exclusive upper bound of `time_field`.
+        time_field (str): Field the records are ordered by.
+    """
+    if start is None and end is None:
+        yield from fastavro.block_reader(f)
+        return
+    pending = None
+    for block in fastavro.block_reader(f):
+        if block.num_records == 0:
+            continue
+        first = _first_value(block, time_field)
+        if end is not None and first >= end:
+            break
+        # The pending block ends at or before `first`
+        if pending is not None and (start is None or first >= start):
+            yield pending
+        pending = block
+    if pending is not None:
+        yield pending
+
+
+def iter_chunks(path, chunk_size=65536, start=None, end=None, time_field="dt"):
+    """
+    Read an Avro file as columnar chunks.
+    Args:
+        path (str): Avro container file.
+        chunk_size (int): Maximum records per chunk.
+        start (int, optional): Inclusive lower bound of `time_field`.
+        end (int, optional): Exclusive upper bound of `time_field`.
+        time_field (str): Field the records are ordered by, only needed for
+            time ranges.
+    Yields:
+        dict[str, np.ndarray]: Column arrays of up to `chunk_size` records.
+    """
+    with open(path, "rb") as f:
+        columns = None
+        records = []
+        for block in iter_blocks(f, start, end, time_field):
+            if columns is None:
+                columns = _columns_of(block.writer_schema)
+            for record in block:
+                t = record.get(time_field)
+                if (start is not None and t < start) or (end is not None and t >= end):
+                    continue
+                records.append(record)
+                if len(records) == chunk_size:
+                    yield _to_columns(records, columns)
+                    records = []
+        if records:
+            yield _to_columns(records, columns)
+
+
+def read_columns(path, start=None, end=None, time_field="dt", chunk_size=65536):
+    """
+    Read an Avro file, or the records of a time range, into column arrays.
+    Returns:
+        dict[str, np.ndarray]: One array per field, empty if nothing matched.
+    """
+    chunks = list(iter_chunks(path, chunk_size, start, end, time_field))
+    if not chunks:
+        with open(path, "rb") as f:
+            schema = fastavro.reader(f).writer_schema
+        return {name: np.array([], dtype=dtype) for name, dtype in _columns_of(schema)}
+    return {
+        name: np.concatenate([chunk[name] for chunk in chunks]) for name in chunks[0]
+    }
+
+
+def read_last(path):
+    """Decode the last record of an Avro file, None if it has none."""
+    last = None
+    with open(path, "rb") as f:
+        for block in fastavro.block_reader(f):
+            if block.num_records:
+                last = block
+        if last is None:
+            return None
+        record = None
+        for record in last:
+            pass
+        return record
+
+
+def write(path, schema, records, sync_interval=16000):
+    """
+    Write records to a new Avro file, streaming them into blocks.
+    Args:
+        path (str): Destination file, replaced if it exists.
+        schema (dict): Avro schema of the records.
+        records (Iterable[dict]): Records, e.g. a generator.
+        sync_interval (int): Approximate block size in bytes.
+    """
+    with open(path, "wb") as f:
+        fastavro.writer(f, schema, records, sync_interval=sync_interval)
+
+
+def append(path, schema, records, fsync=False, sync_interval=16000):
+    """
+    Append records to an Avro file as new blocks, creating it if needed.
+    Args:
+        path (str): Avro container file.
+        schema (dict): Avro schema of the records, used for a new file.
+        records (Iterable[dict]): Records to append.
+        fsync (bool): Wait until the blocks are on disk.
+        sync_interval (int): Approximate block size in bytes.
+    """
+    # fastavro appends to an existing container file opened "a+b"
+    mode = "a+b" if os.path.exists(path) and os.path.getsize(path) else "wb"
+    with open(path, mode) as f:
+        fastavro.writer(f, schema, records, sync_interval=sync_interval)
+        if fsync:
+            f.flush()
+            os.fsync(f.fileno())
+
+
+def to_records(columns):
+    """Iterate column arrays as records, e.g. to write a chunk back."""
+    names = list(columns)
+    for values in zip(*(columns[name].tolist() for name in names)):
+        yield dict(zip(names, values))
+
+
+def _to_columns(records, columns):
+    return {
+        name: np.fromiter(
+            (record[name] for record in records), dtype=dtype, count=len(records)
+        )
+        for name, dtype in columns
+    }
@@ -0,0 +1,326 @@
+"""
+Resumable backfill of hourly weather history from the OpenWeather history API.
+
+Locations are fetched concurrently, while a shared token bucket keeps the
+request rate under the API limit. Every location is paged through week by
+week and its records are appended to `<out_dir>/<id>.avro` in chunks, in the
+`HISTORY_SCHEMA` format read by `train_batch.read_avro`. Once a chunk is on
+disk the timestamp of its last record is stored in a JSON checkpoint, so an
+interrupted run continues after the last stored record of every location.
+
+Usage:
+    python -m weather_predictions.backfill --out-dir histories --rate 10
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import time
+
+import fastavro
+import requests
+
+from weather_predictions import avro_io
+
+HISTORY_API_URL = "https://history.openweathermap.org/data/2.5/history/city"
+HISTORY_SECONDS = 60 * 60 * 24 * 364
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+HISTORY_SCHEMA = fastavro.parse_schema(
+    {
+        "type": "record",
+        "name": "WeatherData",
+        "fields": [
+            {"name": "dt", "type": "long"},
+            {"name": "temp", "type": "float"},
+            {"name": "pressure", "type": "int"},
+            {"name": "humidity", "type": "int"},
+            {"name": "wind_speed", "type": "float"},
+            {"name": "wind_deg", "type": "int"},
+            {"name": "precipitation", "type": "float"},
+            {"name": "clouds", "type": "int"},
+        ],
+    }
+)
+
+
+def to_history_record(d):
+    """Flatten one item of the history API response into a `HISTORY_SCHEMA` record."""
+    precipitation = 0.0
+    if "rain" in d:
+        precipitation += d["rain"]["1h"]
+    if "snow" in d:
+        precipitation += d["snow"]["1h"]
+    return {
+        "dt": d["dt"],
+        "temp": d["main"]["temp"],
+        "pressure": d["main"]["pressure"],
+        "humidity": d["main"]["humidity"],
+        "wind_speed": d["wind"]["speed"],
+        "wind_deg": d["wind"]["deg"],
+        "precipitation": precipitation,
+        "clouds": d["clouds"]["all"],
+    }
+
+
+class RateLimiter:
+    """
+    Token bucket shared by all requests of a backfill.
+    Args:
+        rate (float): Requests per second.
+        burst (int): Requests that may be sent at once after an idle period.
+    """
+
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._updated_at = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            now = time.monotonic()
+            self._tokens = min(
+                self.burst, self._tokens + (now - self._updated_at) * self.rate
+            )
+            self._updated_at = now
+            if self._tokens < 1:
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+                self._tokens = 1
+                self._updated_at = time.monotonic()
+            self._tokens -= 1
+
+
+class Checkpoint:
+    """
+    Timestamp of the last stored record of every location, kept in a JSON file.
+    The file is replaced atomically on every update.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._last = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                self._last = {int(id): dt for id, dt in json.load(f).items()}
+
+    def get(self, id):
+        return self._last.get(id)
+
+    def set(self, id, dt):
+        self._last[id] = dt
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({str(id): dt for id, dt in self._last.items()}, f)
+        os.replace(tmp_path, self.path)
+
+
+class Backfill:
+    """
+    Fetches the history of many locations into per-location Avro files.
+    Args:
+        api_key (str): OpenWeather API key.
+        out_dir (str): Directory of the `<id>.avro` files and the checkpoint.
+        rate (float): Maximum requests per second over all locations.
+        concurrency (int): Locations fetched at the same time.
+        chunk_size (int): Records buffered per location before appending.
+        retries (int): Retries of a request failing with a transient error.
+        backoff (float): Seconds before the first retry, doubled every retry.
+        timeout (float): Request timeout in seconds.
+        url (str): History API endpoint.
+    """
+
+    def __init__(
+        self,
+        api_key,
+        out_dir,
+        rate=10.0,
+        concurrency=8,
+        chunk_size=1000,
+        retries=5,
+        backoff=1.0,
+        timeout=30.0,
+        url=HISTORY_API_URL,
+    ):
+        self.api_key = api_key
+        self.out_dir = out_dir
+        self.rate = rate
+        self.concurrency = concurrency
+        self.chunk_size = chunk_size
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.url = url
+        os.makedirs(out_dir, exist_ok=True)
+        self.checkpoint = Checkpoint(os.path.join(out_dir, "checkpoint.json"))
+        self.requests = 0
+        self._limiter = RateLimiter(rate)
+
+    def path(self, id):
+        return os.path.join(self.out_dir, f"{id}.avro")
+
+    async def run(self, locations, end_time=None):
+        """
+        Backfill the history up to `end_time` of every location.
+        Args:
+            locations (list[dict]): Rows with `id`, `latitude` and `longitude`.
+            end_time (int, optional): Unix time to fetch up to, now by default.
+        Returns:
+            dict: Error of every location that failed, by id.
+        """
+        end_time = int(time.time()) if end_time is None else end_time
+        semaphore = asyncio.Semaphore(self.concurrency)
+        failed = {}
+        started = time.perf_counter()
+
+        async def fetch(location):
+            async with semaphore:
+                try:
+                    return await self.fetch_location(location, end_time)
+                except Exception as e:
+                    logging.error(f"Backfill of location {location['id']} failed: {e}")
+                    failed[location["id"]] = e
+                    return 0
+
+        tasks = [asyncio.ensure_future(fetch(location)) for location in locations]
+        records = 0
+        for done, task in enumerate(asyncio.as_completed(tasks), 1):
+            records += await task
+            if done % 50 == 0 or done == len(tasks):
+                elapsed = time.perf_counter() - started
+                print(
+                    f"Backfilled {done}/{len(tasks)} locations, {records} records, "
+                    f"{self.requests} requests in {elapsed:.0f}s"
+                )
+        return failed
+
+    async def fetch_location(self, location, end_time):
+        """
+        Fetch the missing history of one location and append it to its file.
+        Returns:
+            int: Number of new records.
+        """
+        id = location["id"]
+        last = self.checkpoint.get(id)
+        if (
+            last is None
+            and os.path.exists(self.path(id))
+            and os.path.getsize(self.path(id))
+        ):
+            last = self._last_stored(id)
+        start_time = (
+            end_time - HISTORY_SECONDS
+            if last is None
+            else max(last + 3600, end_time - HISTORY_SECONDS)
+        )
+        session = requests.Session()
+        chunk = []
+        stored = 0
+        try:
+            while start_time < end_time:
+                items = await self._get_page(
+                    session,
+                    location["latitude"],
+                    location["longitude"],
+                    start_time,
+                    end_time,
+                )
+                # Pages may overlap the last stored record
+                items = [d for d in items if d["dt"] >= start_time]
+                if not items:
+                    break
+                chunk.extend(to_history_record(d) for d in items)
+                start_time = items[-1]["dt"] + 3600
+                if len(chunk) >= self.chunk_size:
+                    stored += self._append(id, chunk)
+                    chunk = []
+            stored += self._append(id, chunk)
+        finally:
+            session.close()
+        return stored
+
+    def _last_stored(self, id):
+        # A file without a checkpoint, e.g. written before checkpointing
+        record = avro_io.read_last(self.path(id))
+        return None if record is None else record["dt"]
+
+    def _append(self, id, records):
+        if not records:
+            return 0
+        avro_io.append(self.path(id), HISTORY_SCHEMA, records, fsync=True)
+        # Only checkpoint records that are safely on disk
+        self.checkpoint.set(id, records[-1]["dt"])
+        return len(records)
+
+    async def _get_page(self, session, lat, lon, start_time, end_time):
+        params = {
+            "lat": lat,
+            "lon": lon,
+            "type": "hour",
+            "start": start_time,
+            "end": end_time,
+            "units": "metric",
+            "appid": self.api_key,
+        }
+        for attempt in range(self.retries + 1):
+            await self._limiter.acquire()
+            self.requests += 1
+            try:
+                response = await asyncio.to_thread(
+                    session.get, self.url, params=params, timeout=self.timeout
+                )
+            except requests.RequestException as e:
+                error = e
+            else:
+                if response.status_code == 200:
+                    return response.json()["list"]
+                error = RuntimeError(
+                    f"Failed to fetch API data. Status code: {response.status_code}, "
+                    f"Message: {response.text}"
+                )
+                if response.status_code not in RETRY_STATUS_CODES:
+                    raise error
+            if attempt == self.retries:
+                raise error
+            await asyncio.sleep(self.backoff * 2**attempt * random.uniform(0.5, 1.0))
+
+
+def main():
+    from dotenv import load_dotenv
+
+    from clients.mysql_client import MySQLClient
+    from config import EnvConfig
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--out-dir", default="histories")
+    parser.add_argument("--rate", type=float, default=10.0)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--chunk-size", type=int, default=1000)
+    args = parser.parse_args()
+
+    load_dotenv()
+    config = EnvConfig(os.environ)
+    mysql_client = MySQLClient(
+        config.mysql_host, "weather_admin", config.mysql_password, "weather_db"
+    )
+    with mysql_client as db:
+        locations = db.read("SELECT id, latitude, longitude FROM locations", ())
+    backfill = Backfill(
+        config.openweather_api_key,
+        args.out_dir,
+        rate=args.rate,
+        concurrency=args.concurrency,
+        chunk_size=args.chunk_size,
+    )
+    failed = asyncio.run(backfill.run(locations))
+    if failed:
+        print(f"{len(failed)} locations failed: {sorted(failed)}")
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
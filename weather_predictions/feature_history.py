@@ -0,0 +1,85 @@
+import numpy as np
+
+
+class FeatureHistory:
+    """
+    Fixed-size window of the latest feature rows of a location, oldest first.
+    Rows live in a float64 array of twice the capacity and every row is
+    written at both `i` and `i + capacity`, so the current window is always
+    the contiguous slice starting at the oldest row. Pushing a row is O(1)
+    and `values` returns the window as a view without copying.
+    Args:
+        columns (list[str]): Feature names, in column order.
+        capacity (int): Number of rows in the window.
+    """
+
+    def __init__(self, columns, capacity=96):
+        self.columns = list(columns)
+        self.capacity = capacity
+        self._buffer = np.zeros((2 * capacity, len(self.columns)))
+        self._start = 0
+
+    @classmethod
+    def from_array(cls, columns, rows):
+        """Build a full window from rows in time order."""
+        rows = np.asarray(rows, dtype=float)
+        history = cls(columns, len(rows))
+        history._buffer[: len(rows)] = rows
+        history._buffer[len(rows) :] = rows
+        return history
+
+    @classmethod
+    def from_records(cls, records):
+        """Build a full window from a list of feature dicts, the former format."""
+        columns = list(records[0]) if len(records) else []
+        rows = [[float(x[column]) for column in columns] for x in records]
+        return cls.from_array(columns, np.reshape(rows, (len(records), len(columns))))
+
+    def __len__(self):
+        return self.capacity
+
+    def __getitem__(self, i):
+        """Row `i` of the window as a dict, 0 being the oldest."""
+        if not -self.capacity <= i < self.capacity:
+            raise IndexError("feature history index out of range")
+        row = self._buffer[self._start + i % self.capacity]
+        return dict(zip(self.columns, row.tolist()))
+
+    def __iter__(self):
+        return iter(self.records())
+
+    def __array__(self, dtype=None, copy=None):
+        return np.asarray(self.values(), dtype=dtype)
+
+    def __reduce__(self):
+        # Pickle the window only, not the doubled buffer
+        return FeatureHistory.from_array, (self.columns, self.values().copy())
+
+    def values(self):
+        """The window as a read-only (capacity, columns) view, oldest row first."""
+        view = self._buffer[self._start : self._start + self.capacity]
+        view.flags.writeable = False
+        return view
+
+    def records(self):
+        """The window as a list of feature dicts, oldest first."""
+        return [dict(zip(self.columns, row)) for row in self.values().tolist()]
+
+    def push(self, x):
+        """
+        Append the newest row, dropping the oldest one.
+        Args:
+            x (dict | array-like): Features by name, or values in column order.
+        """
+        if not self.capacity:
+            return
+        if isinstance(x, dict):
+            try:
+                row = [x[column] for column in self.columns]
+            except KeyError as e:
+                raise ValueError(f"Missing feature {e}")
+        else:
+            row = x
+        self._buffer[self._start] = row
+        self._buffer[self._start + self.capacity] = row
+        self._start = (self._start + 1) % self.capacity
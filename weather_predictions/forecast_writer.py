@@ -0,0 +1,165 @@
+import logging
+import threading
+
+FORECAST_COLUMNS = [f"forecast_hour_{hour}" for hour in range(1, 25)]
+
+UPSERT_QUERY = """
+    INSERT INTO cloud_cover_forecasts (location_id, {columns})
+    VALUES ({placeholders})
+    ON DUPLICATE KEY UPDATE {updates}
+""".format(
+    columns=", ".join(FORECAST_COLUMNS),
+    placeholders=", ".join(["%s"] * (len(FORECAST_COLUMNS) + 1)),
+    updates=", ".join(f"{column} = VALUES({column})" for column in FORECAST_COLUMNS),
+)
+
+# Single-row marker bumped with every write, and the version each location
+# last changed in, readers use them to invalidate the changed cache entries
+CREATE_VERSION_TABLE_QUERY = """
+    CREATE TABLE IF NOT EXISTS forecast_version (
+        id TINYINT PRIMARY KEY,
+        version BIGINT NOT NULL
+    )
+"""
+CREATE_CHANGES_TABLE_QUERY = """
+    CREATE TABLE IF NOT EXISTS forecast_changes (
+        location_id INT PRIMARY KEY,
+        version BIGINT NOT NULL,
+        KEY (version)
+    )
+"""
+BUMP_VERSION_QUERY = """
+    INSERT INTO forecast_version (id, version) VALUES (1, 1)
+    ON DUPLICATE KEY UPDATE version = version + 1
+"""
+FORECAST_VERSION_QUERY = "SELECT version FROM forecast_version WHERE id = 1"
+MARK_CHANGED_QUERY = """
+    INSERT INTO forecast_changes (location_id, version) VALUES (%s, %s)
+    ON DUPLICATE KEY UPDATE version = VALUES(version)
+"""
+CHANGED_SINCE_QUERY = """
+    SELECT location_id FROM forecast_changes WHERE version > %s AND version <= %s
+"""
+
+
+def create_version_tables(db):
+    """Create the version tables. DDL commits implicitly in MySQL."""
+    db.execute(CREATE_VERSION_TABLE_QUERY)
+    db.execute(CREATE_CHANGES_TABLE_QUERY)
+
+
+def bump_version(db, ids):
+    """
+    Bump the marker and record it as the version of the changed locations,
+    in the open transaction.
+    Args:
+        db (MySQLClient): Connected client.
+        ids (Iterable[int]): Ids of the changed locations.
+    Returns:
+        int: The new version.
+    """
+    db.execute(BUMP_VERSION_QUERY, commit=False)
+    # Reads the marker as bumped by this transaction
+    version = db.read(FORECAST_VERSION_QUERY)[0]["version"]
+    db.executemany(MARK_CHANGED_QUERY, [(id, version) for id in ids], commit=False)
+    return version
+
+
+class ForecastWriter:
+    """
+    Buffers forecasts of many locations and writes them as one upsert.
+    Only the latest forecast of every location is kept. A flush sends all
+    pending rows in a single `executemany`, which the MySQL connector rewrites
+    into a multi-row `INSERT ... ON DUPLICATE KEY UPDATE` committed in one
+    transaction. The same transaction bumps the `forecast_version` marker and
+    records it for the written locations, so API caches drop only the
+    forecasts that changed. Flushes happen when `max_rows`
+    locations are pending, every `flush_interval` seconds once started, and
+    on `close`.
+    Args:
+        mysql_client (MySQLClient): Client of the weather database.
+        max_rows (int): Number of pending locations that triggers a flush.
+        flush_interval (float): Seconds between background flushes.
+    """
+
+    def __init__(self, mysql_client, max_rows=500, flush_interval=5.0):
+        self.mysql_client = mysql_client
+        self.max_rows = max_rows
+        self.flush_interval = flush_interval
+        self._pending = {}
+        self._lock = threading.Lock()
+        # Serializes flushes so rows of one location are written in order
+        self._flush_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._flusher = None
+        self._version_table_ready = False
+
+    def __len__(self):
+        return len(self._pending)
+
+    def add(self, id, forecast):
+        row = tuple(float(value) for value in forecast)
+        if len(row) != len(FORECAST_COLUMNS):
+            raise ValueError(f"Expected {len(FORECAST_COLUMNS)} hourly values, got {len(row)}")
+        with self._lock:
+            self._pending[id] = row
+            full = len(self._pending) >= self.max_rows
+        if full:
+            try:
+                self.flush()
+            except Exception as e:
+                logging.error(f"Error writing forecasts to MySQL: {e}")
+
+    def flush(self):
+        """
+        Write every pending forecast.
+        Raises:
+            RuntimeError: If the write failed. The rows are kept for the next flush.
+        """
+        with self._flush_lock:
+            with self._lock:
+                rows, self._pending = self._pending, {}
+            if not rows:
+                return
+            try:
+                with self.mysql_client as db:
+                    if not self._version_table_ready:
+                        create_version_tables(db)
+                        self._version_table_ready = True
+                    db.executemany(
+                        UPSERT_QUERY,
+                        [(id,) + row for id, row in rows.items()],
+                        commit=False,
+                    )
+                    bump_version(db, rows)
+                    db.commit()
+            except Exception:
+                with self._lock:
+                    # Forecasts added during the failed write are newer
+                    rows.update(self._pending)
+                    self._pending = rows
+                raise
+        logging.info(f"Wrote forecasts for {len(rows)} locations")
+
+    def start(self):
+        if self._flusher is not None:
+            return
+        self._stop.clear()
+        self._flusher = threading.Thread(
+            target=self._flush_periodically, name="forecast-writer", daemon=True
+        )
+        self._flusher.start()
+
+    def close(self):
+        self._stop.set()
+        if self._flusher is not None:
+            self._flusher.join()
+            self._flusher = None
+        self.flush()
+
+    def _flush_periodically(self):
+        while not self._stop.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception as e:
+                logging.error(f"Error writing forecasts to MySQL: {e}")
@@ -1,7 +1,15 @@
 from clients.mysql_client import MySQLClient
 from dotenv import load_dotenv
+import argparse
 import os
+import time
 from config import EnvConfig
+from services.location_index import LOCATIONS_QUERY
+from weather_predictions.forecast_writer import (
+    FORECAST_COLUMNS,
+    bump_version,
+    create_version_tables,
+)
 import numpy as np
 
 load_dotenv()
@@ -14,33 +22,126 @@ mysql_client = MySQLClient(
     "weather_db",
 )
 
+# Coordinates are compared at this many decimals, well below any grid step
+COORDINATE_DECIMALS = 4
+# Rows per multi-row statement, keeps statements below max_allowed_packet
+CHUNK_ROWS = 5000
 
-def initialize_tables():
-    with mysql_client as db:
-        db.execute("SET FOREIGN_KEY_CHECKS = 0")
-        # Truncate the cloud_cover_forecasts table to remove all rows and reset auto-increment
-        db.execute("TRUNCATE TABLE cloud_cover_forecasts")
+INSERT_LOCATIONS_QUERY = "INSERT INTO locations (latitude, longitude) VALUES (%s, %s)"
+# Zero forecasts for every location that has no forecast row yet
+INSERT_MISSING_FORECASTS_QUERY = """
+    INSERT INTO cloud_cover_forecasts (location_id, {columns})
+    SELECT l.id, {zeros} FROM locations l
+    LEFT JOIN cloud_cover_forecasts f ON f.location_id = l.id
+    WHERE f.location_id IS NULL
+""".format(
+    columns=", ".join(FORECAST_COLUMNS),
+    zeros=", ".join(["0"] * len(FORECAST_COLUMNS)),
+)
+DELETE_FORECASTS_QUERY = "DELETE FROM cloud_cover_forecasts WHERE location_id IN ({})"
+DELETE_LOCATIONS_QUERY = "DELETE FROM locations WHERE id IN ({})"
+
+
+def grid_points(step=0.2, lat_range=(49.1, 55), lon_range=(14.1, 24)):
+    """
+    Points of the location grid, the same points as the original double loop
+    for the default step.
+    Returns:
+        list[tuple[float, float]]: Latitude and longitude pairs.
+    """
+    lats = np.arange(lat_range[0], lat_range[1], step)
+    lons = np.arange(lon_range[0], lon_range[1], step)
+    lat_grid, lon_grid = np.meshgrid(lats, lons, indexing="ij")
+    return list(
+        zip(
+            np.round(lat_grid.ravel(), 6).tolist(),
+            np.round(lon_grid.ravel(), 6).tolist(),
+        )
+    )
+
+
+def _key(lat, lon):
+    return (
+        round(float(lat), COORDINATE_DECIMALS),
+        round(float(lon), COORDINATE_DECIMALS),
+    )
 
-        # Truncate the locations table to remove all rows and reset auto-increment
-        db.execute("TRUNCATE TABLE locations")
-        db.execute("SET FOREIGN_KEY_CHECKS = 1")
 
-        # Insert new rows into the locations table using a double loop
-        insert_query = "INSERT INTO locations (latitude, longitude) VALUES (%s, %s)"
+def _chunks(rows):
+    for i in range(0, len(rows), CHUNK_ROWS):
+        yield rows[i : i + CHUNK_ROWS]
+
+
+def provision_grid(db, points, prune=True):
+    """
+    Bring the locations table to the given grid in one transaction.
+    Only the difference to the current grid is written: new points are
+    inserted with multi-row inserts, points no longer in the grid are deleted
+    with their forecasts if `prune` is set, and zero forecasts are derived
+    for new locations with a single `INSERT ... SELECT`. Existing locations
+    keep their ids and forecasts.
+    Args:
+        db (MySQLClient): Connected client.
+        points (list[tuple[float, float]]): Latitude and longitude pairs.
+        prune (bool): Delete locations that are not in the grid.
+    Returns:
+        tuple[int, int]: Number of added and removed locations.
+    """
+    # DDL commits implicitly in MySQL, so it must not run inside the transaction
+    create_version_tables(db)
+    existing = {}
+    for row in db.read(LOCATIONS_QUERY):
+        existing[_key(row["latitude"], row["longitude"])] = row["id"]
+    wanted = {_key(lat, lon): (lat, lon) for lat, lon in points}
+
+    added = [point for key, point in wanted.items() if key not in existing]
+    removed = (
+        [id for key, id in existing.items() if key not in wanted] if prune else []
+    )
+    for rows in _chunks(added):
+        db.executemany(INSERT_LOCATIONS_QUERY, rows, commit=False)
+    for ids in _chunks(removed):
+        placeholders = ", ".join(["%s"] * len(ids))
+        db.execute(DELETE_FORECASTS_QUERY.format(placeholders), ids, commit=False)
+        db.execute(DELETE_LOCATIONS_QUERY.format(placeholders), ids, commit=False)
+    db.execute(INSERT_MISSING_FORECASTS_QUERY, commit=False)
+    if removed:
+        # API caches drop forecasts of removed locations, new ones are not cached
+        bump_version(db, removed)
+    db.commit()
+    return len(added), len(removed)
+
+
+def initialize_tables(step=0.2, reset=False, prune=True):
+    """
+    Provision the location grid and its forecast rows.
+    Args:
+        step (float): Grid step in degrees.
+        reset (bool): Truncate both tables first, renumbering the locations.
+        prune (bool): Delete locations that are not in the grid.
+    """
+    started = time.perf_counter()
+    with mysql_client as db:
+        if reset:
+            db.execute("SET FOREIGN_KEY_CHECKS = 0")
+            # Truncate the cloud_cover_forecasts table to remove all rows and reset auto-increment
+            db.execute("TRUNCATE TABLE cloud_cover_forecasts")
 
-        for lat in np.arange(49.1, 55, 0.2):
-            for lon in np.arange(14.1, 24, 0.2):
-                values = (lat, lon)
-                db.insert(insert_query, values)
+            # Truncate the locations table to remove all rows and reset auto-increment
+            db.execute("TRUNCATE TABLE locations")
+            db.execute("SET FOREIGN_KEY_CHECKS = 1")
 
-        location_ids = db.read("SELECT id FROM locations")
-        insert_query = """
-INSERT INTO cloud_cover_forecasts VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-"""
-        for location in location_ids:
-            values = (location["id"],) + (0,) * 24
-            db.insert(insert_query, values)
+        added, removed = provision_grid(db, grid_points(step), prune)
+    print(
+        f"Added {added} and removed {removed} locations "
+        f"in {time.perf_counter() - started:.1f}s"
+    )
 
 
 if __name__ == "__main__":
-    initialize_tables()
+    parser = argparse.ArgumentParser(description="Provision the location grid")
+    parser.add_argument("--step", type=float, default=0.2)
+    parser.add_argument("--reset", action="store_true")
+    parser.add_argument("--no-prune", dest="prune", action="store_false")
+    args = parser.parse_args()
+    initialize_tables(args.step, args.reset, args.prune)
@@ -0,0 +1,237 @@
+import logging
+import pickle
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+
+def model_blob_name(id):
+    """Name of the blob holding the model of a location."""
+    return f"model_{id}.pkl"
+
+
+class _Entry:
+    __slots__ = ("model_data", "size", "dirty", "lock", "pins")
+
+    def __init__(self, model_data, size):
+        self.model_data = model_data
+        self.size = size
+        self.dirty = False
+        self.lock = threading.Lock()
+        # Number of checkouts holding the entry, guarded by the cache lock
+        self.pins = 0
+
+
+class ModelCache:
+    """
+    Resident cache of per-location model data with write-behind checkpointing.
+    Models are loaded from ADLS on the first access and kept in memory. Updated
+    models are only marked dirty and uploaded by `flush`, which runs on a
+    background interval, when a dirty model is evicted and on `close`. The
+    cache is bounded by the serialized size of the models and evicts the
+    least recently used ones first.
+    Args:
+        adls_client (ADLSClient): Client used to load and store the models.
+        container_name (str): Container holding the `model_{id}.pkl` blobs.
+        max_bytes (int): Upper bound of the cached models' serialized size.
+        flush_interval (float): Seconds between background flushes.
+        dumps (callable): Serializer of the model data.
+        loads (callable): Deserializer of the model data.
+    """
+
+    def __init__(
+        self,
+        adls_client,
+        container_name,
+        max_bytes=512 * 1024 * 1024,
+        flush_interval=300.0,
+        dumps=pickle.dumps,
+        loads=pickle.loads,
+    ):
+        self.adls_client = adls_client
+        self.container_name = container_name
+        self.max_bytes = max_bytes
+        self.flush_interval = flush_interval
+        self.dumps = dumps
+        self.loads = loads
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        # Entries removed from the LRU whose upload has not finished yet
+        self._evicting = {}
+        self._size = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._flusher = None
+
+    def blob_name(self, id):
+        return model_blob_name(id)
+
+    @property
+    def size(self):
+        return self._size
+
+    def __len__(self):
+        return len(self._entries)
+
+    def start(self):
+        """Start the background flush thread."""
+        if self._flusher is not None:
+            return
+        self._stop.clear()
+        self._flusher = threading.Thread(
+            target=self._flush_periodically, name="model-cache-flusher", daemon=True
+        )
+        self._flusher.start()
+
+    def close(self):
+        """Stop the background thread and upload every dirty model."""
+        self._stop.set()
+        if self._flusher is not None:
+            self._flusher.join()
+            self._flusher = None
+        self.flush()
+
+    @contextmanager
+    def checkout(self, id):
+        """
+        Borrow the model data of a location for an update.
+        The model data is yielded for in-place modification and marked dirty
+        when the block exits normally. If the block raises, the possibly half
+        updated entry is dropped so the next access reloads the last
+        checkpoint. Yields None when there is no model for the location.
+        Args:
+            id (int): Location id.
+        """
+        entry = self._get_entry(id)
+        if entry is None:
+            yield None
+            return
+        try:
+            with entry.lock:
+                try:
+                    yield entry.model_data
+                except BaseException:
+                    self._discard(id, entry)
+                    raise
+                entry.dirty = True
+        finally:
+            with self._lock:
+                entry.pins -= 1
+        self._evict()
+
+    def flush(self, ids=None):
+        """
+        Upload dirty models.
+        Args:
+            ids (Iterable[int], optional): Only flush these locations.
+        Raises:
+            RuntimeError: If some of the uploads failed. Those models stay
+                dirty and are retried by the next flush.
+        """
+        with self._lock:
+            if ids is None:
+                candidates = list(self._entries.items())
+            else:
+                candidates = [
+                    (id, self._entries[id]) for id in ids if id in self._entries
+                ]
+        failed = [id for id, entry in candidates if not self._write(id, entry)]
+        if failed:
+            raise RuntimeError(f"Failed to flush models for locations {failed}")
+
+    def _get_entry(self, id):
+        """Get the entry of a location, pinned so it is not evicted."""
+        with self._lock:
+            entry = self._entries.get(id)
+            if entry is None:
+                entry = self._evicting.get(id)
+                if entry is not None:
+                    self._insert(id, entry)
+            else:
+                self._entries.move_to_end(id)
+            if entry is not None:
+                self.hits += 1
+                entry.pins += 1
+                return entry
+            self.misses += 1
+
+        try:
+            data = self.adls_client.download_bytes(
+                self.container_name, self.blob_name(id)
+            )
+        except Exception as e:
+            logging.error(f"Error loading model for location {id}: {e}")
+            return None
+        entry = _Entry(self.loads(data), len(data))
+
+        with self._lock:
+            # Another thread may have loaded the same model in the meantime
+            if id in self._entries:
+                entry = self._entries[id]
+            else:
+                # A dirty entry being evicted is newer than the download
+                entry = self._evicting.get(id, entry)
+                self._insert(id, entry)
+            entry.pins += 1
+        return entry
+
+    def _insert(self, id, entry):
+        self._entries[id] = entry
+        self._size += entry.size
+
+    def _discard(self, id, entry):
+        with self._lock:
+            if self._entries.get(id) is entry:
+                del self._entries[id]
+                self._size -= entry.size
+
+    def _evict(self):
+        victims = []
+        with self._lock:
+            for id in list(self._entries):
+                if self._size <= self.max_bytes:
+                    break
+                entry = self._entries[id]
+                # Skip models that are checked out right now
+                if entry.pins:
+                    continue
+                del self._entries[id]
+                self._size -= entry.size
+                if entry.dirty:
+                    self._evicting[id] = entry
+                    victims.append((id, entry))
+
+        for id, entry in victims:
+            if not self._write(id, entry):
+                logging.error(f"Keeping model for location {id} after failed upload")
+            with self._lock:
+                if self._evicting.get(id) is entry:
+                    del self._evicting[id]
+                    if entry.dirty and id not in self._entries:
+                        self._insert(id, entry)
+
+    def _write(self, id, entry):
+        with entry.lock:
+            if not entry.dirty:
+                return True
+            data = self.dumps(entry.model_data)
+            entry.dirty = False
+        try:
+            self.adls_client.upload_bytes(self.container_name, self.blob_name(id), data)
+        except Exception as e:
+            logging.error(f"Error saving model for location {id}: {e}")
+            entry.dirty = True
+            return False
+        with self._lock:
+            if self._entries.get(id) is entry:
+                self._size += len(data) - entry.size
+            entry.size = len(data)
+        return True
+
+    def _flush_periodically(self):
+        while not self._stop.wait(self.flush_interval):
+            try:
+                self.flush()
+            except RuntimeError as e:
+                logging.error(e)
@@ -0,0 +1,151 @@
+import logging
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from azure.core.exceptions import (
+    HttpResponseError,
+    ServiceRequestError,
+    ServiceResponseError,
+)
+
+from weather_predictions import state_codec
+from weather_predictions.model_cache import model_blob_name
+
+TRANSIENT_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+
+
+def is_transient(error):
+    """Tell whether an upload error is worth retrying."""
+    if isinstance(error, (ServiceRequestError, ServiceResponseError)):
+        return True
+    if isinstance(error, HttpResponseError):
+        return error.status_code in TRANSIENT_STATUS_CODES
+    return isinstance(error, (ConnectionError, TimeoutError))
+
+
+class ModelPublisher:
+    """
+    Uploads model blobs to ADLS with bounded concurrency.
+    Uploads run on `max_concurrency` threads. Submitting blocks once
+    `2 * max_concurrency` uploads are pending, so the producer cannot buffer
+    payloads without limit. Transient errors are retried with jittered
+    exponential backoff; other errors, and transient ones that outlast the
+    retries, are recorded per blob in `failed`. Model data submitted for
+    several ids is only serialized once.
+    Args:
+        adls_client (ADLSClient): Client used to store the models.
+        container_name (str): Container of the `model_{id}.pkl` blobs.
+        max_concurrency (int): Number of concurrent uploads.
+        retries (int): Retries of a transient failure.
+        backoff (float): Seconds before the first retry, doubled every retry.
+        max_backoff (float): Upper bound of the delay between retries.
+        dumps (callable): Serializer of the model data.
+    """
+
+    def __init__(
+        self,
+        adls_client,
+        container_name="models",
+        max_concurrency=16,
+        retries=4,
+        backoff=0.5,
+        max_backoff=10.0,
+        dumps=state_codec.dumps,
+    ):
+        self.adls_client = adls_client
+        self.container_name = container_name
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.dumps = dumps
+        self.uploaded = 0
+        self.uploaded_bytes = 0
+        self.retried = 0
+        self.failed = {}
+        self._pool = ThreadPoolExecutor(
+            max_workers=max_concurrency, thread_name_prefix="model-publisher"
+        )
+        self._slots = threading.BoundedSemaphore(2 * max_concurrency)
+        self._lock = threading.Lock()
+        # Last serialized model data, kept alive so its id() stays unique
+        self._serialized = (None, None)
+
+    def blob_name(self, id):
+        return model_blob_name(id)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def submit(self, id, model_data):
+        """
+        Serialize and upload the model data of a location.
+        Returns:
+            Future: Resolves to True once uploaded, False if the upload failed.
+        """
+        model, payload = self._serialized
+        if model is not model_data:
+            payload = self.dumps(model_data)
+            self._serialized = (model_data, payload)
+        return self.submit_bytes(id, payload)
+
+    def submit_bytes(self, id, payload):
+        """
+        Upload an already serialized model.
+        Returns:
+            Future: Resolves to True once uploaded, False if the upload failed.
+        """
+        self._slots.acquire()
+        try:
+            future = self._pool.submit(self._upload, id, payload)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    def close(self):
+        """
+        Wait for the pending uploads.
+        Returns:
+            dict: Upload statistics, see `stats`.
+        """
+        self._pool.shutdown(wait=True)
+        self._serialized = (None, None)
+        return self.stats()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "uploaded": self.uploaded,
+                "uploaded_bytes": self.uploaded_bytes,
+                "retried": self.retried,
+                "failed": dict(self.failed),
+            }
+
+    def _upload(self, id, payload):
+        for attempt in range(self.retries + 1):
+            try:
+                self.adls_client.upload_bytes(
+                    self.container_name, self.blob_name(id), payload
+                )
+            except Exception as e:
+                if attempt == self.retries or not is_transient(e):
+                    logging.error(f"Failed to upload model {id}: {e!r}")
+                    with self._lock:
+                        self.failed[id] = e
+                    return False
+                with self._lock:
+                    self.retried += 1
+                delay = min(self.max_backoff, self.backoff * 2**attempt)
+                time.sleep(delay * random.uniform(0.5, 1.0))
+                continue
+            with self._lock:
+                self.uploaded += 1
+                self.uploaded_bytes += len(payload)
+                self.failed.pop(id, None)
+            return True
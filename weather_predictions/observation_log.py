@@ -0,0 +1,212 @@
+import logging
+import math
+import threading
+import time
+
+import numpy as np
+
+from weather_predictions.wire import FIELDS, OBSERVATION_DTYPE
+
+# Start of timeslot 0, timeslots are the 15-minute steps the models learn
+POF = 1737288000
+SLOT_SECONDS = 15 * 60
+PRUNE_INTERVAL = 3600
+
+CREATE_OBSERVATIONS_TABLE_QUERY = """
+    CREATE TABLE IF NOT EXISTS observations (
+        location_id INT NOT NULL,
+        timeslot_id INT NOT NULL,
+        timestamp BIGINT NOT NULL,
+        cloud_coverage INT NOT NULL,
+        temperature FLOAT NOT NULL,
+        pressure INT NOT NULL,
+        humidity INT NOT NULL,
+        wind_speed FLOAT NOT NULL,
+        wind_direction INT NOT NULL,
+        precipitation FLOAT NOT NULL,
+        PRIMARY KEY (location_id, timeslot_id),
+        KEY (timestamp)
+    )
+"""
+_COLUMNS = ["location_id", "timeslot_id"] + list(FIELDS[1:])
+# The first observation of a timeslot wins, replays of a message are no-ops
+INSERT_OBSERVATIONS_QUERY = "INSERT IGNORE INTO observations ({}) VALUES ({})".format(
+    ", ".join(_COLUMNS), ", ".join(["%s"] * len(_COLUMNS))
+)
+OBSERVATIONS_QUERY = """
+    SELECT location_id AS id, {} FROM observations
+    WHERE location_id = %s AND timeslot_id > %s AND timeslot_id < %s
+    ORDER BY timeslot_id
+""".format(", ".join(FIELDS[1:]))
+PRUNE_OBSERVATIONS_QUERY = "DELETE FROM observations WHERE timestamp < %s"
+
+
+def timeslot_id(timestamp):
+    return math.floor((timestamp - POF) / SLOT_SECONDS)
+
+
+def timeslot_ids(timestamps):
+    return (np.asarray(timestamps, dtype=np.int64) - POF) // SLOT_SECONDS
+
+
+def missing_slots(slots, after, before):
+    """
+    Find the timeslots in (after, before) that have no observation.
+    Presence is tracked in a bitmap over the range, one bit per slot.
+    Args:
+        slots (np.ndarray): Timeslot ids of the available observations.
+        after (int): Last slot before the range.
+        before (int): First slot after the range.
+    Returns:
+        np.ndarray: The missing slot ids, in order.
+    """
+    size = max(before - after - 1, 0)
+    slots = np.asarray(slots, dtype=np.int64)
+    slots = slots[(slots > after) & (slots < before)] - after - 1
+    bitmap = np.zeros((size + 7) // 8, dtype=np.uint8)
+    np.bitwise_or.at(bitmap, slots >> 3, (1 << (7 - (slots & 7))).astype(np.uint8))
+    present = np.unpackbits(bitmap, count=size).astype(bool)
+    return np.flatnonzero(~present) + after + 1
+
+
+class ObservationLog:
+    """
+    Durable log of raw observations keyed by location and timeslot.
+    The consumer records every decoded observation, so the timeslots a model
+    missed, e.g. when offsets were committed past the last model checkpoint
+    before a crash, can be read back and replayed. Observations are buffered
+    and written with one `executemany`, when `max_rows` are pending, every
+    `flush_interval` seconds once started, and on `close`. Rows older than
+    `retention` seconds are pruned from time to time.
+    Args:
+        mysql_client (MySQLClient): Client of the weather database.
+        max_rows (int): Number of pending observations that triggers a flush.
+        flush_interval (float): Seconds between background flushes.
+        retention (float): Seconds to keep observations for.
+    """
+
+    def __init__(
+        self, mysql_client, max_rows=1000, flush_interval=5.0, retention=14 * 86400
+    ):
+        self.mysql_client = mysql_client
+        self.max_rows = max_rows
+        self.flush_interval = flush_interval
+        self.retention = retention
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._flusher = None
+        self._table_ready = False
+        self._pruned_at = None
+
+    def __len__(self):
+        return len(self._pending)
+
+    def add(self, batch):
+        """
+        Record observations.
+        Args:
+            batch (np.ndarray): Observations with dtype `OBSERVATION_DTYPE`.
+        """
+        slots = timeslot_ids(batch["timestamp"]).tolist()
+        with self._lock:
+            for slot, fields in zip(slots, batch.tolist()):
+                self._pending.setdefault((fields[0], slot), fields)
+            full = len(self._pending) >= self.max_rows
+        if full:
+            try:
+                self.flush()
+            except Exception as e:
+                logging.error(f"Error writing observations to MySQL: {e}")
+
+    def fetch(self, id, after, before):
+        """
+        Get the observations of a location in the timeslots (after, before),
+        including those not written yet.
+        Returns:
+            np.ndarray: Observations with dtype `OBSERVATION_DTYPE`, one per
+                timeslot in timeslot order.
+        """
+        with self._lock:
+            pending = [
+                fields
+                for (location_id, slot), fields in self._pending.items()
+                if location_id == id and after < slot < before
+            ]
+        with self.mysql_client as db:
+            self._ensure_table(db)
+            rows = db.read(OBSERVATIONS_QUERY, (id, after, before))
+        stored = [tuple(row[name] for name in FIELDS) for row in rows]
+        observations = np.array(stored + pending, dtype=OBSERVATION_DTYPE)
+        _, first = np.unique(timeslot_ids(observations["timestamp"]), return_index=True)
+        return observations[first]
+
+    def flush(self):
+        """
+        Write every pending observation.
+        Raises:
+            RuntimeError: If the write failed. The rows are kept for the next flush.
+        """
+        with self._flush_lock:
+            with self._lock:
+                rows, self._pending = self._pending, {}
+            if not rows:
+                return
+            try:
+                with self.mysql_client as db:
+                    self._ensure_table(db)
+                    db.executemany(
+                        INSERT_OBSERVATIONS_QUERY,
+                        [
+                            (id, slot) + fields[1:]
+                            for (id, slot), fields in rows.items()
+                        ],
+                    )
+                    if (
+                        self._pruned_at is None
+                        or time.monotonic() - self._pruned_at > PRUNE_INTERVAL
+                    ):
+                        self.prune(db)
+            except Exception:
+                with self._lock:
+                    # Keep the first observation of every timeslot
+                    for key, fields in self._pending.items():
+                        rows.setdefault(key, fields)
+                    self._pending = rows
+                raise
+        logging.info(f"Logged {len(rows)} observations")
+
+    def prune(self, db):
+        """Delete the observations older than the retention."""
+        self._ensure_table(db)
+        db.execute(PRUNE_OBSERVATIONS_QUERY, (int(time.time() - self.retention),))
+        self._pruned_at = time.monotonic()
+
+    def start(self):
+        if self._flusher is not None:
+            return
+        self._stop.clear()
+        self._flusher = threading.Thread(
+            target=self._flush_periodically, name="observation-log", daemon=True
+        )
+        self._flusher.start()
+
+    def close(self):
+        self._stop.set()
+        if self._flusher is not None:
+            self._flusher.join()
+            self._flusher = None
+        self.flush()
+
+    def _ensure_table(self, db):
+        if not self._table_ready:
+            db.execute(CREATE_OBSERVATIONS_TABLE_QUERY)
+            self._table_ready = True
+
+    def _flush_periodically(self):
+        while not self._stop.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception as e:
+                logging.error(f"Error writing observations to MySQL: {e}")
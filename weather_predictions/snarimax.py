@@ -0,0 +1,545 @@
+"""
+NumPy implementation of river's SNARIMAX with a StandardScaler | LinearRegression
+regressor.
+
+The engine follows river's update rules step by step: lag features are only
+present once enough history exists, the scaler is updated before the
+regressor learns and the regressor takes one SGD step per observation. What
+can be known before fitting is computed for the whole series at once: the
+differenced target, the autoregressive lags and the running scaler statistics
+of the exogenous and autoregressive features. Only the moving-average
+features and the SGD updates, which depend on the model's own errors, are
+computed in a sequential loop over small arrays.
+"""
+
+import collections
+
+import numpy as np
+from river.time_series.snarimax import Differencer
+from scipy.signal import lfilter
+
+
+class NumpySNARIMAX:
+    """
+    SNARIMAX forecaster with river compatible `learn_one` and `forecast`.
+    Args:
+        p, d, q, m, sp, sd, sq (int): Orders as in `river.time_series.SNARIMAX`.
+        l2 (float): L2 regularization of the linear regression.
+        lr (float): Learning rate of the weights.
+        intercept_lr (float): Learning rate of the intercept.
+        intercept_init (float): Initial intercept.
+        clip_gradient (float): Bound of the absolute loss gradient.
+        with_std (bool): Whether the scaler divides by the standard deviation.
+    """
+
+    def __init__(
+        self,
+        p,
+        d,
+        q,
+        m=1,
+        sp=0,
+        sd=0,
+        sq=0,
+        l2=0.0,
+        lr=0.01,
+        intercept_lr=0.01,
+        intercept_init=0.0,
+        clip_gradient=1e12,
+        with_std=True,
+    ):
+        self.p = p
+        self.d = d
+        self.q = q
+        self.m = m
+        self.sp = sp
+        self.sd = sd
+        self.sq = sq
+        self.l2 = l2
+        self.lr = lr
+        self.intercept_lr = intercept_lr
+        self.intercept_init = intercept_init
+        self.clip_gradient = clip_gradient
+        self.with_std = with_std
+
+        self.differencer = Differencer(d=d, m=1) * Differencer(d=sd, m=m)
+        self.y_hist = collections.deque(maxlen=d + m * sd)
+        self.y_diff = collections.deque(maxlen=max(p, m * sp))
+        self.errors = collections.deque(maxlen=max(q, m * sq))
+
+        # (name, t) pairs: the feature is Y[t] of the newest-first history
+        self.y_lags = [(f"y-{t + 1}", t) for t in range(p)] + [
+            (f"sy-{t + 1}", t) for t in range(m - 1, m * sp, m)
+        ]
+        self.error_lags = [(f"e-{t + 1}", t) for t in range(q)] + [
+            (f"se-{t + 1}", t) for t in range(m - 1, m * sq, m)
+        ]
+
+        self.exog = None
+        self.intercept = intercept_init
+        self.n_iterations = 0
+        self.counts = np.zeros(0)
+        self.means = np.zeros(0)
+        self.vars = np.zeros(0)
+        self.weights = np.zeros(0)
+
+    @property
+    def features(self):
+        lags = [name for name, _ in self.y_lags + self.error_lags]
+        return (self.exog or []) + lags
+
+    def set_exog(self, names):
+        """Fix the exogenous feature names, in the column order of `learn_many`."""
+        if self.exog is not None:
+            if list(names) != self.exog:
+                raise ValueError(
+                    f"Expected exogenous features {self.exog}, got {list(names)}"
+                )
+            return
+        self.exog = list(names)
+        n_features = len(self.features)
+        self.counts = np.zeros(n_features)
+        self.means = np.zeros(n_features)
+        self.vars = np.zeros(n_features)
+        self.weights = np.zeros(n_features)
+
+    # Streaming API, as used by main.py
+
+    def learn_one(self, y, x=None):
+        """
+        Learn one observation.
+        Args:
+            y (float): Target value.
+            x (dict | np.ndarray, optional): Exogenous features by name, or
+                their values in `exog` order.
+        """
+        x = {} if x is None else x
+        if self.exog is None:
+            self.set_exog(list(x))
+        if len(self.y_hist) < self.differencer.n_required_past_values:
+            self.y_hist.appendleft(y)
+            return
+
+        n_exog = len(self.exog)
+        values = np.zeros(len(self.weights))
+        if isinstance(x, np.ndarray):
+            values[:n_exog] = x
+        else:
+            try:
+                values[:n_exog] = [x[name] for name in self.exog]
+            except KeyError as e:
+                raise ValueError(f"Missing exogenous feature {e}")
+        present = [True] * n_exog
+        for column, (_, t) in enumerate(self.y_lags, start=n_exog):
+            if t < len(self.y_diff):
+                values[column] = self.y_diff[t]
+            present.append(t < len(self.y_diff))
+        for column, (_, t) in enumerate(
+            self.error_lags, start=n_exog + len(self.y_lags)
+        ):
+            if t < len(self.errors):
+                values[column] = self.errors[t]
+            present.append(t < len(self.errors))
+        present = np.array(present)
+        columns = np.flatnonzero(present)
+
+        y_diff = self.differencer.diff(y, self.y_hist)
+        y_pred = self._scale(values, self.means, self.vars, present) @ self.weights
+        y_pred += self.intercept
+        self.y_diff.appendleft(y_diff)
+        self.errors.appendleft(y_diff - y_pred)
+
+        # Welford updates of the scaler, as river does them
+        counts, means, vars_ = self.counts, self.means, self.vars
+        counts[columns] += 1
+        old_means = means[columns]
+        means[columns] += (values[columns] - old_means) / counts[columns]
+        if self.with_std:
+            vars_[columns] += (
+                (values[columns] - old_means) * (values[columns] - means[columns])
+                - vars_[columns]
+            ) / counts[columns]
+        x = self._scale(values, means, vars_, present)
+
+        loss_gradient = 2 * ((x @ self.weights + self.intercept) - y_diff)
+        loss_gradient = min(max(loss_gradient, -self.clip_gradient), self.clip_gradient)
+        self.intercept -= self.intercept_lr * loss_gradient
+        gradient = loss_gradient * x
+        if self.l2:
+            gradient[columns] += self.l2 * self.weights[columns]
+        self.weights -= self.lr * gradient
+        self.n_iterations += 1
+        self.y_hist.appendleft(y)
+
+    def forecast(self, horizon, xs=None, recursive=False):
+        """
+        Forecast the next `horizon` values.
+        Once the differencing history is complete, the forecasts are computed
+        directly: the recursion over the forecasts' own lags and the
+        undifferencing are linear filters with constant coefficients, combined
+        into one filter and solved with a single `lfilter` call over the whole
+        horizon. Terms that only depend on known values are computed for all
+        steps at once. Before that, or with `recursive=True`, the forecasts are
+        computed step by step as in river. Both agree up to floating point
+        rounding while the forecasts are finite; a diverging model may give NaN
+        where the recursion overflows to infinity.
+        Args:
+            horizon (int): Number of steps.
+            xs (list[dict] | np.ndarray, optional): Exogenous features of every step.
+            recursive (bool): Use the step by step recursion.
+        Returns:
+            list[float]: Forecasts.
+        """
+        if xs is None:
+            xs = [{}] * horizon
+        if len(xs) != horizon:
+            raise ValueError(
+                "the length of xs should be equal to the specified horizon"
+            )
+        if self.exog is None:
+            self.set_exog(list(xs[0]) if horizon and isinstance(xs[0], dict) else [])
+        X = self._exog_matrix(xs)
+        if (
+            recursive
+            or not horizon
+            or len(self.y_hist) < self.differencer.n_required_past_values
+        ):
+            return self._forecast_recursive(horizon, X)
+        return self._forecast_direct(horizon, X).tolist()
+
+    def _forecast_direct(self, horizon, X):
+        # Every feature term is written as gain * value + offset
+        n_exog = len(self.exog)
+        gains, offsets = self._gains()
+        exog_terms = X @ gains[:n_exog]
+        constant = self.intercept + offsets[:n_exog].sum()
+        gains, offsets = gains[n_exog:], offsets[n_exog:]
+        y_diff = np.fromiter(reversed(self.y_diff), float, len(self.y_diff))
+        errors = np.fromiter(reversed(self.errors), float, len(self.errors))
+        lags = [(y_diff, t) for _, t in self.y_lags]
+        lags += [(errors, t) for _, t in self.error_lags]
+
+        # Differenced forecasts: feedback * y_diff = base, where feedback[k]
+        # multiplies the forecast k steps back and base holds the exogenous
+        # terms and the lags of known values. The errors of future steps are
+        # zero, so the moving-average terms only have known values. Delays of
+        # the horizon or more never reach a forecast.
+        base = exog_terms
+        feedback = np.zeros(horizon)
+        feedback[0] = 1.0
+        n_feedback = 1
+        for (values, t), gain, offset in zip(lags, gains.tolist(), offsets.tolist()):
+            n = len(values)
+            # The lag exists once the series is longer than t
+            first = max(0, t + 1 - n)
+            if first:
+                base[first:] += offset
+            else:
+                constant += offset
+            last = min(horizon, t + 1)
+            if first < last:
+                base[first:last] += gain * values[n + first - 1 - t : n + last - 1 - t]
+            if values is y_diff and t + 1 < horizon:
+                feedback[t + 1] -= gain
+                n_feedback = max(n_feedback, t + 2)
+        base += constant
+
+        # Undifferencing: integrate * y = y_diff - known, where known holds
+        # the terms of the known history
+        y_hist = np.fromiter(reversed(self.y_hist), float, len(self.y_hist))
+        integrate = np.zeros(horizon)
+        integrate[0] = 1.0
+        n_integrate = 1
+        known = np.zeros(horizon)
+        for t, c in self.differencer.coeffs.items():
+            if not t:
+                continue
+            n = min(t, horizon)
+            known[:n] += c * y_hist[len(y_hist) - t : len(y_hist) - t + n]
+            if t < horizon:
+                integrate[t] += c
+                n_integrate = max(n_integrate, t + 1)
+
+        # Both filters at once: feedback * integrate * y = base - feedback * known
+        feedback = feedback[:n_feedback]
+        denominator = np.convolve(feedback, integrate[:n_integrate])[:horizon]
+        base -= np.convolve(known, feedback)[:horizon]
+        return lfilter([1.0], denominator, base)
+
+    def _forecast_recursive(self, horizon, X):
+        n_exog = len(self.exog)
+        exog_terms = (
+            self._scale(X, self.means[:n_exog], self.vars[:n_exog], True)
+            @ self.weights[:n_exog]
+        )
+        y_terms = self._lag_terms(self.y_lags, n_exog)
+        error_terms = self._lag_terms(self.error_lags, n_exog + len(self.y_lags))
+        coeffs = [(t, c) for t, c in self.differencer.coeffs.items() if t]
+        y_hist = list(reversed(self.y_hist))
+        y_diff = list(reversed(self.y_diff))
+        errors = list(reversed(self.errors))
+        forecasts = [None] * horizon
+        for step in range(horizon):
+            y_pred = exog_terms[step] + self.intercept
+            for t, weight, mean, scale in y_terms:
+                if t < len(y_diff):
+                    y_pred += weight * self._scale_one(y_diff[-1 - t], mean, scale)
+            for t, weight, mean, scale in error_terms:
+                if t < len(errors):
+                    y_pred += weight * self._scale_one(errors[-1 - t], mean, scale)
+            y_diff.append(y_pred)
+            forecast = y_pred
+            for t, c in coeffs:
+                if t > len(y_hist):
+                    break
+                forecast -= c * y_hist[-t]
+            forecasts[step] = forecast
+            y_hist.append(forecast)
+            errors.append(0)
+        return forecasts
+
+    # Batch API
+
+    def learn_many(self, y, X=None):
+        """
+        Learn a series of observations in order.
+        Args:
+            y (array-like): Target values.
+            X (pd.DataFrame | np.ndarray, optional): Exogenous features, one row
+                per target value. DataFrame columns fix the feature names.
+        Returns:
+            np.ndarray: For every observation, the one-step forecast the model
+                made right before learning it. NaN while the model is warming up.
+        """
+        y = np.asarray(y, dtype=float)
+        if X is None:
+            X = np.zeros((len(y), 0))
+        if hasattr(X, "columns"):
+            self.set_exog([str(column) for column in X.columns])
+        elif self.exog is None:
+            self.set_exog([str(i) for i in range(np.shape(X)[1])])
+        X = np.asarray(X, dtype=float).reshape(len(y), len(self.exog))
+
+        forecasts = np.full(len(y), np.nan)
+        y_hist = np.array(list(reversed(self.y_hist)), dtype=float)
+        first = max(0, self.differencer.n_required_past_values - len(y_hist))
+        if first >= len(y):
+            self.y_hist.extendleft(y.tolist())
+            return forecasts
+
+        # Differenced targets, in the same summation order as river
+        series = np.concatenate([y_hist, y])
+        positions = len(y_hist) + np.arange(first, len(y))
+        y_diff = series[positions].copy()
+        history = np.zeros(len(positions))
+        for t, c in self.differencer.coeffs.items():
+            if t:
+                y_diff += c * series[positions - t]
+                history -= c * series[positions - t]
+
+        n = len(y_diff)
+        n_exog = len(self.exog)
+        n_known = n_exog + len(self.y_lags)
+
+        # Exogenous and autoregressive features, known before fitting
+        past_diff = np.array(list(reversed(self.y_diff)), dtype=float)
+        diff_series = np.concatenate([past_diff, y_diff])
+        available = len(past_diff) + np.arange(n)
+        known = np.zeros((n, n_known))
+        present = np.zeros((n, n_known), dtype=bool)
+        known[:, :n_exog] = X[first:]
+        present[:, :n_exog] = True
+        for column, (_, t) in enumerate(self.y_lags, start=n_exog):
+            has_lag = t < available
+            present[:, column] = has_lag
+            known[has_lag, column] = diff_series[available[has_lag] - 1 - t]
+        z_pre, z_post, stats = self._scale_known(known, present)
+
+        # Moving-average features and SGD, sequentially
+        n_features = len(self.weights)
+        weights = self.weights.copy()
+        intercept = self.intercept
+        error_columns = range(n_known, n_features)
+        counts = self.counts[n_known:].tolist()
+        means = self.means[n_known:].tolist()
+        vars_ = self.vars[n_known:].tolist()
+        errors = list(reversed(self.errors))
+        x_pre = np.zeros(n_features)
+        x_post = np.zeros(n_features)
+        mask = np.zeros(n_features)
+        predictions = np.empty(n)
+        for step in range(n):
+            x_pre[:n_known] = z_pre[step]
+            x_post[:n_known] = z_post[step]
+            mask[:n_known] = present[step]
+            for slot, (column, (_, t)) in enumerate(
+                zip(error_columns, self.error_lags)
+            ):
+                if t >= len(errors):
+                    x_pre[column] = x_post[column] = mask[column] = 0.0
+                    continue
+                value = errors[-1 - t]
+                x_pre[column] = self._scale_one(value, means[slot], vars_[slot])
+                counts[slot] += 1
+                old_mean = means[slot]
+                means[slot] += (value - old_mean) / counts[slot]
+                if self.with_std:
+                    vars_[slot] += (
+                        (value - old_mean) * (value - means[slot]) - vars_[slot]
+                    ) / counts[slot]
+                x_post[column] = self._scale_one(value, means[slot], vars_[slot])
+                mask[column] = 1.0
+
+            y_pred = x_pre @ weights + intercept
+            predictions[step] = y_pred
+            errors.append(y_diff[step] - y_pred)
+
+            loss_gradient = 2 * ((x_post @ weights + intercept) - y_diff[step])
+            loss_gradient = min(
+                max(loss_gradient, -self.clip_gradient), self.clip_gradient
+            )
+            intercept -= self.intercept_lr * loss_gradient
+            gradient = loss_gradient * x_post
+            if self.l2:
+                gradient += self.l2 * (weights * mask)
+            weights -= self.lr * gradient
+
+        self.weights = weights
+        self.intercept = float(intercept)
+        self.n_iterations += n
+        self.counts[:n_known], self.means[:n_known], self.vars[:n_known] = stats
+        self.counts[n_known:] = counts
+        self.means[n_known:] = means
+        self.vars[n_known:] = vars_
+        self.y_hist.extendleft(y.tolist())
+        self.y_diff.extendleft(y_diff.tolist())
+        self.errors.extendleft(errors[len(errors) - n :])
+
+        forecasts[first:] = predictions + history
+        return forecasts
+
+    # Conversion
+
+    @classmethod
+    def from_river(cls, model):
+        """
+        Build an engine from a river SNARIMAX with a StandardScaler | LinearRegression
+        regressor, carrying over its learned state.
+        """
+        scaler, regressor = list(model.regressor.steps.values())
+        engine = cls(
+            p=model.p,
+            d=model.d,
+            q=model.q,
+            m=model.m,
+            sp=model.sp,
+            sd=model.sd,
+            sq=model.sq,
+            l2=regressor.l2,
+            lr=regressor.optimizer.lr.learning_rate,
+            intercept_lr=regressor.intercept_lr.learning_rate,
+            intercept_init=regressor.intercept_init,
+            clip_gradient=regressor.clip_gradient,
+            with_std=scaler.with_std,
+        )
+        lags = {name for name, _ in engine.y_lags + engine.error_lags}
+        names = list(scaler.counts) + [
+            name for name in regressor._weights.to_dict() if name not in scaler.counts
+        ]
+        engine.set_exog([name for name in names if name not in lags])
+        weights = regressor._weights.to_dict()
+        for i, name in enumerate(engine.features):
+            engine.counts[i] = scaler.counts.get(name, 0)
+            engine.means[i] = scaler.means.get(name, 0.0)
+            engine.vars[i] = scaler.vars.get(name, 0.0)
+            engine.weights[i] = weights.get(name, 0.0)
+        engine.intercept = regressor.intercept
+        engine.n_iterations = regressor.optimizer.n_iterations
+        engine.y_hist.extend(model.y_hist)
+        engine.y_diff.extend(model.y_diff)
+        engine.errors.extend(model.errors)
+        return engine
+
+    # Helpers
+
+    def _exog_matrix(self, xs):
+        if isinstance(xs, np.ndarray):
+            return xs.astype(float).reshape(len(xs), len(self.exog))
+        try:
+            return np.array(
+                [[x[name] for name in self.exog] for x in xs], dtype=float
+            ).reshape(len(xs), len(self.exog))
+        except KeyError as e:
+            raise ValueError(f"Missing exogenous feature {e}")
+
+    def _scale(self, X, means, vars_, present):
+        if not self.with_std:
+            return np.where(present, X - means, 0.0)
+        centered = X - means
+        return np.divide(
+            centered,
+            np.sqrt(vars_),
+            out=np.zeros(centered.shape),
+            where=present & (vars_ != 0),
+        )
+
+    def _scale_one(self, value, mean, var):
+        if not self.with_std:
+            return value - mean
+        return (value - mean) / var**0.5 if var else 0.0
+
+    def _gains(self):
+        """
+        Write the terms `weight * scaled value` of the features as
+        `gain * value + offset`.
+        """
+        if not self.with_std:
+            return self.weights, -self.weights * self.means
+        gains = np.divide(
+            self.weights,
+            np.sqrt(self.vars),
+            out=np.zeros(len(self.weights)),
+            where=self.vars != 0,
+        )
+        return gains, -gains * self.means
+
+    def _lag_terms(self, lags, offset):
+        return [
+            (t, self.weights[offset + i], self.means[offset + i], self.vars[offset + i])
+            for i, (_, t) in enumerate(lags)
+        ]
+
+    def _scale_known(self, known, present):
+        """
+        Scale the known features with the running statistics before and after
+        every observation, merging the new observations into the current ones.
+        """
+        n_known = known.shape[1]
+        count0 = self.counts[:n_known]
+        mean0 = self.means[:n_known]
+        var0 = self.vars[:n_known]
+        # Sums are taken around the current mean, or the first value of a new
+        # feature, so that constant features keep a variance of exactly zero
+        first = np.where(
+            present.any(axis=0), known[present.argmax(axis=0), range(n_known)], 0.0
+        )
+        center = np.where(count0 > 0, mean0, first)
+        centered = np.where(present, known - center, 0.0)
+        counts = count0 + np.cumsum(present, axis=0)
+        sum1 = np.cumsum(centered, axis=0)
+        sum2 = np.cumsum(centered * centered, axis=0)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            shift = np.where(counts > 0, sum1 / counts, 0.0)
+            vars_ = np.where(
+                counts > 0, (count0 * var0 + sum2 - sum1 * shift) / counts, 0.0
+            )
+        means = np.where(counts > 0, center + shift, mean0)
+        vars_ = np.maximum(vars_, 0.0)
+        if not self.with_std:
+            vars_[:] = 0.0
+
+        means_pre = np.vstack([mean0, means[:-1]])
+        vars_pre = np.vstack([var0, vars_[:-1]])
+        z_pre = self._scale(known, means_pre, vars_pre, present)
+        z_post = self._scale(known, means, vars_, present)
+        return z_pre, z_post, (counts[-1], means[-1], vars_[-1])
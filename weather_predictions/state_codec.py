@@ -0,0 +1,309 @@
+"""
+Compact binary format for per-location model state.
+
+A blob starts with a fixed header (magic, schema version, model kind) and is
+followed by the model hyperparameters, a table of feature names and flat
+little-endian float64 arrays holding the differencing buffers, the scaler
+statistics, the regressor weights and the feature history, which decodes to
+a `FeatureHistory`. Only numbers are stored, so blobs stay readable across
+river and pickle upgrades and decode without rebuilding deep object graphs.
+
+Both river's SNARIMAX (kind 1) and NumpySNARIMAX (kind 2) share this layout.
+Blobs that do not start with the magic are treated as legacy pickles.
+"""
+
+import pickle
+import struct
+
+import numpy as np
+from river import compose, linear_model, optim, preprocessing, time_series, utils
+
+from weather_predictions.feature_history import FeatureHistory
+from weather_predictions.snarimax import NumpySNARIMAX
+
+MAGIC = b"WXMS"
+SCHEMA_VERSION = 1
+
+KIND_RIVER_SNARIMAX = 1
+KIND_NUMPY_SNARIMAX = 2
+
+_HEADER = struct.Struct("<4sHBB")
+_SNARIMAX = struct.Struct("<7iq6dq6I")
+_NO_TIMESTAMP = np.iinfo(np.int64).min
+# Flags of the header
+_WITH_STD = 1
+_EXOG_UNSET = 2
+
+
+class UnsupportedModelError(ValueError):
+    pass
+
+
+def dumps(model_data):
+    """
+    Serialize model data, falling back to pickle for models the codec cannot represent.
+    Args:
+        model_data (dict): Dictionary with `model`, `timestamp` and `x_hist`.
+    Returns:
+        bytes: Serialized model data.
+    Raises:
+        ValueError: If the timestamp is not None or a whole number of seconds.
+    """
+    try:
+        return encode(model_data)
+    except UnsupportedModelError:
+        return pickle.dumps(model_data)
+
+
+def loads(data):
+    """
+    Deserialize model data written by `dumps` or by a plain `pickle.dumps`.
+    Args:
+        data (bytes): Serialized model data.
+    Returns:
+        dict: Dictionary with `model`, `timestamp` and `x_hist`.
+    """
+    if data[:4] == MAGIC:
+        return decode(data)
+    return pickle.loads(data)
+
+
+def encode(model_data):
+    model = model_data["model"]
+    if isinstance(model, NumpySNARIMAX):
+        kind, state = KIND_NUMPY_SNARIMAX, _engine_state(model)
+    elif isinstance(model, time_series.SNARIMAX):
+        kind, state = KIND_RIVER_SNARIMAX, _river_state(model)
+    else:
+        raise UnsupportedModelError(f"Unsupported model type {type(model).__name__}")
+    features = state["features"]
+    flags = _WITH_STD if state["with_std"] else 0
+    if state.get("exog_unset"):
+        flags |= _EXOG_UNSET
+
+    x_hist = model_data["x_hist"]
+    if isinstance(x_hist, FeatureHistory):
+        columns = x_hist.columns
+        history = np.asarray(x_hist.values(), dtype="<f8")
+    else:
+        columns = list(x_hist[0]) if len(x_hist) else []
+        history = np.array(
+            [[float(x[column]) for column in columns] for x in x_hist], dtype="<f8"
+        ).reshape(len(x_hist), len(columns))
+
+    timestamp = _timestamp(model_data.get("timestamp"))
+
+    names = "\n".join(features + columns).encode("utf-8")
+    parts = [
+        _HEADER.pack(MAGIC, SCHEMA_VERSION, kind, flags),
+        _SNARIMAX.pack(
+            model.p,
+            model.d,
+            model.q,
+            model.m,
+            model.sp,
+            model.sd,
+            model.sq,
+            timestamp,
+            state["intercept"],
+            state["intercept_init"],
+            state["l2"],
+            state["lr"],
+            state["intercept_lr"],
+            state["clip_gradient"],
+            state["n_iterations"],
+            len(model.y_hist),
+            len(model.y_diff),
+            len(model.errors),
+            len(features),
+            len(columns),
+            len(x_hist),
+        ),
+        struct.pack("<I", len(names)),
+        names,
+    ]
+    arrays = [
+        list(model.y_hist),
+        list(model.y_diff),
+        list(model.errors),
+        state["counts"],
+        state["means"],
+        state["vars"],
+        state["weights"],
+    ]
+    parts += [np.asarray(array, dtype="<f8").tobytes() for array in arrays]
+    parts.append(history.tobytes())
+    return b"".join(parts)
+
+
+def decode(data):
+    magic, version, kind, flags = _HEADER.unpack_from(data, 0)
+    if magic != MAGIC:
+        raise ValueError("Not a model state blob")
+    if version != SCHEMA_VERSION:
+        raise ValueError(f"Unsupported model state schema version {version}")
+    if kind not in (KIND_RIVER_SNARIMAX, KIND_NUMPY_SNARIMAX):
+        raise ValueError(f"Unsupported model kind {kind}")
+
+    offset = _HEADER.size
+    (
+        p, d, q, m, sp, sd, sq,
+        timestamp,
+        intercept, intercept_init, l2, lr, intercept_lr, clip_gradient,
+        n_iterations,
+        n_y_hist, n_y_diff, n_errors, n_features, n_columns, n_rows,
+    ) = _SNARIMAX.unpack_from(data, offset)
+    offset += _SNARIMAX.size
+
+    (names_size,) = struct.unpack_from("<I", data, offset)
+    offset += 4
+    names = data[offset : offset + names_size].decode("utf-8")
+    names = names.split("\n") if names else []
+    offset += names_size
+    features, columns = names[:n_features], names[n_features:]
+
+    def read(*shape):
+        nonlocal offset
+        count = int(np.prod(shape))
+        array = np.frombuffer(data, dtype="<f8", count=count, offset=offset)
+        offset += 8 * count
+        return array.reshape(shape)
+
+    y_hist, y_diff, errors = (read(n).tolist() for n in (n_y_hist, n_y_diff, n_errors))
+    counts, means, vars_, weights = (read(n_features).tolist() for _ in range(4))
+    history = read(n_rows, n_columns)
+
+    if kind == KIND_NUMPY_SNARIMAX:
+        model = NumpySNARIMAX(
+            p=p, d=d, q=q, m=m, sp=sp, sd=sd, sq=sq,
+            l2=l2,
+            lr=lr,
+            intercept_lr=intercept_lr,
+            intercept_init=intercept_init,
+            clip_gradient=clip_gradient,
+            with_std=bool(flags & _WITH_STD),
+        )
+        # An engine that never learned has no features until its first sample
+        if not flags & _EXOG_UNSET:
+            lags = {name for name, _ in model.y_lags + model.error_lags}
+            model.set_exog([name for name in features if name not in lags])
+            positions = [model.features.index(name) for name in features]
+            model.counts[positions] = counts
+            model.means[positions] = means
+            model.vars[positions] = vars_
+            model.weights[positions] = weights
+        model.intercept = intercept
+        model.n_iterations = n_iterations
+    else:
+        scaler = preprocessing.StandardScaler(with_std=bool(flags & _WITH_STD))
+        regressor = linear_model.LinearRegression(
+            optimizer=optim.SGD(lr),
+            l2=l2,
+            intercept_init=intercept_init,
+            intercept_lr=intercept_lr,
+            clip_gradient=clip_gradient,
+        )
+        model = time_series.SNARIMAX(
+            p=p, d=d, q=q, m=m, sp=sp, sd=sd, sq=sq,
+            regressor=compose.Pipeline(scaler, regressor),
+        )
+        for name, count, mean, var in zip(features, counts, means, vars_):
+            if count:
+                scaler.counts[name] = int(count)
+                scaler.means[name] = mean
+                scaler.vars[name] = var
+        regressor._weights = utils.VectorDict(
+            {name: weight for name, weight in zip(features, weights) if weight}
+        )
+        regressor.intercept = intercept
+        regressor.optimizer.n_iterations = n_iterations
+    model.y_hist.extend(y_hist)
+    model.y_diff.extend(y_diff)
+    model.errors.extend(errors)
+
+    x_hist = FeatureHistory.from_array(columns, history)
+    return {
+        "model": model,
+        "timestamp": None if timestamp == _NO_TIMESTAMP else timestamp,
+        "x_hist": x_hist,
+    }
+
+
+def _timestamp(timestamp):
+    """
+    Convert the timestamp of model data to an int, `_NO_TIMESTAMP` for None.
+    Raises:
+        ValueError: If the timestamp is not a whole number of seconds.
+    """
+    if timestamp is None:
+        return _NO_TIMESTAMP
+    if isinstance(timestamp, np.ndarray) and timestamp.size == 1:
+        timestamp = timestamp.item()
+    if isinstance(timestamp, (int, np.integer)) and not isinstance(timestamp, bool):
+        return int(timestamp)
+    if isinstance(timestamp, (float, np.floating)) and float(timestamp).is_integer():
+        return int(timestamp)
+    raise ValueError(f"Invalid model timestamp {timestamp!r}")
+
+
+def _river_state(model):
+    scaler, regressor = _unpack_regressor(model.regressor)
+    features = list(scaler.counts)
+    features += [name for name in regressor._weights.to_dict() if name not in scaler.counts]
+    weights = regressor._weights.to_dict()
+    return {
+        "with_std": scaler.with_std,
+        "intercept": regressor.intercept,
+        "intercept_init": regressor.intercept_init,
+        "l2": regressor.l2,
+        "lr": regressor.optimizer.lr.learning_rate,
+        "intercept_lr": regressor.intercept_lr.learning_rate,
+        "clip_gradient": regressor.clip_gradient,
+        "n_iterations": regressor.optimizer.n_iterations,
+        "features": features,
+        "counts": [scaler.counts[name] for name in features],
+        "means": [scaler.means[name] for name in features],
+        "vars": [scaler.vars[name] for name in features],
+        "weights": [weights.get(name, 0.0) for name in features],
+    }
+
+
+def _engine_state(model):
+    exog_unset = model.exog is None
+    return {
+        "with_std": model.with_std,
+        "intercept": model.intercept,
+        "intercept_init": model.intercept_init,
+        "l2": model.l2,
+        "lr": model.lr,
+        "intercept_lr": model.intercept_lr,
+        "clip_gradient": model.clip_gradient,
+        "n_iterations": model.n_iterations,
+        "exog_unset": exog_unset,
+        # The arrays are sized by set_exog, which has not run without exog
+        "features": [] if exog_unset else model.features,
+        "counts": model.counts,
+        "means": model.means,
+        "vars": model.vars,
+        "weights": model.weights,
+    }
+
+
+def _unpack_regressor(pipeline):
+    steps = list(getattr(pipeline, "steps", {}).values())
+    if len(steps) != 2:
+        raise UnsupportedModelError("Expected a StandardScaler | LinearRegression pipeline")
+    scaler, regressor = steps
+    if not (
+        type(scaler) is preprocessing.StandardScaler
+        and getattr(scaler, "window_size", None) is None
+        and type(regressor) is linear_model.LinearRegression
+        and type(regressor.initializer) is optim.initializers.Zeros
+        and type(regressor.optimizer) is optim.SGD
+        and type(regressor.optimizer.lr) is optim.schedulers.Constant
+        and type(regressor.intercept_lr) is optim.schedulers.Constant
+        and type(regressor.loss) is optim.losses.Squared
+        and regressor.l1 == 0
+    ):
+        raise UnsupportedModelError("Expected a StandardScaler | LinearRegression pipeline")
+    return scaler, regressor
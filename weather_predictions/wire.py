@@ -0,0 +1,183 @@
+"""
+Wire formats of the weather observation messages.
+
+Messages are either the legacy JSON objects with numbers encoded as strings,
+or schemaless Avro records of `MESSAGE_SCHEMA`. The two are told apart by the
+first byte: a JSON object starts with "{", which as the first byte of an Avro
+record would encode a negative location id.
+"""
+
+import io
+import json
+import logging
+
+import fastavro
+import numpy as np
+
+MESSAGE_SCHEMA = fastavro.parse_schema(
+    {
+        "type": "record",
+        "name": "WeatherObservation",
+        "fields": [
+            {"name": "id", "type": "int"},
+            {"name": "timestamp", "type": "long"},
+            {"name": "cloud_coverage", "type": "int"},
+            {"name": "temperature", "type": "float"},
+            {"name": "pressure", "type": "int"},
+            {"name": "humidity", "type": "int"},
+            {"name": "wind_speed", "type": "float"},
+            {"name": "wind_direction", "type": "int"},
+            {"name": "precipitation", "type": "float"},
+        ],
+    }
+)
+
+OBSERVATION_DTYPE = np.dtype(
+    [
+        ("id", np.int64),
+        ("timestamp", np.int64),
+        ("cloud_coverage", np.int64),
+        ("temperature", np.float64),
+        ("pressure", np.int64),
+        ("humidity", np.int64),
+        ("wind_speed", np.float64),
+        ("wind_direction", np.int64),
+        ("precipitation", np.float64),
+    ]
+)
+FIELDS = OBSERVATION_DTYPE.names
+_CASTS = [int if OBSERVATION_DTYPE[name].kind == "i" else float for name in FIELDS]
+_FLOAT_FIELDS = {
+    field["name"] for field in MESSAGE_SCHEMA["fields"] if field["type"] == "float"
+}
+# Longest Avro record: 10 byte varints and 4 byte floats
+_MAX_RECORD_SIZE = sum(4 if name in _FLOAT_FIELDS else 10 for name in FIELDS)
+_MIN_VECTORIZED_BATCH = 64
+
+
+def encode(observation):
+    """
+    Encode an observation as a schemaless Avro record.
+    Args:
+        observation (dict): Observation with the `MESSAGE_SCHEMA` fields.
+    Returns:
+        bytes: Encoded record.
+    """
+    buffer = io.BytesIO()
+    fastavro.schemaless_writer(buffer, MESSAGE_SCHEMA, observation)
+    return buffer.getvalue()
+
+
+def decode(payload):
+    """
+    Decode a JSON or Avro message.
+    Args:
+        payload (bytes | str): Message value.
+    Returns:
+        tuple: Typed field values in `FIELDS` order.
+    Raises:
+        ValueError: If the message is malformed.
+    """
+    if isinstance(payload, str) or payload[:1] == b"{":
+        try:
+            message = json.loads(payload)
+            return tuple(cast(message[name]) for cast, name in zip(_CASTS, FIELDS))
+        except KeyError as e:
+            raise ValueError(f"Missing key in message: {e}")
+        except (TypeError, json.JSONDecodeError) as e:
+            raise ValueError(f"Malformed JSON message: {e}")
+    buffer = io.BytesIO(payload)
+    try:
+        record = fastavro.schemaless_reader(buffer, MESSAGE_SCHEMA)
+    except (EOFError, IndexError, StopIteration) as e:
+        raise ValueError(f"Malformed Avro message: {e!r}")
+    if buffer.tell() != len(payload):
+        raise ValueError(
+            f"Malformed Avro message: {len(payload) - buffer.tell()} trailing bytes"
+        )
+    return tuple(record[name] for name in FIELDS)
+
+
+def decode_batch(payloads):
+    """
+    Decode many messages into one structured array.
+    In larger batches Avro messages are decoded together, one field at a time
+    over the whole batch, JSON messages are always decoded one by one. Malformed messages are left out.
+    Args:
+        payloads (Sequence[bytes | str]): Message values.
+    Returns:
+        np.ndarray: Observations with dtype `OBSERVATION_DTYPE` in message
+            order, whose fields can be used as columns, e.g. `batch["temperature"]`.
+    """
+    batch = np.zeros(len(payloads), dtype=OBSERVATION_DTYPE)
+    valid = np.zeros(len(payloads), dtype=bool)
+    avro = []
+    # Vectorized decoding only pays off once its fixed cost is spread out
+    small = len(payloads) < _MIN_VECTORIZED_BATCH
+    for i, payload in enumerate(payloads):
+        if isinstance(payload, str) or payload[:1] == b"{" or small:
+            try:
+                batch[i] = decode(payload)
+                valid[i] = True
+            except ValueError as e:
+                logging.error(e)
+        else:
+            avro.append(i)
+    if avro:
+        avro = np.array(avro)
+        records, decoded = _decode_avro_batch([payloads[i] for i in avro])
+        batch[avro] = records
+        valid[avro] = decoded
+        for i in avro[~decoded]:
+            logging.error(f"Malformed Avro message: {payloads[i]!r}")
+    return batch[valid]
+
+
+def _decode_avro_batch(payloads):
+    lengths = np.fromiter(map(len, payloads), dtype=np.int64, count=len(payloads))
+    ends = np.cumsum(lengths)
+    position = ends - lengths
+    # Padding keeps reads past the end of a malformed last record in bounds
+    buffer = np.frombuffer(b"".join(payloads) + bytes(_MAX_RECORD_SIZE), np.uint8)
+    records = np.zeros(len(payloads), dtype=OBSERVATION_DTYPE)
+    decoded = np.ones(len(payloads), dtype=bool)
+    for name in FIELDS:
+        # Malformed records may have run far ahead, keep them in the buffer
+        np.minimum(position, ends, out=position)
+        if name in _FLOAT_FIELDS:
+            raw = buffer[position[:, None] + np.arange(4)]
+            records[name] = raw.view("<f4")[:, 0]
+            position += 4
+            continue
+        # Zigzag encoded varint, 7 bits per byte, least significant first
+        value = np.zeros(len(payloads), dtype=np.uint64)
+        reading = np.ones(len(payloads), dtype=bool)
+        for shift in range(0, 70, 7):
+            byte = buffer[position].astype(np.uint64)
+            value |= np.where(reading, (byte & 0x7F) << np.uint64(shift), 0)
+            position += reading
+            reading &= byte >= 0x80
+            if not reading.any():
+                break
+        decoded &= ~reading
+        records[name] = (value >> np.uint64(1)).astype(np.int64) ^ -(
+            value & np.uint64(1)
+        ).astype(np.int64)
+    decoded &= position == ends
+    return records, decoded
+
+
+def group_by_location(batch):
+    """
+    Split a batch into the observations of every location, in timestamp order.
+    Args:
+        batch (np.ndarray): Observations with dtype `OBSERVATION_DTYPE`.
+    Returns:
+        list[tuple[int, np.ndarray]]: Location id and its observations.
+    """
+    # lexsort is stable, so equal timestamps keep their arrival order
+    batch = batch[np.lexsort((batch["timestamp"], batch["id"]))]
+    bounds = np.flatnonzero(np.diff(batch["id"])) + 1
+    return [
+        (int(group["id"][0]), group) for group in np.split(batch, bounds) if len(group)
+    ]
@@ -0,0 +1,69 @@
+import logging
+import threading
+from queue import Queue
+
+_STOP = object()
+
+
+class KeyedWorkerPool:
+    """
+    Thread pool that keeps tasks with the same key in submission order.
+    Every key is hashed to a lane, a bounded queue drained by a single thread,
+    so tasks for one key never overlap while tasks for different keys run
+    concurrently. Submitting to a full lane blocks, which applies backpressure
+    to the producer instead of buffering without limit.
+    Args:
+        lanes (int): Number of worker threads.
+        lane_capacity (int): Maximum number of pending tasks per lane.
+    """
+
+    def __init__(self, lanes=4, lane_capacity=100):
+        self.queues = [Queue(maxsize=lane_capacity) for _ in range(lanes)]
+        self.threads = []
+
+    def start(self):
+        if self.threads:
+            return
+        for i, lane in enumerate(self.queues):
+            thread = threading.Thread(
+                target=self._work, args=(lane,), name=f"lane-{i}", daemon=True
+            )
+            thread.start()
+            self.threads.append(thread)
+
+    def lane_for(self, key):
+        return hash(key) % len(self.queues)
+
+    def submit(self, key, fn, *args):
+        self.start()
+        self.queues[self.lane_for(key)].put((fn, args))
+
+    def pending(self):
+        return sum(lane.qsize() for lane in self.queues)
+
+    def join(self):
+        """Block until every submitted task has been processed."""
+        for lane in self.queues:
+            lane.join()
+
+    def shutdown(self):
+        """Process the remaining tasks and stop the worker threads."""
+        for lane in self.queues:
+            lane.put(_STOP)
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+
+    def _work(self, lane):
+        while True:
+            task = lane.get()
+            try:
+                if task is _STOP:
+                    return
+                fn, args = task
+                try:
+                    fn(*args)
+                except Exception as e:
+                    logging.error(f"Error in {fn.__name__}: {e}")
+            finally:
+                lane.task_done()